@@ -0,0 +1,84 @@
+""" vast.py command line benchmarks: url building, cold start and a full command.
+
+    python bench/run.py cli
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from vastai import daemon
+from vastai.testing import generate_machines
+from vastai.vast import apiurl, parser, add_global_arguments, write_rows, machine_fields
+from common import make_client, start_server, src_dir
+
+vast_py = os.path.join(src_dir, "vastai", "vast.py")
+
+class Args:
+    url = "https://vast.ai/api/v0"
+    api_key = "a"*64
+
+def setup():
+    server = start_server(num_offers=1000)
+    server.add_instances(100)
+    env = dict(os.environ, PYTHONPATH=src_dir, VAST_NO_DAEMON="1")
+    socket_path = os.path.join(tempfile.mkdtemp(), "vast.sock")
+    daemon.start(socket_path)
+    daemon_env = dict(os.environ, PYTHONPATH=src_dir, VAST_DAEMON_SOCKET=socket_path)
+    machines = generate_machines(2000)
+    return dict(server=server, client=make_client(server), env=env, daemon_env=daemon_env, socket_path=socket_path,
+                machines=machines)
+
+def teardown(ctx):
+    daemon.control("stop", ctx["socket_path"])
+    ctx["server"].stop()
+
+def bench_apiurl(ctx):
+    """ 10k urls with a json query arg, as built by vast.py. """
+    for i in range(10000):
+        apiurl(Args, "/bundles", {"q": {"num_gpus": {"gte": i}, "order": [["score", "desc"]]}})
+
+def bench_client_apiurl(ctx):
+    """ 10k urls with a json query arg, as built by `VastClient`. """
+    client = ctx["client"]
+    for i in range(10000):
+        client._apiurl("/bundles", q={"num_gpus": {"gte": i}, "order": [["score", "desc"]]})
+
+def bench_build_parser(ctx):
+    """ 100 parser builds and parses of a `search offers` command line, as done by each cold start. """
+    add_global_arguments()
+    for i in range(100):
+        parser.parsers.clear()
+        parser.parse_args(["search", "offers", "num_gpus=%i"%i, "--raw"])
+
+def bench_cli_help(ctx):
+    """ Cold start of `vast.py --help`: interpreter start, imports and argparse setup. """
+    subprocess.check_call([sys.executable, vast_py, "--help"], env=ctx["env"], stdout=subprocess.DEVNULL)
+
+def bench_cli_show_instances(ctx):
+    """ Cold start plus one request: `vast.py show instances` with 100 instances. """
+    subprocess.check_call([sys.executable, vast_py, "show", "instances", "--url", ctx["server"].url,
+                           "--api-key", ctx["server"].api_key], env=ctx["env"], stdout=subprocess.DEVNULL)
+
+def bench_cli_show_instances_daemon(ctx):
+    """ `vast.py show instances` with 100 instances, forwarded to a running daemon. """
+    subprocess.check_call([sys.executable, vast_py, "show", "instances", "--url", ctx["server"].url,
+                           "--api-key", ctx["server"].api_key], env=ctx["daemon_env"], stdout=subprocess.DEVNULL)
+
+def bench_machines_json_dump(ctx):
+    """ 2000 machines as indented json, one dump per machine, as `show machines` used to print them. """
+    out = io.StringIO()
+    for machine in ctx["machines"]:
+        out.write("{id}: {json}\n".format(id=machine["id"], json=json.dumps(machine, indent=4, sort_keys=True)))
+
+def bench_machines_table(ctx):
+    """ 2000 machines as a `machine_fields` table. """
+    write_rows(ctx["machines"], machine_fields, out=io.StringIO())
+
+def bench_machines_ndjson(ctx):
+    write_rows(ctx["machines"], machine_fields, "ndjson", out=io.StringIO())
+
+def bench_machines_csv(ctx):
+    write_rows(ctx["machines"], machine_fields, "csv", out=io.StringIO())
@@ -0,0 +1,105 @@
+""" Instance refresh, formatting and lifecycle benchmarks against a local stand-in server.
+
+    python bench/run.py instances
+"""
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from vastai.guard import BudgetGuard, Budget, IdleRule
+from vastai.hooks import HookRegistry, HistogramCollector
+from vastai.telemetry import TelemetryStore, parse_sample
+from common import make_client, start_server
+
+fleet_size = 1000
+bulk_size = 50
+telemetry_fleet = 300
+telemetry_samples = 120
+
+def setup():
+    server = start_server(num_offers=fleet_size, stop_s=0, start_s=0)
+    ids = server.add_instances(fleet_size)
+    client = make_client(server)
+    client.get_instances()
+    hooked = make_client(server)
+    hooked.hooks = HookRegistry()
+    hooked.hooks.register(HistogramCollector())
+    hooked.get_instances()
+    guard = BudgetGuard(make_client(server), budgets=[Budget(1e6), Budget(1e4, per_hour=True)],
+                        idle_rules=[IdleRule(minutes=1e6)])
+    guard.check()
+    lines = ["S|%i|%i, 4000, 8000, 60;%i, 2000, 8000, 70;|cpu %i 0 0 %i 0 0 0|1000 250|30 120"%(t, t % 100, t % 50, t*3, t*5)
+             for t in range(1000000, 1000000 + telemetry_samples)]
+    telemetry = TelemetryStore()
+    for inst_id in ids[:telemetry_fleet]:
+        cpu = None
+        for line in lines:
+            t, values, cpu = parse_sample(line, cpu)
+            telemetry.add(inst_id, t, values)
+    uncoalesced = make_client(server)
+    uncoalesced.coalesce = False
+    return dict(server=server, client=client, hooked=hooked, uncoalesced=uncoalesced, guard=guard, bulk_ids=set(ids[:bulk_size]),
+                telemetry=telemetry, telemetry_line=lines[-1])
+
+def teardown(ctx):
+    ctx["server"].stop()
+
+def bench_get_instances_refresh(ctx):
+    """ Refreshes a fleet of 1000 already known instances. """
+    ctx["client"].get_instances()
+
+def bench_get_instances_refresh_hooked(ctx):
+    """ Same refresh with a `HistogramCollector` registered, to show the cost of instrumentation. """
+    ctx["hooked"].get_instances()
+
+def bench_refresh_instances(ctx):
+    """ Incremental refresh of 1000 known instances, reporting what changed. """
+    ctx["client"].refresh_instances()
+
+def bench_guard_check(ctx):
+    """ One `BudgetGuard` tick over 1000 instances with budgets and an idle rule, none of them broken. """
+    ctx["guard"].check()
+
+def bench_as_df(ctx):
+    """ `InstanceList.as_df` of 1000 instances with value formatting. """
+    ctx["client"].instances.as_df()
+
+def bench_as_df_raw(ctx):
+    ctx["client"].instances.as_df(columns=True, format_values=False)
+
+def bench_bulk_stop_start(ctx):
+    """ Stops and restarts 50 instances, one request at a time. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        for inst in ctx["client"].instances:
+            if inst.id in ctx["bulk_ids"]:
+                inst.stop()
+                inst.start()
+
+def bench_costs(ctx):
+    """ Fleet totals and per-GPU costs of 1000 instances, as recomputed on each poll tick. """
+    costs = ctx["client"].instances.costs()
+    costs.total(hours=24, plan={ctx["client"].instance_ids[0]: "stop"})
+    costs.by("gpu")
+
+def bench_telemetry_tick(ctx):
+    """ Parses and stores one telemetry sample from each of 300 instances. """
+    store, line = ctx["telemetry"], ctx["telemetry_line"]
+    for inst_id in store.instances():
+        t, values, _ = parse_sample(line)
+        store.add(inst_id, t, values)
+
+def bench_telemetry_summary(ctx):
+    """ p50/p90/p99 of every metric of 300 instances over their kept samples. """
+    ctx["telemetry"].summary()
+
+def _concurrent_get_instances(client, threads=8):
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda _: client.get_instances(), range(threads)))
+
+def bench_concurrent_get_instances(ctx):
+    """ 8 threads refreshing 1000 instances at once, sharing one request. """
+    _concurrent_get_instances(ctx["client"])
+
+def bench_concurrent_get_instances_uncoalesced(ctx):
+    """ Same, with request coalescing turned off. """
+    _concurrent_get_instances(ctx["uncoalesced"])
@@ -0,0 +1,97 @@
+""" Offer search, selection and display benchmarks against a local stand-in server.
+
+    python bench/run.py offers
+"""
+import contextlib
+import io
+import json
+
+from vastai import jsonlib, selection
+from vastai.api import OfferList, Machine
+from vastai.feed import OfferFeed
+from vastai.pricing import market_prices
+from vastai.snipe import OfferSniper, compile_predicate
+from vastai.testing import generate_machines
+from vastai.vast import display_table, displayable_fields
+from common import make_client, start_server
+
+num_offers = 20000
+
+def setup():
+    server = start_server(num_offers=num_offers)
+    client = make_client(server)
+    offers = client.search_offers(query="rentable=true")
+    # The next snapshot: 1% of offers gone, 1% repriced.
+    moved = [dict(o, dph_total=o["dph_total"]*1.1) if i % 100 == 1 else o for i, o in enumerate(offers) if i % 100]
+    feed = OfferFeed(client)
+    feed.update(offers)
+    sniper = OfferSniper(client, "num_gpus>=8 gpu_ram>=40000", max_price=.01, count=0)
+    machines = [Machine(client, **row) for row in generate_machines(50, start_id=10**6)]
+    body = json.dumps({"offers": offers}).encode("utf-8")
+    return dict(server=server, client=client, offers=offers, moved=moved, feed=feed, sniper=sniper, machines=machines,
+                body=body,
+                predicate=compile_predicate("num_gpus>=4 gpu_name in [RTX_3090, A100_SXM4] reliability>0.95"))
+
+def teardown(ctx):
+    ctx["server"].stop()
+    jsonlib.use()
+
+def bench_search_offers(ctx):
+    """ Full `/bundles` round trip and `OfferList` construction for 20k offers. """
+    ctx["client"].search_offers(query="rentable=true")
+
+def bench_offer_list(ctx):
+    """ `OfferList` construction alone. """
+    OfferList(ctx["offers"])
+
+def bench_pareto_front(ctx):
+    selection.pareto_front(ctx["offers"])
+
+def bench_top_k(ctx):
+    selection.top_k(ctx["offers"], 10)
+
+def bench_display_table(ctx):
+    """ Table rendering of 20k offers, as `search offers` prints it. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        display_table(ctx["offers"], displayable_fields)
+
+def bench_offer_feed_update(ctx):
+    """ Diffs two snapshots of 20k offers, as `OfferFeed` does on each poll. """
+    feed = ctx["feed"]
+    feed.update(ctx["moved"])
+    feed.update(ctx["offers"])
+
+def bench_compile_predicate_match(ctx):
+    """ A compiled offer query applied to 20k offers. """
+    predicate = ctx["predicate"]
+    [o for o in ctx["offers"] if predicate(o)]
+
+def bench_snipe_poll(ctx):
+    """ One `OfferSniper` poll of 20k offers with a narrow query and a `limit`. """
+    sniper = ctx["sniper"]
+    sniper._last_body = None
+    sniper.poll()
+
+def bench_market_prices(ctx):
+    """ Competitor price percentiles for 50 host machines against 20k offers. """
+    market_prices(ctx["machines"], ctx["offers"])
+
+def bench_json_loads_stdlib(ctx):
+    """ Decoding a 20k offer `/bundles` response with the standard library. """
+    jsonlib.use("json")
+    jsonlib.loads(ctx["body"])
+
+def bench_json_loads_fast(ctx):
+    """ The same with the fastest installed backend (orjson if installed). """
+    jsonlib.use()
+    jsonlib.loads(ctx["body"])
+
+def bench_json_raw_dumps_stdlib(ctx):
+    """ `search offers --raw` encoding of 20k offers with the standard library. """
+    jsonlib.use("json")
+    jsonlib.dumps(ctx["offers"], indent=1, sort_keys=True)
+
+def bench_json_raw_dumps_fast(ctx):
+    """ The same with the fastest installed backend. """
+    jsonlib.use()
+    jsonlib.dumps(ctx["offers"], indent=1, sort_keys=True)
@@ -0,0 +1,36 @@
+""" Micro-benchmarks for `vastai.vast.parse_query`.
+
+    python bench/run.py parse_query
+"""
+import random
+
+from vastai.vast import parse_query
+
+fields = ["num_gpus", "gpu_ram", "dph", "reliability", "cuda_vers", "inet_down", "cpu_ram", "total_flops"]
+ops = [">", ">=", "<", "<=", "=", "!="]
+
+def make_queries(n, seed=0):
+    """ Generates `n` distinct queries shaped like the ones a search optimizer produces.
+    """
+    rnd = random.Random(seed)
+    queries = []
+    for i in range(n):
+        terms = ["%s%s%s"%(f, rnd.choice(ops), round(rnd.uniform(0, 100), 2)) 
+                 for f in rnd.sample(fields, 4)]
+        terms.append("gpu_name in [RTX_3090, A100_%i]"%i)
+        queries.append(" ".join(terms))
+    return queries
+
+def setup():
+    return dict(unique=make_queries(10000), repeated=make_queries(1000)*10)
+
+def bench_parse_query_unique(ctx):
+    """ 10k queries, each one new, so every call tokenizes. """
+    parse_query.cache_clear()
+    for q in ctx["unique"]:
+        parse_query(q)
+
+def bench_parse_query_repeated(ctx):
+    """ 1k queries parsed 10 times each, mostly served from the cache. """
+    for q in ctx["repeated"]:
+        parse_query(q)
@@ -0,0 +1,40 @@
+""" Helpers shared by the benchmark modules. """
+import contextlib
+import io
+import os
+import time
+
+import requests
+
+from vastai.api import VastClient
+from vastai.testing import LocalVastServer
+
+src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+def make_client(server):
+    """ A `VastClient` authenticated against a `vastai.testing.LocalVastServer`. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def start_server(**kwargs):
+    """ Starts a `LocalVastServer`, checking that requests to it only take a few milliseconds,
+        so benchmarks measure the client rather than the stand-in's connection handling.
+    """
+    server = LocalVastServer(**kwargs).start()
+    if server.latency_s or server.jitter_s:
+        return server
+    with requests.Session() as session:
+        url = server.url + "/users/current/?api_key=" + server.api_key
+        session.get(url)
+        times = []
+        for _ in range(20):
+            start = time.perf_counter()
+            session.get(url)
+            times.append(time.perf_counter() - start)
+    median = sorted(times)[len(times)//2]
+    if median > .005:
+        server.stop()
+        raise AssertionError("Loopback round trips to the stand-in server take %.1f ms, expected a few."%(median*1e3))
+    return server
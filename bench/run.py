@@ -0,0 +1,121 @@
+""" Runs the benchmark suite and records results in a machine-readable history.
+
+    python bench/run.py                      # all benchmarks
+    python bench/run.py parse_query offers   # only bench_parse_query.py and bench_offers.py
+    python bench/run.py -k refresh           # only benchmarks with 'refresh' in their name
+
+Each `bench/bench_*.py` module may define `setup()`, which returns a context passed to
+each of its `bench_*(ctx)` functions, and `teardown(ctx)`. Each benchmark is timed with
+`timeit`, keeping the best of `--repeat` runs. Results are appended to the history file,
+`bench/history.jsonl` by default (ignored by git, since it's specific to the machine),
+as one JSON object per line, and compared with the last recorded run.
+"""
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(bench_dir)
+sys.path[:0] = [os.path.join(root_dir, "src"), bench_dir]
+
+default_history = os.path.join(bench_dir, "history.jsonl")
+
+def version_info():
+    """ Identifies the code being benchmarked: package version, git commit and python version.
+    """
+    try:
+        from importlib.metadata import version
+        pkg_version = version("vastai")
+    except Exception:
+        pkg_version = None
+    try:
+        commit = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=root_dir,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(version=pkg_version, commit=commit, python=platform.python_version(), machine=platform.node())
+
+def run_module(name, filter_str=None, repeat=5):
+    """ Runs the benchmarks of one `bench_*.py` module.
+    Returns:
+        dict: best seconds per call, keyed by `module.function`
+    """
+    module = importlib.import_module(name)
+    benches = [getattr(module, f) for f in dir(module) if f.startswith("bench_") and callable(getattr(module, f))]
+    benches = [b for b in benches if not filter_str or filter_str in b.__name__]
+    if not benches:
+        return {}
+    ctx = module.setup() if hasattr(module, "setup") else None
+    results = {}
+    try:
+        for bench in sorted(benches, key=lambda b: b.__code__.co_firstlineno):
+            number = getattr(bench, "number", 1)
+            best = min(timeit.repeat(lambda: bench(ctx), number=number, repeat=repeat)) / number
+            results["%s.%s"%(name[len("bench_"):], bench.__name__[len("bench_"):])] = best
+            print("%-45s %12.3f ms"%(name[len("bench_"):] + "." + bench.__name__[len("bench_"):], best*1e3))
+            sys.stdout.flush()
+    finally:
+        if hasattr(module, "teardown"):
+            module.teardown(ctx)
+    return results
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(results, previous, threshold):
+    """ Prints benchmarks which got more than `threshold` (fractional) slower or faster.
+    Returns:
+        int: number of regressions
+    """
+    regressions = 0
+    for name, seconds in sorted(results.items()):
+        before = previous["results"].get(name)
+        if not before:
+            continue
+        change = seconds/before - 1
+        if abs(change) >= threshold:
+            regressions += change > 0
+            print("%-45s %+7.1f%%  (%.3f ms -> %.3f ms)%s"%(name, change*100, before*1e3, seconds*1e3,
+                                                           "  REGRESSION" if change > 0 else ""))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run vastai benchmarks.")
+    parser.add_argument("modules", nargs="*", help="benchmark modules to run, e.g. 'offers' for bench_offers.py")
+    parser.add_argument("-k", dest="filter", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per benchmark, best is kept. default: 5")
+    parser.add_argument("--history", default=default_history, help="JSON lines history file. default: bench/history.jsonl")
+    parser.add_argument("--no-save", action="store_true", help="don't append results to the history")
+    parser.add_argument("--threshold", type=float, default=.1, help="relative change reported as a regression. default: 0.1")
+    args = parser.parse_args(argv)
+
+    names = ["bench_" + m.replace("bench_", "").replace(".py", "") for m in args.modules] or \
+            sorted(os.path.basename(p)[:-3] for p in glob.glob(os.path.join(bench_dir, "bench_*.py")))
+    results = {}
+    for name in names:
+        results.update(run_module(name, args.filter, args.repeat))
+
+    history = load_history(args.history)
+    previous = next((run for run in reversed(history) if set(run["results"]) & set(results)), None)
+    regressions = 0
+    if previous is not None:
+        print("\nCompared with %s (%s):"%(previous.get("commit"), time.strftime("%Y-%m-%d %H:%M", time.localtime(previous["time"]))))
+        regressions = compare(results, previous, args.threshold)
+    if not args.no_save and results:
+        run = dict(time=time.time(), repeat=args.repeat, results=results, **version_info())
+        with open(args.history, "a") as f:
+            f.write(json.dumps(run, sort_keys=True) + "\n")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,10 +17,11 @@ setup(
     #entry_points = {
     #    'console_scripts':['foobar=vastai.foobar:main'],
     #},
-    install_requires = [ 'paramiko', 'pandas', 'requests' ],
+    install_requires = [ 'numpy', 'paramiko', 'pandas', 'requests' ],
     tests_require = test_deps,
     extras_require = {
         'docs': ['pdoc3'],
+        'fast': ['orjson'],
         'tests': test_deps,
     },
     setup_requires = [ 'pytest-runner>=2.0,<3dev' ],
@@ -2,15 +2,24 @@
 import os
 import requests
 import json
+import re
 from requests.exceptions import HTTPError
 from urllib.parse import quote_plus
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from paramiko.client import SSHClient, AutoAddPolicy
 from paramiko.ssh_exception import NoValidConnectionsError
 from paramiko import RSAKey
 import sys
-from vastai.exceptions import InstanceError, Unauthorized, PrivateSshKeyNotFound, UnhandledSetupError
-from vastai.vast import displayable_fields, instance_fields, parse_query
+from vastai.exceptions import InstanceError, MachineError, Unauthorized, ApiKeyNotSet, PrivateSshKeyNotFound, UnhandledSetupError
+from vastai.vast import displayable_fields, instance_fields, parse_query, parse_order
+from vastai import selection
+from vastai import jsonlib
+from vastai.timeline import LaunchTimeline
+from vastai.costs import FleetCosts
+from vastai import hooks as _hooks
+from vastai.hooks import endpoint_name
 import pandas as pd
 import time
 from plumbum.machines.paramiko_machine import ParamikoMachine
@@ -22,6 +31,23 @@ default_api_key_file = os.path.join('~','.vast_api_key')
 default_ssh_key_dir = os.path.join('~','.ssh')
 api_base_url = "https://vast.ai/api/v0"
 
+InstanceDiff = namedtuple('InstanceDiff', ['added', 'removed', 'changed'])
+""" Returned by `VastClient.refresh_instances`: lists of `added` and `removed` `Instance`s, and `changed`,
+    a dict of `{instance id: {field: (old value, new value)}}` for instances which were already known. """
+
+volatile_fields = ('duration',)
+""" Instance fields which change on every request, left out of `InstanceDiff.changed`. """
+
+_volatile_re = re.compile(('"(?:%s)"\\s*:\\s*(?:null|[-+.0-9eE]+)'%"|".join(volatile_fields)).encode("utf-8"))
+
+def _stable_body(content):
+    """ An `/instances` response body without its `volatile_fields`, to tell whether anything else changed. """
+    return _volatile_re.sub(b"", content)
+
+BulkResult = namedtuple('BulkResult', ['succeeded', 'failed'])
+""" Returned by `MachineList` bulk operations: `succeeded`, a list of machine ids, and `failed`, a dict of 
+    `{machine id: exception}`. """
+
 class VastClient:
     """
     # Vast.ai API Client  
@@ -29,7 +55,8 @@ class VastClient:
     By default, looks for `VAST_API_KEY` env variable or `~/.vast_api_key` for existing credentials.
     If `api_key_file` is explicitly set to None then the API key won't be written to disk. 
     """
-    def __init__(self, api_key_file=default_api_key_file, ssh_key_dir=default_ssh_key_dir):
+    def __init__(self, api_key_file=default_api_key_file, ssh_key_dir=default_ssh_key_dir, api_url=api_base_url,
+                 hooks=None, cache=None, coalesce=True):
         """
         Initialize VastClient object.  
         Args:
@@ -37,14 +64,48 @@ class VastClient:
                 (default "~/.vast_api_key") Will not save to disk if this is set to None or False.
             ssh_key_dir (str, optional): Path to directory containing ssh key for connecting to vast.ai 
                 instances. (default: ~/.ssh/)
+            api_url (str, optional): Base url of the REST api, e.g. a `vastai.testing.LocalVastServer` url.
+                (default: `api_base_url`)
+            hooks (vastai.hooks.HookRegistry, optional): Registry notified of each api request, ssh command,
+                tunnel and status check. (default: `vastai.hooks.hooks`)
+            cache (str, bool or vastai.cache.StateCache, optional): Keep the last `/instances` and `/bundles`
+                responses in this `StateCache`, or in a `StateCache` at this path. Pass True for the default
+                path. `self.instances` starts out as the cached instances. (default: no cache)
+            coalesce (bool): Share identical GET requests made at the same time by several threads: 
+                while a request is in flight, others for the same url wait for its response instead 
+                of sending their own. (default: True)
         """
+        self.api_url = api_url
+        self.hooks = _hooks.hooks if hooks is None else hooks
+        # One session for all requests, so connections are reused. Sized for `create_instances` workers.
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+        self.coalesce = coalesce
+        self.coalesced = Counter()
+        """ Number of GET requests per endpoint which were served by an identical request already in flight. """
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
         self.api_key_file = os.path.expanduser(api_key_file) if api_key_file else None
         print("api_key_file: ",api_key_file)
         self.ssh_key_dir = os.path.expanduser(ssh_key_dir) 
         self.ssh_key = None
         self.api_key = None
         self.instance_ids = []
-        self.instances = []
+        self.instances = InstanceList()
+        self._instance_index = {}
+        self._instance_rows = {}
+        self._instances_body = None
+        self._merge_lock = threading.Lock()
+        self.machines = MachineList()
+        self._machine_index = {}
+        self.refresh_listeners = []
+        """ Callables passed the `InstanceDiff` of each refresh of `self.instances` which changed something. """
+        self.timeline = LaunchTimeline()
+        self.cache = None
+        if cache:
+            from vastai.cache import StateCache
+            self.cache = cache if isinstance(cache, StateCache) else StateCache(None if cache is True else cache)
         if 'VAST_API_KEY' in os.environ: 
             print("Initializing vast.ai client with api_key from VAST_API_KEY env var.")
             self.api_key = os.environ['VAST_API_KEY']
@@ -55,8 +116,17 @@ class VastClient:
         else:
             print("No api_key set. Call `login` to retrieve%s."%\
                  ((" and save in "+self.api_key_file) if self.api_key_file else ""))
+        if self.cache is not None:
+            cached = self.cache.load("instances", self._cache_key())
+            if cached is not None:
+                self._merge_instances(cached[0])
             
 
+    def _cache_key(self, key=""):
+        """ Key of a response in `self.cache`, for this client's api url and key. """
+        from vastai.cache import scoped_key
+        return scoped_key(self.api_url, self.api_key, key)
+
     def authenticate(self, username=None, password=None):
         """
         Get api_key using username and password.
@@ -96,11 +166,11 @@ class VastClient:
         try:
             url = self._apiurl("/users/current/")
             if self.api_key:
-                r = requests.get(url) 
+                r = self._http('get', url)
             else:
-                r = requests.put(url, json={'username': username, 'password': password} )
+                r = self._http('put', url, json={'username': username, 'password': password} )
             r.raise_for_status()
-            resp = r.json()
+            resp = self._json(r)
             # print("Login response:\n",json.dumps(resp))
             for key in resp.keys():
                 setattr(self, key, resp[key])
@@ -159,8 +229,11 @@ class VastClient:
         return public_key_file
 
         
-    def get_instances(self, retries=2, retry_delay_s=5):
+    def get_instances(self, retries=2, retry_delay_s=5, max_age_s=None):
         """ Retrieves a list of user's configured instances.
+        Args:
+            max_age_s (float, optional): Use the instances in `self.cache` instead, if they were 
+                retrieved less than this many seconds ago. (default: always request them)
         Raises:
             `vastai.exceptions.ApiKeyNotSet`: If `self.api_key` is not set. 
         Returns:
@@ -168,47 +241,159 @@ class VastClient:
         """
         if self.api_key is None: raise ApiKeyNotSet()
         
+        if max_age_s is not None and self.cache is not None:
+            cached = self.cache.load("instances", self._cache_key(), max_age_s=max_age_s)
+            if cached is not None:
+                self._merge_instances(cached[0])
+                self._instances_body = None
+                return self.instances
+        r = self._fetch_instances(retries, retry_delay_s)
+        rows = self._json(r)["instances"]
+        if self.cache is not None:
+            self.cache.store("instances", rows, self._cache_key())
+        self._merge_instances(rows)
+        self._instances_body = _stable_body(r.content)
+        return self.instances
+
+    def refresh_instances(self, retries=2, retry_delay_s=5):
+        """ Refreshes `self.instances` like `get_instances`, and reports what changed since the last refresh.
+            Uses one request. If nothing but `volatile_fields` changed since the last response, it isn't
+            decoded at all, so polling an unchanged fleet stays cheap however large it is. Those fields
+            then keep their previous values.
+        Raises:
+            `vastai.exceptions.ApiKeyNotSet`: If `self.api_key` is not set. 
+        Returns:
+            InstanceDiff: Instances added, removed and changed since the last refresh.
+        """
+        if self.api_key is None: raise ApiKeyNotSet()
+        r = self._fetch_instances(retries, retry_delay_s)
+        body = _stable_body(r.content)
+        if body == self._instances_body:
+            return InstanceDiff([], [], {})
+        rows = self._json(r)["instances"]
+        if self.cache is not None:
+            self.cache.store("instances", rows, self._cache_key())
+        diff = self._merge_instances(rows)
+        self._instances_body = body
+        return diff
+
+    def _fetch_instances(self, retries, retry_delay_s):
+        """ Requests `/instances`, retrying failed requests.
+        Returns:
+            requests.Response
+        """
         req_url = self._apiurl("/instances", owner="me")
-        try:
-            r = requests.get(req_url)
-            r.raise_for_status()
-            resp = r.json()
-        except HTTPError:
-            if retries>0:
-                time.sleep(retry_delay_s)
-                return self.get_instances(retries=retries-1, 
-                                          retry_delay_s=retry_delay_s)
-            raise
-        # Merge with existing Instances
-        for instance_latest in resp["instances"]:
-            if instance_latest['id'] in self.instance_ids: 
-                # merge with existing
-                instance_idx = self.instance_ids.index(instance_latest['id'])
-                instance = self.instances[instance_idx]
-                for field in self.instances[instance_idx].fields:
-                    setattr(instance, field, instance_latest[field])
-                instance.status=instance_latest['actual_status']
-            else:
-                self.instances.append(Instance(self, **instance_latest))
-                self.instance_ids.append(instance_latest['id'])
+        attempt = 0
+        while True:
+            try:
+                r = self._http('get', req_url, retries=attempt)
+                r.raise_for_status()
+                break
+            except HTTPError:
+                if attempt<retries:
+                    attempt += 1
+                    time.sleep(retry_delay_s)
+                    continue
+                raise
+        return r
 
-        return self.instances
+    def _merge_instances(self, rows):
+        """ Merges instance data from `/instances` with existing Instances, dropping any that are no longer listed,
+            and notifies `refresh_listeners` of what changed.
+        Returns:
+            InstanceDiff: what changed. `self.instances` holds the merged instances.
+        """
+        with self._merge_lock:
+            diff = self._merge_rows(rows)
+        if diff.added or diff.removed or diff.changed:
+            for listener in list(self.refresh_listeners):
+                listener(diff)
+        return diff
+
+    def _merge_rows(self, rows):
+        index = {}
+        added, changed = [], {}
+        for instance_latest in rows:
+            instance = self._instance_index.get(instance_latest['id'])
+            previous = self._instance_rows.get(instance_latest['id'])
+            if instance is None:
+                instance = Instance(self, **instance_latest)
+                added.append(instance)
+            elif previous != instance_latest:
+                changes = {k: (previous.get(k), v) for k, v in instance_latest.items() 
+                           if k not in volatile_fields and previous.get(k) != v}
+                if changes:
+                    changed[instance.id] = changes
+                instance._update(instance_latest)
+            index[instance.id] = instance
+            self.timeline.observe(instance)
+        removed = [inst for inst_id, inst in self._instance_index.items() if inst_id not in index]
+        self._instance_index = index
+        self._instance_rows = {row['id']: row for row in rows}
+        self.instances = InstanceList(index.values())
+        self.instance_ids = list(index.keys())
+
+        return InstanceDiff(added, removed, changed)
     
     def get_instance(self, id, retries=0, retry_delay_s=15):
         """ Get a configured `Instance` by id.
         Args:
             id (str): vast.ai instance id.
         Returns:
-            Instance
+            Instance: or None if no instance with this id exists.
         """
         self.get_instances()
-        idx = self.instance_ids.index(id)
-        instance = self.instances[idx] if idx >= 0 else None
+        instance = self._instance_index.get(id)
         if instance is None and retries>0:
             time.sleep(retry_delay_s)
-            return get_instance(id, retries=retries-1, retry_delay_s=retry_delay_s)
+            return self.get_instance(id, retries=retries-1, retry_delay_s=retry_delay_s)
         return instance
 
+    def get_machines(self, max_age_s=None):
+        """ Retrieves the user's host machines.
+        Args:
+            max_age_s (float, optional): Use the machines in `self.cache` instead, if they were 
+                retrieved less than this many seconds ago. (default: always request them)
+        Raises:
+            `vastai.exceptions.ApiKeyNotSet`: If `self.api_key` is not set. 
+        Returns:
+            MachineList: A list of the user's `Machine`s.
+        """
+        if self.api_key is None: raise ApiKeyNotSet()
+
+        rows = None
+        if max_age_s is not None and self.cache is not None:
+            cached = self.cache.load("machines", self._cache_key(), max_age_s=max_age_s)
+            if cached is not None:
+                rows = cached[0]
+        if rows is None:
+            resp = self._http('get', self._apiurl("/machines", owner="me"))
+            resp.raise_for_status()
+            rows = self._json(resp)["machines"]
+            if self.cache is not None:
+                self.cache.store("machines", rows, self._cache_key())
+        index = {}
+        for row in rows:
+            machine = self._machine_index.get(row['id'])
+            if machine is None:
+                machine = Machine(self, **row)
+            else:
+                machine._update(row)
+            index[machine.id] = machine
+        self._machine_index = index
+        self.machines = MachineList(index.values())
+        return self.machines
+
+    def get_machine(self, id):
+        """ Get a host `Machine` by id.
+        Args:
+            id (int): vast.ai machine id.
+        Returns:
+            Machine: or None if no machine with this id exists.
+        """
+        self.get_machines()
+        return self._machine_index.get(id)
+
     def get_running_instances(self):
         return [inst for inst in self.get_instances() if inst.status=='running']
 
@@ -237,6 +422,29 @@ class VastClient:
             `vastai.exceptions.ApiKeyNotSet`: if `client.api_key` isn't set. 
         """
         if self.api_key is None: raise ApiKeyNotSet()
+        req_url, req_json = self._create_instance_request(offer_id, price=price, disk=disk, image=image, 
+                                label=label, onstart=onstart, onstart_cmd=onstart_cmd, jupyter=jupyter, 
+                                jupyter_dir=jupyter_dir, jupyter_lab=jupyter_lab, lang_utf8=lang_utf8, 
+                                python_utf8=python_utf8, create_from=create_from, force=force)
+        print(req_url, '\n', jsonlib.dumps(req_json))
+        requested = time.time()
+        resp = self._http('put', req_url, json=req_json)
+        resp.raise_for_status()
+        resp_data = self._json(resp)
+        print(jsonlib.dumps(resp_data))
+        if isinstance(resp_data, dict) and resp_data.get('success'):
+            self.timeline.record(resp_data['new_contract'], 'requested', requested)
+            self.timeline.record(resp_data['new_contract'], 'accepted')
+        # TODO: Add a listener for running status.
+        return resp_data
+
+    def _create_instance_request(self, offer_id, price=None, disk=1, image="tensorflow/tensorflow:nightly-gpu-py3", 
+                                 label=None, onstart=None, onstart_cmd=None, jupyter=False, jupyter_dir=None, 
+                                 jupyter_lab=False, lang_utf8=False, python_utf8=False, create_from=None, force=False):
+        """ Builds the url and json body for a `/asks/{offer_id}/` request. See `create_instance` for args.
+        Returns:
+            tuple: (url, json data)
+        """
         if onstart is not None:
             #if not os.path.isfile(onstart):
             #    raise FileNotFoundError
@@ -249,16 +457,134 @@ class VastClient:
                          python_utf8=python_utf8, lang_utf8=lang_utf8,
                          use_jupyter_lab=jupyter_lab, jupyter_dir=jupyter_dir,
                          create_from=create_from, force=force )
-        print(req_url, '\n', json.dumps(req_json))
-        resp = requests.put(req_url, json=req_json)
-        resp.raise_for_status()
-        print(json.dumps(resp.json()))
-        resp_data = resp.json()
-        # TODO: Add a listener for running status.
-        return resp_data
+        return req_url, req_json
+
+    def create_instances(self, offers, count, wait=False, max_workers=8, check_every_s=30, timeout=900, 
+                         **create_kwargs):
+        """ Rents up to `count` instances from a ranked list of offers, several at a time.
+            Offers are tried in order. When an offer has been taken by someone else (or 
+            can't be rented for any other reason) the next offer in the list is tried instead.
+        Args:
+            offers (list): Offers to rent, best first. An `OfferList`, or a list of offer ids.
+            count (int): Number of instances to create.
+            wait (bool): Wait until all new instances are running. (default: False)
+            max_workers (int): Maximum number of concurrent `/asks/{id}/` requests. (default: 8)
+            check_every_s (float): If `wait`, seconds between status checks. (default: 30)
+            timeout (float): If `wait`, seconds to wait before raising `TimeoutError`. (default: 900)
+            **create_kwargs: Passed to `create_instance`, e.g. `image`, `disk`, `label`, `price`. 
+        Raises:
+            `vastai.exceptions.ApiKeyNotSet`: if `client.api_key` isn't set. 
+            `vastai.exceptions.Unauthorized`: if the api key is rejected. No more offers are tried, and
+                the instances already created are in the error's `contracts` dict.
+        Returns:
+            dict: `Instance`s keyed by new contract id, in the order they were created. Has fewer 
+                than `count` entries if the offers ran out.
+        """
+        if self.api_key is None: raise ApiKeyNotSet()
+        candidates = iter([offer['id'] if isinstance(offer, dict) else offer for offer in offers])
+        contracts = OrderedDict()
+        failures = OrderedDict()
+        in_flight = [0]
+        fatal = []
+        lock = threading.Lock()
+
+        def rent_next():
+            while True:
+                with lock:
+                    if fatal or len(contracts) + in_flight[0] >= count:
+                        return
+                    offer_id = next(candidates, None)
+                    if offer_id is None:
+                        return
+                    in_flight[0] += 1
+                contract, error = None, None
+                try:
+                    req_url, req_json = self._create_instance_request(offer_id, **create_kwargs)
+                    requested = time.time()
+                    resp = self._http('put', req_url, json=req_json)
+                    if resp.status_code in (401, 403):
+                        raise Unauthorized("Error creating instance from offer %s."%offer_id)
+                    resp.raise_for_status()
+                    resp_data = self._json(resp)
+                    if resp_data.get('success'):
+                        contract = resp_data['new_contract']
+                        self.timeline.record(contract, 'requested', requested)
+                        self.timeline.record(contract, 'accepted')
+                    else:
+                        error = resp_data.get('msg', resp_data)
+                except (requests.RequestException, ValueError) as err:
+                    error = err
+                except Exception as err:
+                    # e.g. Unauthorized: stop every worker, but still hand back what was rented.
+                    error = err
+                    with lock:
+                        fatal.append(err)
+                finally:
+                    with lock:
+                        in_flight[0] -= 1
+                        if contract is not None:
+                            contracts[contract] = offer_id
+                        else:
+                            failures[offer_id] = error
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, count))) as pool:
+            for future in [pool.submit(rent_next) for _ in range(max(1, min(max_workers, count)))]:
+                future.result()
+        for offer_id, error in failures.items():
+            print("Offer %s unavailable: %s"%(offer_id, error))
+        print("Created %i of %i instances from %i offers."%(len(contracts), count, len(contracts)+len(failures)))
+        if fatal:
+            fatal[0].contracts = OrderedDict((contract, self._instance_index.get(contract) or
+                                              Instance(self, id=contract, actual_status=None, status_msg=None))
+                                             for contract in contracts)
+            raise fatal[0]
+
+        self.get_instances()
+        instances = OrderedDict()
+        for contract in contracts:
+            instances[contract] = self._instance_index.get(contract) or \
+                                  Instance(self, id=contract, actual_status=None, status_msg=None)
+        if wait and instances:
+            self.wait_until_all(instances, 'running', check_every_s=check_every_s, timeout=timeout)
+        return instances
+
+    def wait_until_all(self, instances, target_status='running', check_every_s=30, timeout=900):
+        """ Waits until every instance in `instances` has `target_status`, using one 
+            `get_instances` request per check no matter how many instances are waited on.
+        Args:
+            instances (dict or list): `Instance`s, or a dict with `Instance` values such as the one 
+                returned by `create_instances`. Dict values are replaced by the refreshed `Instance`s.
+            target_status (str or list of str): Status, or list of statuses, to wait for. (default: 'running')
+            check_every_s (float): Seconds between status checks. (default: 30)
+            timeout (float): Seconds to wait before raising `TimeoutError`. (default: 900)
+        Raises:
+            `vastai.exceptions.UnhandledSetupError`: if an instance fails to set up.
+            TimeoutError: if not all instances reach `target_status` within `timeout`.
+        Returns:
+            list: The refreshed `Instance`s.
+        """
+        pending = instances if isinstance(instances, dict) else OrderedDict((inst.id, inst) for inst in instances)
+        start_time = time.time()
+        iteration = 0
+        while True:
+            with self.hooks.span('wait', 'wait_until_all', iteration=iteration, instances=len(pending)) as event:
+                self.get_instances()
+                for inst_id in pending:
+                    pending[inst_id] = self._instance_index.get(inst_id, pending[inst_id])
+                waiting = [inst.id for inst in pending.values() if not inst._has_status(target_status)]
+                event.status = len(pending) - len(waiting)
+            iteration += 1
+            if not waiting:
+                return list(pending.values())
+            if time.time()-start_time >= timeout:
+                raise TimeoutError("Checked every %i seconds, but instances %s never reached status %s."%(
+                                   check_every_s, waiting, str(target_status)))
+            print("Waiting for %i of %i instances. Checking again in %ss..."%(len(waiting), len(pending), check_every_s))
+            time.sleep(check_every_s)
 
     def search_offers(self, sort_order='score-', query=None, instance_type='on-demand', 
-                      no_default=True, disable_bundling=False ):
+                      no_default=True, disable_bundling=False, pareto=None, top_k=None, weights=None, 
+                      max_age_s=None):
         """ Search for available machines to bid on. 
         Args:
             order (str): Comma-separated list of fields to sort on. Postfix field with `-` to sort descending.
@@ -267,6 +593,13 @@ class VastClient:
             query (str): Query to search for. default: 'external=false rentable=true verified=true
             storage (float): amount of storage to use for pricing, in GiB. (default: 5.0GiB)
             disable_bundling (bool): Show identical offers. This request is more heavily rate limited. (default: False)
+            pareto (bool or str, optional): Keep only Pareto-optimal offers. Pass True to use 
+                         `vastai.selection.default_objectives` or objectives like `dph_total,dlperf-`.
+            top_k (int, optional): Keep only the best `top_k` offers, ranked by `weights`.
+            weights (str or dict, optional): Field weights used to rank offers, e.g. `dph=-2,dlperf=1`. 
+                         See `vastai.selection.parse_weights`.
+            max_age_s (float, optional): Use the offers cached in `self.cache` for the same search instead, 
+                         if they were retrieved less than this many seconds ago. (default: always request them)
         Raises:
             `vastai.exceptions.ApiKeyNotSet`: if `client.api_key` isn't set. 
         Returns: 
@@ -274,8 +607,6 @@ class VastClient:
         """
         if self.api_key is None: raise ApiKeyNotSet()
         
-        field_alias = dict(cuda_vers = "cuda_max_good", reliability = "reliability2", dlperf_usd = "dlperf_per_dphtotal",
-                           dph = "dph_total", flops_usd = "flops_per_dphtotal" )
         if no_default:
             query_args = {}
         else:
@@ -285,27 +616,28 @@ class VastClient:
             query_args = parse_query(query, query_args)
         #for k,q in query_args.items():
         #    print("%10s: %s"%(k, q));
-        order = []
-        for name in sort_order.split(","):
-            name = name.strip()
-            if not name: continue
-            direction = "asc"
-            if name.strip("-") != name:
-                direction = "desc"
-            field = name.strip("-");
-            if field in field_alias:
-                field = field_alias[field];
-            order.append([field, direction])
-
-        query_args["order"] = order
+        query_args["order"] = parse_order(sort_order)
         query_args["type"]  = instance_type
         if disable_bundling:
             query_args["disable_bundling"] = True
 
-        req_url = self._apiurl("/bundles", q=query_args)
-        resp = requests.get(req_url);
-        resp.raise_for_status()
-        offer_list = OfferList(resp.json()["offers"])
+        cached = None
+        if self.cache is not None:
+            from vastai.cache import offers_key
+            if max_age_s is not None:
+                cached = self.cache.load("offers", self._cache_key(offers_key(query_args)), max_age_s=max_age_s)
+        if cached is not None:
+            offers = cached[0]
+        else:
+            req_url = self._apiurl("/bundles", q=query_args)
+            resp = self._http('get', req_url)
+            resp.raise_for_status()
+            offers = self._json(resp)["offers"]
+            if self.cache is not None:
+                self.cache.store("offers", offers, self._cache_key(offers_key(query_args)))
+        offer_list = OfferList(offers)
+        if pareto or top_k is not None or weights is not None:
+            offer_list = offer_list.select(pareto=pareto, k=top_k, weights=weights)
         return offer_list
 
     def stop_all_instances(self):
@@ -314,6 +646,64 @@ class VastClient:
         for inst in self.get_instances():
             inst.stop()
         
+    def _http(self, method, url, retries=0, **kwargs):
+        """ Sends a request using `self.session`. Emits an 'http' `vastai.hooks.CallEvent` if any hooks 
+            are registered. If `self.coalesce`, a GET for a url which is already being requested by 
+            another thread waits for that request and returns its response (or raises its error).
+        Args:
+            method (str): HTTP request method.
+            url (str): Request URL, e.g. from `_apiurl`.
+            retries (int): Number of earlier attempts of this request, reported to hooks. (default: 0)
+            **kwargs: Passed to `requests.Session.request`, e.g. `json`.
+        Returns:
+            requests.Response
+        """
+        if not self.coalesce or kwargs or method.lower() != 'get':
+            return self._send(method, url, retries, **kwargs)
+        with self._in_flight_lock:
+            flight = self._in_flight.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[url] = _Flight()
+        if not leader:
+            flight.done.wait()
+            with self._in_flight_lock:
+                self.coalesced[endpoint_name(url, self.api_url)] += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+        try:
+            flight.response = self._send(method, url, retries)
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[url]
+            flight.done.set()
+        return flight.response
+
+    def _send(self, method, url, retries=0, **kwargs):
+        if not self.hooks:
+            return self.session.request(method, url, **kwargs)
+        with self.hooks.span('http', endpoint_name(url, self.api_url), method=method.upper(), 
+                             retries=retries) as event:
+            resp = self.session.request(method, url, **kwargs)
+            event.status = resp.status_code
+            event.bytes_sent = len(resp.request.body or b'')
+            event.bytes_received = len(resp.content)
+        return resp
+
+    def _json(self, resp):
+        """ Decodes a response from `_http`. Emits a 'json' `vastai.hooks.CallEvent` if any hooks are 
+            registered, so decoding time can be told apart from request time.
+        """
+        if not self.hooks:
+            return jsonlib.loads(resp.content)
+        with self.hooks.span('json', endpoint_name(resp.url, self.api_url), method=resp.request.method, 
+                             bytes_received=len(resp.content)):
+            return jsonlib.loads(resp.content)
+
     def _apiurl(self, subpath, **kwargs):
         query_args = {}
         for k in kwargs:
@@ -321,13 +711,20 @@ class VastClient:
         if self.api_key is not None:
             query_args["api_key"] = self.api_key
         if query_args:
-            return api_base_url + subpath + "?" + "&".join("{x}={y}".format(
-                    x=x, y=quote_plus(y if isinstance(y, str) else json.dumps(y))) 
+            return self.api_url + subpath + "?" + "&".join("{x}={y}".format(
+                    x=x, y=quote_plus(y if isinstance(y, str) else jsonlib.dumps(y))) 
                 for x, y in query_args.items())
         else:
-            return api_base_url + subpath
+            return self.api_url + subpath
 
 
+class _Flight:
+    """ A GET request in flight, shared by the threads which make it at the same time. """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
 class InstanceList(list):
     """ A list of `Instance`s, returned by `VastClient.get_instances()`
     """
@@ -367,9 +764,10 @@ class InstanceList(list):
         # Remove columns in exclude_columns
         if type(columns) is list and type(exclude_columns) is list:
             columns = [c for c in columns if c not in exclude_columns]
-        df = pd.DataFrame(self, columns=columns)
+        df = pd.DataFrame([i.__dict__() if isinstance(i, Instance) else i for i in self], columns=columns)
         if format_values:
             for k in self.value_formatters.keys():
+                if k not in df: continue
                 fmt = self.value_formatters[k]
                 df[k] = [ fmt[0].format( fmt[1](val) if callable(fmt[1]) else val ) if val is not None else 'None'
                         for val in df[k] ]
@@ -379,10 +777,19 @@ class InstanceList(list):
             df = df.rename(columns=rename_columns)
         return df
 
+    def costs(self, now=None):
+        """ Accrued and projected spend of these instances. See `vastai.costs.FleetCosts`.
+        Args:
+            now (float, optional): Seconds since the epoch to compute accruals at. (default: now)
+        Returns:
+            vastai.costs.FleetCosts
+        """
+        return FleetCosts(self, now)
+
     def __dict__(self):
         return {i.id:i.__dict__() for i in self}
     def __json__(self):
-        return json.dumps([i.__dict__() for i in self])
+        return jsonlib.dumps([i.__dict__() for i in self])
     def __repr__(self):
         #return self.as_df().to_string(columns=self.column_mapper.values())
         return '\n'.join([inst.__repr__() for inst in self])
@@ -393,6 +800,33 @@ class OfferList(InstanceList):
     #display_columns = [field[0] for field in displayable_fields]
     #column_mapper = { field[0]:field[1] for field in displayable_fields}
     #value_formatters = { field[0]:(field[2],field[3]) for field in displayable_fields}
+    def pareto(self, objectives=None):
+        """ Offers on the Pareto frontier of `objectives`. See `vastai.selection.pareto_front`.
+        Args:
+            objectives (str or list, optional): e.g. `dph_total,dlperf-`. Postfix field with `-` to prefer 
+                larger values. (default: `vastai.selection.default_objectives`)
+        Returns:
+            OfferList
+        """
+        return OfferList(self[i] for i in selection.pareto_front(self, objectives))
+
+    def top_k(self, k, weights=None):
+        """ The best `k` offers by weighted score, best first. See `vastai.selection.top_k`.
+        Args:
+            k (int): Number of offers to return.
+            weights (str or dict, optional): e.g. `dph=-2,dlperf=1`. (default: `vastai.selection.default_weights`)
+        Returns:
+            OfferList
+        """
+        return OfferList(self[i] for i in selection.top_k(self, k, weights))
+
+    def select(self, pareto=None, k=None, weights=None):
+        """ Pareto filter followed by weighted top-k. See `vastai.selection.select`.
+        Returns:
+            OfferList
+        """
+        return OfferList(selection.select(self, pareto=pareto, k=k, weights=weights))
+
     def __repr__(self):
         return '\n'.join(["%s: "%inst['id']+\
                ("Min bid: $%.4f/hr  "%inst['min_bid'] if inst['dph_total']==inst['min_bid'] \
@@ -420,6 +854,19 @@ class Instance:
         self._ssh_machine = None
         self._tunnels={}
 
+    def _update(self, latest):
+        """ Merges the latest `/instances` data for this instance into its attributes.
+        Args:
+            latest (dict): Instance data, as returned by the api.
+        """
+        known = set(self.fields)
+        for key, value in latest.items():
+            if key not in known:
+                self.fields.append(key)
+                known.add(key)
+            setattr(self, key, value)
+        self.status = latest.get('actual_status')
+
     def __repr__(self):
         """ Uses `pandas.DataTable` for display.
         """
@@ -438,7 +885,7 @@ class Instance:
     def __json__(self):
         """ Gets JSON serializable string
         """
-        return json.dumps(self.__dict__())
+        return jsonlib.dumps(self.__dict__())
 
 #    def get(self, attr, default=None):
 #        """ Gets a specified attribute from this Instance. 
@@ -462,10 +909,10 @@ class Instance:
         assert type(method) is str
         assert method.lower() in ['get', 'put', 'post', 'update', 'delete']
         url = self.client._apiurl(url_base)
-        resp = requests.request(method, url, json=json_data)
+        resp = self.client._http(method, url, json=json_data)
         resp.raise_for_status()
         if resp.status_code == 200:
-            resp_data = resp.json()
+            resp_data = self.client._json(resp)
             #if resp_data['success']:
             #    logging.info(json.dumps(resp_data))
             #    return resp_data
@@ -509,6 +956,21 @@ class Instance:
         print("Bid changed to $%.3f/hr"%price)
         return self
         
+    def set_label(self, label):
+        """ Sets this instance's label.
+        Args:
+            label (str): New label.
+        Raises:
+            `vastai.exceptions.InstanceError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('put', "/instances/%s/"%self.id, {"label": label})
+        self.label = label
+        if 'label' not in self.fields:
+            self.fields.append('label')
+        return self
+
     def start(self):
         """ Starts this configured instance.  
         Raises:
@@ -549,18 +1011,23 @@ class Instance:
         ssh_client = SSHClient()
         ssh_client.set_missing_host_key_policy(AutoAddPolicy)
         print("Connecting to %s:%i "%(self.ssh_host,self.ssh_port))
-        try:
-            ssh_client.connect(self.ssh_host, port=int(self.ssh_port), username='root', 
-                               key_filename=self.client._get_ssh_key_file())
-            print("Running command '%s'"%command_str)
-            stdin, stdout, stderr = ssh_client.exec_command(command_str)
-            print(stdout.read().decode('utf-8'))
-            print(stderr.read().decode('utf-8'))
-    
-        # except NoValidConnectionsError as err:
-        #     raise InstanceError(self.id, err.errors)
-        finally:
-            ssh_client.close()
+        with self.client.hooks.span('ssh', 'run_command', instance_id=self.id) as event:
+            try:
+                ssh_client.connect(self.ssh_host, port=int(self.ssh_port), username='root', 
+                                   key_filename=self.client._get_ssh_key_file())
+                self.client.timeline.mark_ssh(self.id)
+                print("Running command '%s'"%command_str)
+                stdin, stdout, stderr = ssh_client.exec_command(command_str)
+                out, err = stdout.read(), stderr.read()
+                event.status = stdout.channel.recv_exit_status()
+                event.bytes_sent, event.bytes_received = len(command_str), len(out) + len(err)
+                print(out.decode('utf-8'))
+                print(err.decode('utf-8'))
+        
+            # except NoValidConnectionsError as err:
+            #     raise InstanceError(self.id, err.errors)
+            finally:
+                ssh_client.close()
 
     @property
     def pb_remote(self):
@@ -571,9 +1038,11 @@ class Instance:
         if self._pb_remote:# and self._pb_remote._session.alive():
             if self._pb_remote._session.alive():
                 return self._pb_remote 
-        self._pb_remote = ParamikoMachine(self.ssh_host, user='root', port=self.ssh_port, 
-                               keyfile=self.client._get_ssh_key_file(), 
-                               missing_host_policy=AutoAddPolicy )
+        with self.client.hooks.span('ssh', 'pb_remote', instance_id=self.id):
+            self._pb_remote = ParamikoMachine(self.ssh_host, user='root', port=self.ssh_port, 
+                                   keyfile=self.client._get_ssh_key_file(), 
+                                   missing_host_policy=AutoAddPolicy )
+        self.client.timeline.mark_ssh(self.id)
         return self._pb_remote
 
     @property
@@ -583,7 +1052,10 @@ class Instance:
         if self._ssh_machine:
             if self._ssh_machine._session.alive():
                 return self._ssh_machine
-        self._ssh_machine = SshMachine(self.ssh_host, 'root', port=self.ssh_port, keyfile=self.client._get_ssh_key_file())
+        with self.client.hooks.span('ssh', 'ssh_machine', instance_id=self.id):
+            self._ssh_machine = SshMachine(self.ssh_host, 'root', port=self.ssh_port, 
+                                           keyfile=self.client._get_ssh_key_file())
+        self.client.timeline.mark_ssh(self.id)
         return self._ssh_machine
 
     @property
@@ -616,35 +1088,58 @@ class Instance:
             tunnel = self._tunnels[tunnel_local_port]
             if tunnel._session.alive():
                 return tunnel
-        self._tunnels[tunnel_local_port] = self.ssh_machine.tunnel(tunnel_local_port, tunnel_remote_port)
+        with self.client.hooks.span('tunnel', 'get_tunnel', instance_id=self.id, 
+                                    local_port=tunnel_local_port, remote_port=tunnel_remote_port):
+            self._tunnels[tunnel_local_port] = self.ssh_machine.tunnel(tunnel_local_port, tunnel_remote_port)
         return self._tunnels[tunnel_local_port]
 
 
+    def setup_error(self):
+        """ The `status_msg` of an instance which failed to set up, or None.
+        """
+        status_msg = getattr(self, 'status_msg', None)
+        return status_msg if status_msg and status_msg.startswith("Unhandled setup error") else None
+
+    def _has_status(self, status):
+        """ Checks whether this instance's last known status is `status`.
+        Args:
+            status (str or list of str): Status, or list of statuses, to check for.
+        Raises:
+            `vastai.exceptions.UnhandledSetupError`: if `status_msg` reports a setup error.
+        """
+        if self.setup_error():
+            raise(UnhandledSetupError(self.status_msg))
+        if self.status is None:
+            return False
+        if type(status) is str:
+            return self.status.lower()==status.lower() 
+        elif type(status) is list:
+            # Check to see if self.status is any of those listed in status
+            for st in status:
+                if self._has_status(st):
+                    return True
+            return False
+        else: 
+            raise TypeError("Expected target_status to be a string or a list of strings.")
+
     def _wait_until(self, target_status, check_every_s, timeout, destroy_return_delay=20):
         def _check_status(status=target_status):
-            if self.status_msg and self.status_msg.startswith("Unhandled setup error"):
-                raise(UnhandledSetupError(self.status_msg))
-            if self.status is None:
-                return False
-            if type(status) is str:
-                return self.status.lower()==status.lower() 
-            elif type(status) is list:
-                # Check to see if self.status is any of those listed in status
-                for st in status:
-                    if _check_status(st):
-                        return True
-                return False
-            else: 
-                raise TypeError("Expected target_status to be a string or a list of strings.")
+            # `inst` is the refreshed Instance, which may differ from self if self was created 
+            # before the instance was listed by get_instances.
+            return (inst or self)._has_status(status)
 
         #self = self.client.get_instance(self.id) # Calls get_instances() to refresh state
         inst_id = self.id
         client = self.client # Keep a reference to client, in case the Instance isn't in get_instances yet
         inst = client.get_instance(inst_id) # Calls get_instances() which refreshes state
         start_time = time.time()
+        iteration = 0
         while not _check_status() and time.time()-start_time<timeout:
             #instance = self.client.get_instance(inst_id)
-            inst = client.get_instance(inst_id)
+            with client.hooks.span('wait', '_wait_until', instance_id=inst_id, iteration=iteration) as event:
+                inst = client.get_instance(inst_id)
+                event.status = inst.status if inst is not None else None
+            iteration += 1
             if inst is None and time.time()-start_time>destroy_return_delay:
                 print("Instance destroyed.")
                 return 
@@ -665,3 +1160,213 @@ class Instance:
 
     def wait_until_destroyed(self, check_every_s=10, timeout=60):
         self._wait_until([], check_every_s, timeout)
+
+
+def _per_machine(value, machine):
+    """ Resolves a `MachineList` bulk argument for one machine: dicts are keyed by machine id, and 
+        callables are passed the `Machine`. """
+    if isinstance(value, dict):
+        return value.get(machine.id)
+    if callable(value):
+        return value(machine)
+    return value
+
+class MachineList(list):
+    """ A list of host `Machine`s, returned by `VastClient.get_machines()`. Bulk operations run 
+        concurrently over the client's pooled session, and report the result for each machine.
+        Their arguments can also be a dict of `{machine id: value}`, or a function of the `Machine`, 
+        e.g. to reprice each machine differently.
+    """
+    def as_df(self):
+        """ Get list as a `pandas.DataFrame`, indexed by machine id. """
+        return pd.DataFrame([m.__dict__() for m in self]).set_index('id') if self else pd.DataFrame()
+
+    def _bulk(self, method, max_workers=8, **kwargs):
+        """ Calls `Machine.<method>` on every machine, `max_workers` at a time.
+        Returns:
+            BulkResult
+        """
+        def call(machine):
+            getattr(machine, method)(**{k: _per_machine(v, machine) for k, v in kwargs.items()})
+
+        succeeded, failed = [], OrderedDict()
+        if not self:
+            return BulkResult(succeeded, failed)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(self)))) as pool:
+            futures = [(machine.id, pool.submit(call, machine)) for machine in self]
+        for machine_id, future in futures:
+            try:
+                future.result()
+                succeeded.append(machine_id)
+            except (HTTPError, MachineError, ValueError) as err:
+                failed[machine_id] = err
+        for machine_id, err in failed.items():
+            print("Machine %s %s failed: %s"%(machine_id, method, err))
+        print("%s succeeded for %i of %i machines."%(method, len(succeeded), len(self)))
+        return BulkResult(succeeded, failed)
+
+    def list(self, price_gpu=None, price_disk=None, price_inetu=None, price_inetd=None, max_workers=8):
+        """ Lists (or relists at new prices) every machine. See `Machine.list`.
+        Returns:
+            BulkResult
+        """
+        return self._bulk('list', max_workers, price_gpu=price_gpu, price_disk=price_disk, 
+                          price_inetu=price_inetu, price_inetd=price_inetd)
+
+    def unlist(self, max_workers=8):
+        """ Unlists every machine. See `Machine.unlist`.
+        Returns:
+            BulkResult
+        """
+        return self._bulk('unlist', max_workers)
+
+    def set_min_bid(self, price, max_workers=8):
+        """ Sets the min bid price of every machine. See `Machine.set_min_bid`.
+        Returns:
+            BulkResult
+        """
+        return self._bulk('set_min_bid', max_workers, price=price)
+
+    def set_defjob(self, image, price_gpu=None, price_inetu=None, price_inetd=None, args=None, max_workers=8):
+        """ Sets the default job of every machine. See `Machine.set_defjob`.
+        Returns:
+            BulkResult
+        """
+        return self._bulk('set_defjob', max_workers, image=image, price_gpu=price_gpu, 
+                          price_inetu=price_inetu, price_inetd=price_inetd, args=args)
+
+    def remove_defjob(self, max_workers=8):
+        """ Removes the default job of every machine. See `Machine.remove_defjob`.
+        Returns:
+            BulkResult
+        """
+        return self._bulk('remove_defjob', max_workers)
+
+    def __dict__(self):
+        return {m.id:m.__dict__() for m in self}
+    def __json__(self):
+        return jsonlib.dumps([m.__dict__() for m in self])
+    def __repr__(self):
+        return '\n'.join([m.__repr__() for m in self])
+
+class Machine:
+    def __init__(self, client, **kwargs):
+        """ Vast.ai host machine, instantiated by `VastClient.get_machines()`.
+        Args:
+            client (VastClient): 
+            **kwargs: Machine fields, as returned by `/machines`.
+        """
+        self.fields = []
+        self.client = client
+        self._update(kwargs)
+
+    def _update(self, latest):
+        """ Merges the latest `/machines` data for this machine into its attributes. """
+        for key, value in latest.items():
+            if key not in self.fields:
+                self.fields.append(key)
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "{id}: {hostname} {num_gpus}X {gpu_name}  ".format(**self.__dict__())+\
+               ("listed at $%.3f/gpu/hr"%self.listed_gpu_cost if getattr(self, 'listed', False) and \
+                getattr(self, 'listed_gpu_cost', None) is not None else 
+                "listed" if getattr(self, 'listed', False) else "unlisted")
+
+    def __dict__(self):
+        """ Gets dict of serializable fields.
+        """
+        return {k:getattr(self,k) for k in self.fields}
+
+    def __json__(self):
+        """ Gets JSON serializable string
+        """
+        return jsonlib.dumps(self.__dict__())
+
+    def _request(self, method, url_base, json_data):
+        """ Makes http request to `<api_base_url><url_base>`.
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        """
+        resp = self.client._http(method, self.client._apiurl(url_base), json=json_data)
+        resp.raise_for_status()
+        resp_data = self.client._json(resp)
+        if not resp_data.get('success'):
+            raise MachineError(resp_data.get('msg', resp_data), self.id)
+        return resp_data
+
+    def list(self, price_gpu=None, price_disk=None, price_inetu=None, price_inetd=None):
+        """ Lists this machine for rent, replacing any current offers, e.g. to reprice it.
+        Args:
+            price_gpu (float, optional): per gpu rental price in $/hour (price for active instances)
+            price_disk (float, optional): storage price in $/GB/month (price for inactive instances), 
+                default: $0.15/GB/month
+            price_inetu (float, optional): price for internet upload bandwidth in $/GB
+            price_inetd (float, optional): price for internet download bandwidth in $/GB
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('put', "/machines/create_asks/", {'machine': self.id, 'price_gpu': price_gpu, 
+                      'price_disk': price_disk, 'price_inetu': price_inetu, 'price_inetd': price_inetd})
+        self._update(dict(listed=True))
+        if price_gpu is not None:
+            self._update(dict(listed_gpu_cost=price_gpu))
+        print("Listed machine %s%s."%(self.id, " at $%s/gpu/hr"%price_gpu if price_gpu is not None else ""))
+        return self
+
+    def unlist(self):
+        """ Removes all offers for this machine.
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('delete', "/machines/%s/asks/"%self.id, {})
+        self._update(dict(listed=False, listed_gpu_cost=None))
+        print("Unlisted machine %s."%self.id)
+        return self
+
+    def set_min_bid(self, price):
+        """ Sets the min bid price of this machine.
+        Args:
+            price (float): per gpu min bid price in $/hour
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('put', "/machines/%s/minbid/"%self.id, {"client_id": "me", "price": price})
+        self._update(dict(min_bid_price=price))
+        print("Min bid of machine %s set to $%s/gpu/hr."%(self.id, price))
+        return self
+
+    def set_defjob(self, image, price_gpu=None, price_inetu=None, price_inetd=None, args=None):
+        """ Sets the default job, which runs on this machine's idle GPUs.
+        Args:
+            image (str): docker container image to launch
+            price_gpu (float, optional): per gpu rental price in $/hour
+            price_inetu (float, optional): price for internet upload bandwidth in $/GB
+            price_inetd (float, optional): price for internet download bandwidth in $/GB
+            args (list of str, optional): arguments passed to container launch
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('put', "/machines/create_bids/", {'machine': self.id, 'price_gpu': price_gpu, 
+                      'price_inetu': price_inetu, 'price_inetd': price_inetd, 'image': image, 'args': args})
+        print("Default job %s set on machine %s."%(image, self.id))
+        return self
+
+    def remove_defjob(self):
+        """ Removes the default job of this machine.
+        Raises:
+            `vastai.exceptions.MachineError`: if request doesn't return `{'success': true}`
+        Returns:
+            self
+        """
+        self._request('delete', "/machines/%s/defjob/"%self.id, {})
+        print("Default job removed from machine %s."%self.id)
+        return self
@@ -0,0 +1,186 @@
+""" Bid manager for interruptible instances.
+
+An interruptible (`is_bid`) instance keeps running while its bid, reported as `dph_base`,
+stays above the machine's `min_bid`. A `BidManager` watches `min_bid` of every
+interruptible instance and re-bids according to a `BidStrategy`:
+
+    manager = BidManager(client, BidStrategy(margin=.02, max_price=.9, hysteresis=.01)).start()
+
+It learns of market moves from the instance refreshes of its client, whoever makes them
+(see `VastClient.refresh_listeners`), and refreshes at most every `check_every_s` seconds
+itself, so it never polls instances one by one. Bid changes are sent concurrently.
+`reaction_times` records the seconds from the refresh which showed a move to the
+updated bid being accepted.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vastai.api import InstanceDiff
+
+class BidStrategy:
+    """ Bids a margin above `min_bid`, up to a cap, ignoring moves smaller than `hysteresis`.
+    """
+    def __init__(self, margin=.01, margin_frac=0., max_price=None, hysteresis=.005, lower=True):
+        """
+        Args:
+            margin (float): $/hr to bid above `min_bid`. (default: .01)
+            margin_frac (float): Fraction of `min_bid` to bid above it, added to `margin`. (default: 0)
+            max_price (float, optional): Never bid more than this many $/hr. (default: no cap)
+            hysteresis (float): Only change a bid which is more than this many $/hr away from the target.
+                Bids below `min_bid` are always raised. (default: .005)
+            lower (bool): Also lower bids when `min_bid` drops. (default: True)
+        """
+        self.margin = margin
+        self.margin_frac = margin_frac
+        self.max_price = max_price
+        self.hysteresis = hysteresis
+        self.lower = lower
+
+    def target(self, min_bid):
+        """ The price to bid for a given `min_bid`, in $/hr. """
+        price = min_bid*(1 + self.margin_frac) + self.margin
+        return price if self.max_price is None else min(price, self.max_price)
+
+    def new_bid(self, min_bid, current):
+        """ The bid to change to, or None to keep `current`.
+        Args:
+            min_bid (float): The machine's `min_bid`, in $/hr.
+            current (float or None): The current bid, in $/hr.
+        """
+        target = round(self.target(min_bid), 6)
+        if current is None:
+            return target
+        if target > current and (current < min_bid or target - current > self.hysteresis):
+            return target
+        if self.lower and current - target > self.hysteresis:
+            return target
+        return None
+
+class BidManager:
+    """ Keeps the bids of a client's interruptible instances in line with `min_bid`.
+    """
+    def __init__(self, client, strategy=None, check_every_s=10, max_workers=8, clock=time.time):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            strategy (BidStrategy, optional): (default: `BidStrategy()`)
+            check_every_s (float): Seconds between background refreshes. (default: 10)
+            max_workers (int): Bid changes to send at once. (default: 8)
+        """
+        self.client = client
+        self.strategy = strategy or BidStrategy()
+        self.check_every_s = check_every_s
+        self.max_workers = max_workers
+        self.clock = clock
+        self.bids = {}
+        """ `{instance id: $/hr}` last bid for each interruptible instance """
+        self.changes = []
+        """ `(time, instance id, min_bid, old bid, new bid)` for each bid change """
+        self.reaction_times = []
+        """ Seconds from the refresh which showed a `min_bid` move to the new bid being accepted """
+        self.capped = set()
+        """ Ids of instances whose target bid is capped by `max_price` below `min_bid`, so they may be outbid """
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = threading.Event()
+        self._on_refresh(InstanceDiff(list(client.instances), [], {}))
+        client.refresh_listeners.append(self._on_refresh)
+
+    def _on_refresh(self, diff):
+        """ Notes which interruptible instances need their bids checked. """
+        now = self.clock()
+        with self._lock:
+            for inst in diff.removed:
+                self.bids.pop(inst.id, None)
+                self._dirty.pop(inst.id, None)
+                self.capped.discard(inst.id)
+            for inst in diff.added:
+                if getattr(inst, 'is_bid', False):
+                    self.bids[inst.id] = getattr(inst, 'dph_base', None)
+                    self._dirty.setdefault(inst.id, now)
+            for inst_id, changes in diff.changed.items():
+                if 'dph_base' in changes and inst_id in self.bids:
+                    self.bids[inst_id] = changes['dph_base'][1]
+                if 'is_bid' in changes and not changes['is_bid'][1]:
+                    self.bids.pop(inst_id, None)
+                elif 'min_bid' in changes or 'is_bid' in changes or 'dph_base' in changes:
+                    inst = self.client._instance_index.get(inst_id)
+                    if inst is not None and getattr(inst, 'is_bid', False):
+                        self.bids.setdefault(inst_id, getattr(inst, 'dph_base', None))
+                        self._dirty.setdefault(inst_id, now)
+
+    def check(self, refresh=True):
+        """ Re-bids for every interruptible instance whose `min_bid` moved.
+        Args:
+            refresh (bool): Refresh the instances first. (default: True)
+        Returns:
+            list: `(instance, old bid, new bid)` for each bid changed.
+        """
+        if refresh:
+            self.client.refresh_instances()
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            updates = []
+            for inst_id, seen_at in dirty.items():
+                inst = self.client._instance_index.get(inst_id)
+                min_bid = getattr(inst, 'min_bid', None)
+                if inst is None or min_bid is None:
+                    continue
+                current = self.bids.get(inst_id)
+                price = self.strategy.new_bid(min_bid, current)
+                if self.strategy.max_price is not None and self.strategy.target(min_bid) < min_bid:
+                    self.capped.add(inst_id)
+                else:
+                    self.capped.discard(inst_id)
+                if price is not None:
+                    updates.append((inst, min_bid, current, price, seen_at))
+        if updates:
+            self._apply(updates)
+        return [(inst, current, price) for inst, _, current, price, _ in updates]
+
+    def _apply(self, updates):
+        def change(update):
+            inst, min_bid, current, price, seen_at = update
+            try:
+                inst.change_bid(price)
+            except Exception as err:
+                print("Failed to change bid of instance %s: %s"%(inst.id, err))
+                with self._lock:
+                    self._dirty.setdefault(inst.id, seen_at) # Retry on the next check.
+                return
+            now = self.clock()
+            with self._lock:
+                self.bids[inst.id] = price
+                self.changes.append((now, inst.id, min_bid, current, price))
+                self.reaction_times.append(now - seen_at)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(updates))) as executor:
+            list(executor.map(change, updates))
+
+    def start(self):
+        """ Refreshes and re-bids every `check_every_s` seconds in a background thread.
+        Returns:
+            BidManager: self
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name="vastai-bid-manager", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closing.is_set():
+            try:
+                self.check()
+            except Exception as err:
+                print("Bid manager check failed: %s"%err)
+            self._closing.wait(self.check_every_s)
+
+    def close(self):
+        """ Stops the background checks, and stops tracking refreshes. """
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._on_refresh in self.client.refresh_listeners:
+            self.client.refresh_listeners.remove(self._on_refresh)
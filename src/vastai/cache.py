@@ -0,0 +1,151 @@
+""" On-disk cache of the last known instances, offers and machines.
+
+`StateCache` keeps the latest `/instances`, `/bundles` and `/machines` responses in an
+SQLite database, so `VastClient` and `vast.py` can start from the last known state
+instead of waiting on the network, and so past data can be analyzed offline with SQL:
+
+    from vastai.cache import StateCache
+    cache = StateCache()
+    cache.df("select gpu_name, min(dph_total), count(*) from offers group by gpu_name")
+
+Every response is stored whole in the `responses` table, keyed by kind and by a key made
+with `scoped_key` from the api url, the api key and the query. Its rows are also stored in
+the `instances`, `offers` and `machines` tables, with indexed `id`, `machine_id`, `status`,
+`gpu_name` and `dph_total` columns and the full row as json in `data`. `instances` and
+`machines` hold the latest snapshot stored; `offers` keeps every offer seen, with the time
+it was last seen. Offers and offer queries older than `retention_s` are pruned as new ones are
+stored. The database holds ssh details and jupyter tokens, so only its owner may read it.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from vastai import jsonlib
+
+def env_cache_path():
+    """ `$VAST_CACHE`, or `~/.vast_cache.sqlite` if it isn't set. """
+    return os.path.expanduser(os.environ.get("VAST_CACHE", "~/.vast_cache.sqlite"))
+
+default_cache_path = env_cache_path()
+""" Cache database. (default: `$VAST_CACHE` or `~/.vast_cache.sqlite`) """
+
+kinds = {
+    # kind: (status field, whether each response replaces all rows)
+    "instances": ("actual_status", True),
+    "offers":    (None,            False),
+    "machines":  (None,            True),
+}
+
+_schema = """
+create table if not exists responses (
+    kind text not null, key text not null, fetched_at real not null, body text not null,
+    primary key (kind, key));
+""" + "".join("""
+create table if not exists {kind} (
+    id integer primary key, machine_id integer, status text, gpu_name text, dph_total real,
+    fetched_at real not null, data text not null);
+create index if not exists {kind}_machine_id on {kind} (machine_id);
+create index if not exists {kind}_status on {kind} (status);
+create index if not exists {kind}_gpu_name on {kind} (gpu_name);
+create index if not exists {kind}_dph_total on {kind} (dph_total);
+create index if not exists {kind}_fetched_at on {kind} (fetched_at);
+""".format(kind=kind) for kind in kinds)
+
+class StateCache:
+    """ SQLite store of api responses. Safe to share between threads.
+    """
+    def __init__(self, path=None, retention_s=7*24*3600):
+        """
+        Args:
+            path (str, optional): Database file, created if missing. (default: `default_cache_path`)
+            retention_s (float, optional): Prune offers and offer queries last stored longer ago than this.
+                (default: a week, None to keep everything)
+        """
+        self.path = path or default_cache_path
+        self.retention_s = retention_s
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            # SQLite creates the -wal and -shm files with the database's permissions.
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(self.path, 0o600)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("pragma journal_mode=wal")
+            self._db.executescript(_schema)
+
+    def close(self):
+        self._db.close()
+
+    def store(self, kind, rows, key="", fetched_at=None):
+        """ Stores one response.
+        Args:
+            kind (str): 'instances', 'offers' or 'machines'.
+            rows (list of dict): Rows of the response, e.g. `resp.json()["instances"]`.
+            key (str): Distinguishes responses of the same kind, see `scoped_key`. (default: '')
+            fetched_at (float, optional): Seconds since the epoch. (default: now)
+        """
+        status_field, replace = kinds[kind]
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        values = [(row.get("id"), row.get("machine_id", row.get("id") if kind == "machines" else None),
+                   row.get(status_field) if status_field else None, row.get("gpu_name"), row.get("dph_total"),
+                   fetched_at, jsonlib.dumps(row)) for row in rows]
+        with self._lock, self._db:
+            self._db.execute("insert or replace into responses values (?, ?, ?, ?)",
+                             (kind, key, fetched_at, jsonlib.dumps(rows)))
+            if replace:
+                self._db.execute("delete from %s"%kind)
+            self._db.executemany("insert or replace into %s values (?, ?, ?, ?, ?, ?, ?)"%kind, values)
+            if self.retention_s is not None:
+                self._prune(time.time() - self.retention_s)
+
+    def _prune(self, before):
+        self._db.execute("delete from responses where kind = 'offers' and fetched_at < ?", (before,))
+        self._db.execute("delete from offers where fetched_at < ?", (before,))
+
+    def load(self, kind, key="", max_age_s=None):
+        """ The last stored response.
+        Args:
+            kind (str): 'instances', 'offers' or 'machines'.
+            key (str): As given to `store`. (default: '')
+            max_age_s (float, optional): Ignore responses older than this many seconds. (default: any age)
+        Returns:
+            tuple: `(rows, fetched_at)`, or None if there's no response (young enough).
+        """
+        with self._lock:
+            row = self._db.execute("select fetched_at, body from responses where kind=? and key=?",
+                                   (kind, key)).fetchone()
+        if row is None or (max_age_s is not None and time.time() - row["fetched_at"] > max_age_s):
+            return None
+        return jsonlib.loads(row["body"]), row["fetched_at"]
+
+    def sql(self, query, *params):
+        """ Runs an SQL query.
+        Returns:
+            list of dict: result rows
+        """
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, params).fetchall()]
+
+    def df(self, query, *params):
+        """ Runs an SQL query.
+        Returns:
+            pandas.DataFrame
+        """
+        import pandas as pd
+        with self._lock:
+            return pd.read_sql_query(query, self._db, params=params)
+
+def scoped_key(api_url, api_key, key=""):
+    """ Cache key of a response of one account on one api server, so `--cached` with another api key
+        or `--url` never returns this account's data. Only a hash of the api key is stored.
+    """
+    account = hashlib.sha256(("%s\n%s"%(api_url, api_key)).encode("utf-8")).hexdigest()[:16]
+    return "%s:%s"%(account, key)
+
+def offers_key(query):
+    """ Cache key of an offer search, from the `q` query arg of a `/bundles` request. """
+    return json.dumps(query, sort_keys=True)
@@ -0,0 +1,154 @@
+""" Accrued and projected spend of a fleet of instances.
+
+`FleetCosts` reads the pricing fields of each instance once into numpy arrays, so
+accruals, burn rates and projections for the whole fleet are a few array operations,
+cheap enough to recompute after every `VastClient.get_instances()`:
+
+    costs = client.get_instances().costs()
+    costs.total(hours=24)                  # spend so far, and after another day
+    costs.by("label", hours=24)            # the same per label, as a DataFrame
+    costs.burn_rate(plan={1234: "stop"})   # $/hr if instance 1234 were stopped
+
+Billing model: a running instance pays `dph_total` per hour, which is its `dph_base`
+compute price plus `storage_total_cost`. Any other instance only pays for storage.
+Bandwidth is billed per GB at `inet_up_cost` and `inet_down_cost`. The api doesn't report
+when an instance was stopped or started, so accruals assume each instance has been in its
+current state since `start_date`: running instances are charged compute for all of that
+time, and other instances none, so the compute a stopped instance used before it stopped
+isn't counted. Projections stop at the contract's `end_date`.
+"""
+import time
+
+import numpy as np
+
+plan_actions = ("start", "stop", "destroy")
+""" Actions a plan can apply to an instance. """
+
+group_keys = {"instance": "id", "label": "label", "gpu": "gpu_name", "machine": "machine_id"}
+""" Names accepted by `FleetCosts.by`, and the instance field each groups on. """
+
+_price_fields = ("dph_total", "dph_base", "storage_total_cost", "inet_up_cost", "inet_down_cost",
+                 "inet_up_billed", "inet_down_billed", "start_date", "end_date", "duration")
+
+def _getter(instances):
+    if instances and isinstance(instances[0], dict):
+        return lambda inst, field: inst.get(field)
+    return lambda inst, field: getattr(inst, field, None)
+
+class FleetCosts:
+    """ Vectorized cost accounting for a list of instances, as of one point in time.
+    """
+    def __init__(self, instances, now=None):
+        """
+        Args:
+            instances (list of Instance or dict): e.g. an `InstanceList`, or rows from `/instances`.
+            now (float, optional): Seconds since the epoch to compute accruals at. (default: now)
+        """
+        get = _getter(instances)
+        self.now = time.time() if now is None else now
+        self.ids = np.array([get(inst, "id") for inst in instances])
+        self.labels = [get(inst, "label") for inst in instances]
+        self.gpu_names = [get(inst, "gpu_name") for inst in instances]
+        self.machine_ids = [get(inst, "machine_id") for inst in instances]
+        self.running = np.array([get(inst, "actual_status") == "running" for inst in instances], dtype=bool)
+        columns = np.array([[get(inst, field) for field in _price_fields] for inst in instances],
+                           dtype=float).reshape(len(instances), len(_price_fields))
+        columns = dict(zip(_price_fields, columns.T))
+        self.storage = np.nan_to_num(columns["storage_total_cost"])
+        dph_base = columns["dph_base"]
+        # Fall back to dph_total less storage where dph_base isn't reported.
+        self.compute = np.nan_to_num(np.where(np.isnan(dph_base), columns["dph_total"] - self.storage, dph_base))
+        self.bandwidth = np.nan_to_num(columns["inet_up_billed"]*columns["inet_up_cost"]) + \
+                         np.nan_to_num(columns["inet_down_billed"]*columns["inet_down_cost"])
+        start = columns["start_date"]
+        elapsed_s = np.where(np.isnan(start), columns["duration"], self.now - start)
+        self.hours = np.clip(np.nan_to_num(elapsed_s), 0, None)/3600.
+        """ Hours since each instance was created. """
+        self.remaining_hours = np.clip((columns["end_date"] - self.now)/3600., 0, None)
+        """ Hours until each contract ends. `inf` where no end date is reported. """
+        self.remaining_hours[np.isnan(self.remaining_hours)] = np.inf
+        self._index = {id: i for i, id in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def accrued(self):
+        """ Spend so far, per instance: storage and bandwidth, plus compute for running instances.
+        Returns:
+            numpy.ndarray: dollars
+        """
+        return (np.where(self.running, self.compute, 0.) + self.storage)*self.hours + self.bandwidth
+
+    def _running_after(self, plan):
+        if not plan:
+            return self.running, np.zeros(len(self), dtype=bool)
+        running, destroyed = self.running.copy(), np.zeros(len(self), dtype=bool)
+        for id, action in plan.items():
+            if action not in plan_actions:
+                raise ValueError("Unknown plan action %r for instance %s. Expected one of %s."%(
+                                 action, id, ", ".join(plan_actions)))
+            i = self._index.get(id)
+            if i is None:
+                raise KeyError("Instance %s isn't in this fleet."%id)
+            running[i] = action == "start"
+            destroyed[i] = action == "destroy"
+        return running, destroyed
+
+    def burn_rate(self, plan=None):
+        """ Current spend per hour, per instance, excluding bandwidth.
+        Args:
+            plan (dict, optional): Hypothetical `{instance id: 'start', 'stop' or 'destroy'}` to apply first.
+        Raises:
+            ValueError: if a plan action isn't one of `plan_actions`.
+            KeyError: if a planned instance isn't in the fleet.
+        Returns:
+            numpy.ndarray: dollars per hour
+        """
+        running, destroyed = self._running_after(plan)
+        return np.where(destroyed, 0., self.storage + np.where(running, self.compute, 0.))
+
+    def projected(self, hours, plan=None):
+        """ Spend so far plus the spend over the next `hours`, per instance.
+        Args:
+            hours (float): Hours to project ahead. Contracts stop accruing at their `end_date`.
+            plan (dict, optional): As for `burn_rate`.
+        Returns:
+            numpy.ndarray: dollars
+        """
+        return self.accrued() + self.burn_rate(plan)*np.minimum(hours, self.remaining_hours)
+
+    def total(self, hours=24, plan=None):
+        """ Fleet totals.
+        Returns:
+            dict: `instances`, `running`, `accrued` ($), `burn_rate` ($/hr) and `projected` ($ after `hours`).
+        """
+        burn_rate = self.burn_rate(plan)
+        return dict(instances=len(self), running=int(self._running_after(plan)[0].sum()),
+                    accrued=float(self.accrued().sum()), burn_rate=float(burn_rate.sum()),
+                    projected=float((self.accrued() + burn_rate*np.minimum(hours, self.remaining_hours)).sum()))
+
+    def by(self, key="label", hours=24, plan=None):
+        """ Accrued spend, burn rate and projected spend, summed per group.
+        Args:
+            key (str): 'instance', 'label', 'gpu' or 'machine'. See `group_keys`.
+            hours (float): Hours to project ahead. (default: 24)
+            plan (dict, optional): As for `burn_rate`.
+        Returns:
+            pandas.DataFrame: indexed by group, sorted by burn rate, highest first.
+        """
+        import pandas as pd
+        if key not in group_keys:
+            raise ValueError("Can't group by %r. Expected one of %s."%(key, ", ".join(group_keys)))
+        values = {"instance": self.ids.tolist(), "label": self.labels, "gpu": self.gpu_names,
+                  "machine": self.machine_ids}[key]
+        groups, inverse = np.unique(np.array([str(v) if v is not None else "" for v in values]),
+                                    return_inverse=True)
+        burn_rate = self.burn_rate(plan)
+        running, _ = self._running_after(plan)
+        projected = self.accrued() + burn_rate*np.minimum(hours, self.remaining_hours)
+        sums = lambda weights: np.bincount(inverse, weights=weights, minlength=len(groups))
+        df = pd.DataFrame(dict(instances=np.bincount(inverse, minlength=len(groups)),
+                               running=sums(running.astype(float)).astype(int),
+                               accrued=sums(self.accrued()), burn_rate=sums(burn_rate), projected=sums(projected)),
+                          index=pd.Index(groups, name=group_keys[key]))
+        return df.sort_values("burn_rate", ascending=False)
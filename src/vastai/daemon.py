@@ -0,0 +1,322 @@
+""" Background process which runs `vast.py` commands.
+
+Each `vast.py` invocation normally pays for interpreter start, imports, argparse setup and
+new TLS connections before it sends its first request. `vast start daemon` starts one
+long-lived process which has all of that done already. While it's running, `vast.py`
+forwards its command line, working directory and environment over a Unix socket before
+importing anything else, and prints the output streamed back. Commands run in the daemon
+share one warm `requests.Session`, so they run one at a time.
+
+If the daemon isn't running `vast.py` runs commands itself, as before. Pass `--no-daemon`
+to a single command, or set `VAST_NO_DAEMON=1`, to do so regardless.
+
+Protocol: the client sends one json line, `{"argv": [...], "cwd": ..., "env": {...}}` to run a command, or
+`{"control": "status"}` / `{"control": "stop"}`. The daemon replies with json lines:
+`{"out": text}` and `{"err": text}` as the command prints, then `{"exit": status}`.
+This module only imports the standard library, so forwarding stays cheap.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+default_socket_path = os.path.expanduser(os.environ.get("VAST_DAEMON_SOCKET", "~/.vast_daemon.sock"))
+""" Unix socket the daemon listens on. (default: `$VAST_DAEMON_SOCKET` or `~/.vast_daemon.sock`) """
+
+local_commands = (["start", "daemon"], ["stop", "daemon"], ["show", "daemon"], ["login"], ["create", "account"])
+""" Commands which always run in the calling process: daemon management, and commands which prompt for input.
+    Commands with `--profile` or `--watch` also run in the calling process. """
+
+def _runs_locally(argv):
+    if os.environ.get("VAST_NO_DAEMON") or any(arg.startswith(("--profile", "--watch")) for arg in argv):
+        return True
+    return any(argv[i:i+len(cmd)] == cmd for cmd in local_commands for i in range(len(argv)))
+
+def _absolute_paths(argv):
+    """ Makes `--onstart` file arguments absolute, since the daemon has its own working directory. """
+    argv = list(argv)
+    for i, arg in enumerate(argv):
+        if arg == "--onstart" and i+1 < len(argv):
+            argv[i+1] = os.path.abspath(argv[i+1])
+        elif arg.startswith("--onstart="):
+            argv[i] = "--onstart=" + os.path.abspath(arg[len("--onstart="):])
+    return argv
+
+def _connect(socket_path):
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        # Left behind by a daemon which didn't shut down cleanly.
+        sock.close()
+        return None
+    return sock
+
+def forward(argv, socket_path=None, stdout=None, stderr=None):
+    """ Runs a `vast.py` command in the daemon, printing its output as it arrives.
+    Args:
+        argv (list of str): Command line arguments, e.g. `["show", "instances"]`.
+        socket_path (str, optional): Daemon socket. (default: `default_socket_path`)
+        stdout, stderr (file, optional): Where to print output. (default: `sys.stdout`, `sys.stderr`)
+    Returns:
+        int: The command's exit status, or None if the command should run in this process
+            because no daemon is running, or because it's one of `local_commands`.
+    """
+    if _runs_locally(argv):
+        return None
+    sock = _connect(socket_path or default_socket_path)
+    if sock is None:
+        return None
+    stdout, stderr = stdout or sys.stdout, stderr or sys.stderr
+    with sock:
+        request = {"argv": _absolute_paths(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        for line in sock.makefile("r", encoding="utf-8"):
+            msg = json.loads(line)
+            if "out" in msg:
+                stdout.write(msg["out"])
+                stdout.flush()
+            elif "err" in msg:
+                stderr.write(msg["err"])
+                stderr.flush()
+            elif "exit" in msg:
+                return msg["exit"]
+    # The command may already have had side effects, so don't run it again here.
+    print("Lost connection to the vast daemon.", file=stderr)
+    return 1
+
+def control(command, socket_path=None):
+    """ Sends a control command to the daemon.
+    Args:
+        command (str): 'status' or 'stop'.
+        socket_path (str, optional): Daemon socket. (default: `default_socket_path`)
+    Returns:
+        dict: The daemon's reply, or None if no daemon is running.
+    """
+    sock = _connect(socket_path or default_socket_path)
+    if sock is None:
+        return None
+    with sock:
+        sock.sendall((json.dumps({"control": command}) + "\n").encode("utf-8"))
+        line = sock.makefile("r", encoding="utf-8").readline()
+    return json.loads(line) if line else None
+
+def start(socket_path=None, idle_timeout_s=None, timeout=10):
+    """ Starts a daemon in a new background process, unless one is already running.
+    Args:
+        socket_path (str, optional): Socket to listen on. (default: `default_socket_path`)
+        idle_timeout_s (float, optional): Exit after this many seconds without a command.
+        timeout (float): Seconds to wait for the daemon to start listening. (default: 10)
+    Raises:
+        TimeoutError: if the daemon doesn't start listening within `timeout`.
+    Returns:
+        dict: The new (or already running) daemon's status.
+    """
+    import subprocess
+    socket_path = socket_path or default_socket_path
+    status = control("status", socket_path)
+    if status is not None:
+        return status
+    cmd = [sys.executable, "-m", "vastai.daemon", "--socket", socket_path]
+    if idle_timeout_s is not None:
+        cmd += ["--idle-timeout", str(idle_timeout_s)]
+    # Make sure the child can import this package, even if it isn't installed.
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    with open(os.devnull, "r+b") as devnull:
+        subprocess.Popen(cmd, env=env, stdin=devnull, stdout=devnull, stderr=devnull, start_new_session=True,
+                         cwd="/")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = control("status", socket_path)
+        if status is not None:
+            return status
+        time.sleep(.02)
+    raise TimeoutError("vast daemon didn't start listening on %s within %is."%(socket_path, timeout))
+
+class _ThreadStream:
+    """ Stands in for `sys.stdout` or `sys.stderr`, sending each thread's output to the
+        stream set with `redirect`, or to the original stream.
+    """
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def _target(self):
+        return getattr(self._local, "stream", None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+class _ReplyStream:
+    """ File-like object which sends writes to a client as `{key: text}` json lines.
+        Output is buffered, but sent at least every `flush_every_s` seconds so progress
+        messages from long running commands still appear as they're printed.
+    """
+    flush_every_s = .1
+    buffer_size = 1 << 16
+
+    def __init__(self, conn, lock, key):
+        self.conn, self.lock, self.key = conn, lock, key
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.time()
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size or time.time() - self._last_flush >= self.flush_every_s:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        self._last_flush = time.time()
+        if not self._size:
+            return
+        text, self._buffer, self._size = "".join(self._buffer), [], 0
+        with self.lock:
+            self.conn.sendall((json.dumps({self.key: text}) + "\n").encode("utf-8"))
+
+class VastDaemon:
+    """ Serves forwarded `vast.py` commands on a Unix socket, each connection in its own thread.
+        Commands run one at a time, since they share the session, the parser, the working directory
+        and the environment.
+    """
+    def __init__(self, socket_path=None, idle_timeout_s=None):
+        """
+        Args:
+            socket_path (str, optional): Socket to listen on. (default: `default_socket_path`)
+            idle_timeout_s (float, optional): Exit after this many seconds without a command. (default: never)
+        """
+        self.socket_path = socket_path or default_socket_path
+        self.idle_timeout_s = idle_timeout_s
+        self.started = None
+        self.commands = 0
+        self.active = 0
+        self._last_command = time.time()
+        self._lock = threading.Lock()
+        self._command_lock = threading.Lock()
+        self._stopping = threading.Event()
+        from vastai import vast
+        self.vast = vast
+        vast.add_global_arguments()
+
+    def status(self):
+        return dict(pid=os.getpid(), socket=self.socket_path, uptime_s=time.time() - self.started,
+                    commands=self.commands, active=self.active)
+
+    def serve_forever(self):
+        """ Listens until stopped with a 'stop' control command, or until idle for `idle_timeout_s`.
+        """
+        if _connect(self.socket_path) is not None:
+            raise RuntimeError("A vast daemon is already listening on %s."%self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177) # Only this user may connect, since commands use their api key.
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        server.settimeout(.5)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _ThreadStream(stdout), _ThreadStream(stderr)
+        self.started = time.time()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    if self.idle_timeout_s is not None and not self.active and \
+                            time.time() - self._last_command > self.idle_timeout_s:
+                        break
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def _handle(self, conn):
+        with conn:
+            line = conn.makefile("r", encoding="utf-8").readline()
+            if not line:
+                return
+            request = json.loads(line)
+            if "control" in request:
+                if request["control"] == "stop":
+                    self._stopping.set()
+                reply = self.status()
+                reply["stopping"] = self._stopping.is_set()
+                conn.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+                return
+            with self._lock:
+                self.active += 1
+                self.commands += 1
+            try:
+                status = self._run(conn, request["argv"], request.get("cwd"), request.get("env"))
+                conn.sendall((json.dumps({"exit": status}) + "\n").encode("utf-8"))
+            except OSError:
+                pass # The client went away.
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self._last_command = time.time()
+
+    def _run(self, conn, argv, cwd=None, env=None):
+        """ Runs a command in the client's working directory and environment. """
+        from vastai import cache
+        lock = threading.Lock()
+        with self._command_lock:
+            sys.stdout.redirect(_ReplyStream(conn, lock, "out"))
+            sys.stderr.redirect(_ReplyStream(conn, lock, "err"))
+            environ, old_cwd = dict(os.environ), os.getcwd()
+            try:
+                if env is not None:
+                    os.environ.clear()
+                    os.environ.update(env)
+                if cwd is not None:
+                    os.chdir(cwd)
+                cache.default_cache_path = cache.env_cache_path()
+                return self.vast.run(argv)
+            except SystemExit as err:
+                # argparse exits after printing help or usage errors.
+                return err.code if isinstance(err.code, int) else (0 if err.code is None else 1)
+            except Exception as err:
+                print("%s: %s"%(type(err).__name__, err), file=sys.stderr)
+                return 1
+            finally:
+                for stream in (sys.stdout, sys.stderr):
+                    stream.flush()
+                    stream.redirect(None)
+                os.environ.clear()
+                os.environ.update(environ)
+                os.chdir(old_cwd)
+                cache.default_cache_path = cache.env_cache_path()
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Runs forwarded vast.py commands. See `vast start daemon`.")
+    arg_parser.add_argument("--socket", default=default_socket_path, help="unix socket to listen on")
+    arg_parser.add_argument("--idle-timeout", type=float, default=None, help="exit after this many idle seconds")
+    cli_args = arg_parser.parse_args()
+    VastDaemon(cli_args.socket, cli_args.idle_timeout).serve_forever()
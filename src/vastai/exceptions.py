@@ -2,6 +2,10 @@ class InstanceError(Exception):
     def __init__(self, message='', instance_id=None):
         super().__init__("Error making request for Instance %s\n%s"%(instance_id, message))
 
+class MachineError(Exception):
+    def __init__(self, message='', machine_id=None):
+        super().__init__("Error making request for Machine %s\n%s"%(machine_id, message))
+
 class Unauthorized(Exception):
     def __init__(self, message):
         super().__init__(message+"\nMust provide a valid api_key or login with username/password.")
@@ -0,0 +1,139 @@
+""" Change feed over successive offer searches.
+
+An `OfferFeed` repeats one `VastClient.search_offers` query and reports only what
+changed since the previous result: offers added, offers removed, and offers whose
+price fields changed. The previous result is kept as a dict of offer id to price
+fingerprint, so each diff is linear in the number of offers.
+
+    feed = OfferFeed(client, query="gpu_name=RTX_3090 num_gpus>=4")
+    for delta in feed.stream():
+        for offer in delta.added:
+            print("New offer %s at $%.3f/hr"%(offer["id"], offer["dph_total"]))
+
+Or in a background thread, with callbacks:
+
+    feed.subscribe(lambda delta: print(delta))
+    feed.start()
+"""
+import threading
+import time
+from collections import namedtuple
+
+OfferDelta = namedtuple('OfferDelta', ['added', 'removed', 'changed', 'time'])
+""" Changes between two offer searches: lists of `added` and `removed` offers, and `changed`,
+    a list of `(previous offer, offer)` pairs whose `OfferFeed.fields` differ. """
+
+default_fields = ("dph_total", "min_bid", "dph_base", "storage_cost", "inet_up_cost", "inet_down_cost")
+""" Offer fields compared by `OfferFeed`. """
+
+class OfferFeed:
+    """ Polls one offer search and reports the offers added, removed and changed since the previous poll.
+    """
+    def __init__(self, client, query=None, fields=default_fields, interval_s=30, clock=time.time, **search_kwargs):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            query (str, optional): Offer query, see `VastClient.search_offers`.
+            fields (tuple of str): Offer fields whose changes are reported. (default: `default_fields`)
+            interval_s (float): Seconds between polls in `stream` and the background thread. (default: 30)
+            **search_kwargs: Passed to `VastClient.search_offers`, e.g. `sort_order`, `instance_type`.
+        """
+        self.client = client
+        self.query = query
+        self.fields = tuple(fields)
+        self.interval_s = interval_s
+        self.clock = clock
+        self.search_kwargs = search_kwargs
+        self.offers = {}
+        """ `{offer id: offer}` as of the last poll """
+        self._fingerprints = {}
+        self._callbacks = []
+        self._thread = None
+        self._closing = threading.Event()
+
+    def update(self, offers):
+        """ Replaces the snapshot with `offers`, e.g. the result of a search made elsewhere.
+        Args:
+            offers (list of dict): Offers, as returned by `VastClient.search_offers`.
+        Returns:
+            OfferDelta
+        """
+        fields = self.fields
+        previous, previous_fingerprints = self.offers, self._fingerprints
+        offers_by_id = {offer["id"]: offer for offer in offers}
+        fingerprints = {offer_id: tuple([offer.get(f) for f in fields]) for offer_id, offer in offers_by_id.items()}
+        added, changed = [], []
+        for offer_id, fingerprint in fingerprints.items():
+            old = previous_fingerprints.get(offer_id)
+            if old is None:
+                added.append(offers_by_id[offer_id])
+            elif old != fingerprint:
+                changed.append((previous[offer_id], offers_by_id[offer_id]))
+        removed = [offer for offer_id, offer in previous.items() if offer_id not in offers_by_id]
+        self.offers, self._fingerprints = offers_by_id, fingerprints
+        return OfferDelta(added, removed, changed, self.clock())
+
+    def poll(self):
+        """ Runs the search once, and notifies subscribers if anything changed.
+        Returns:
+            OfferDelta
+        """
+        delta = self.update(self.client.search_offers(query=self.query, **self.search_kwargs))
+        if delta.added or delta.removed or delta.changed:
+            for callback in list(self._callbacks):
+                try:
+                    callback(delta)
+                except Exception as err:
+                    print("Offer feed callback %r failed: %s"%(callback, err))
+        return delta
+
+    def stream(self, iterations=None, sleep=time.sleep):
+        """ Polls every `interval_s` seconds, yielding each `OfferDelta` that isn't empty.
+            The first delta has every matching offer as added.
+        Args:
+            iterations (int, optional): Stop after this many polls. (default: poll forever)
+        """
+        polls = 0
+        while iterations is None or polls < iterations:
+            polls += 1
+            delta = self.poll()
+            if delta.added or delta.removed or delta.changed:
+                yield delta
+            if iterations is None or polls < iterations:
+                sleep(self.interval_s)
+
+    def subscribe(self, callback):
+        """ Calls `callback(delta)` with each `OfferDelta` that isn't empty.
+        Returns:
+            callable: `callback`, so this can be used as a decorator.
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def start(self):
+        """ Polls every `interval_s` seconds in a background thread, notifying subscribers.
+        Returns:
+            OfferFeed: self
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name="vastai-offer-feed", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closing.is_set():
+            try:
+                self.poll()
+            except Exception as err:
+                print("Offer feed poll failed: %s"%err)
+            self._closing.wait(self.interval_s)
+
+    def close(self):
+        """ Stops the background polls. """
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
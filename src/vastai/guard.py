@@ -0,0 +1,358 @@
+""" Budget guard: stops or destroys instances which overspend or sit idle.
+
+A `BudgetGuard` checks the fleet every `check_every_s` seconds in a background thread
+and enforces `Budget`s (total or hourly spend, per label or for the whole fleet) and
+`IdleRule`s (e.g. `gpu_util` at most 5% for 30 minutes):
+
+    guard = BudgetGuard(client, budgets=[Budget(50), Budget(2, label="eval", per_hour=True)],
+                        idle_rules=[IdleRule(max_gpu_util=5, minutes=30)]).start()
+
+Each check makes one `/instances` request, through `VastClient.refresh_instances`, plus
+one request per instance acted on. Idle tracking only looks at instances whose data
+changed in a refresh, whoever made it (see `VastClient.refresh_listeners`). Stops and
+destroys run concurrently.
+
+`gpu_util` in `/instances` is a coarse snapshot. Given a `TelemetryStore` (or a running
+`TelemetryCollector`), idle rules use the peaks of its samples instead, wherever they
+cover the rule's window, and can also require low CPU utilization. A rule with a
+`process` pattern only acts once `pgrep -f` finds no matching process on the instance;
+these checks run concurrently, and only on instances which are otherwise idle:
+
+    collector = TelemetryCollector(client).start()
+    guard = BudgetGuard(client, idle_rules=[IdleRule(max_gpu_util=5, max_cpu_util=10, minutes=30,
+                                                     process="python train.py")],
+                        telemetry=collector).start()
+"""
+import shlex
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from vastai.api import InstanceDiff
+from vastai.costs import FleetCosts
+
+actions = ("stop", "destroy")
+""" Actions a rule can take. A destroy overrides a stop of the same instance. """
+
+def _check_action(action):
+    if action not in actions:
+        raise ValueError("action should be one of %s, got %r."%(", ".join(actions), action))
+
+class Budget:
+    """ A spending limit for the instances with one label, or for the whole fleet.
+    """
+    def __init__(self, limit, label=None, per_hour=False, action="stop"):
+        """
+        Args:
+            limit (float): Dollars, or dollars per hour if `per_hour`.
+            label (str, optional): Only count instances with this label. (default: the whole fleet)
+            per_hour (bool): Limit the burn rate, rather than the spend accrued since each instance
+                was created. Over the limit, the most expensive instances are acted on until the
+                burn rate is back under it. Over a total limit, all of them are. (default: False)
+            action (str): 'stop' or 'destroy'. Stopped instances still pay for storage. (default: 'stop')
+        """
+        _check_action(action)
+        self.limit = limit
+        self.label = label
+        self.per_hour = per_hour
+        self.action = action
+
+    def __repr__(self):
+        return "Budget(%s%s%s)"%("$%.2f/hr"%self.limit if self.per_hour else "$%.2f"%self.limit,
+                                 " for label %r"%self.label if self.label is not None else "",
+                                 ", destroy" if self.action == "destroy" else "")
+
+class IdleRule:
+    """ Acts on running instances whose `gpu_util` stays at or below `max_gpu_util` for `minutes`.
+        Instances which don't report `gpu_util` aren't considered idle.
+    """
+    def __init__(self, max_gpu_util=5., minutes=30., label=None, action="stop", max_cpu_util=None, process=None):
+        """
+        Args:
+            max_gpu_util (float): Highest `gpu_util` (%) counted as idle. (default: 5)
+            minutes (float): Minutes an instance has to stay idle. (default: 30)
+            label (str, optional): Only apply to instances with this label. (default: all instances)
+            action (str): 'stop' or 'destroy'. (default: 'stop')
+            max_cpu_util (float, optional): Highest CPU utilization (%) counted as idle. Only checked
+                on instances with telemetry samples. (default: CPU utilization isn't checked)
+            process (str, optional): `pgrep -f` pattern of a process which keeps an instance busy
+                while it runs, e.g. a training script. (default: no process check)
+        """
+        _check_action(action)
+        self.max_gpu_util = max_gpu_util
+        self.minutes = minutes
+        self.label = label
+        self.action = action
+        self.max_cpu_util = max_cpu_util
+        self.process = process
+
+    def __repr__(self):
+        return "IdleRule(gpu_util <= %g%%%s%s for %g min%s%s)"%(
+               self.max_gpu_util, ", cpu_util <= %g%%"%self.max_cpu_util if self.max_cpu_util is not None else "",
+               ", no %r process"%self.process if self.process is not None else "",
+               self.minutes, " for label %r"%self.label if self.label is not None else "",
+               ", destroy" if self.action == "destroy" else "")
+
+def _is_running(inst):
+    return getattr(inst, 'actual_status', None) == 'running' and getattr(inst, 'intended_status', None) != 'stopped'
+
+def process_alive(inst, pattern):
+    """ Whether a process whose command line matches `pattern` is running on an instance, using `pgrep -f` over ssh.
+    Args:
+        inst (Instance): A running instance.
+        pattern (str): Regular expression, as for `pgrep -f`.
+    Returns:
+        bool
+    """
+    from paramiko.client import SSHClient, AutoAddPolicy
+    ssh_client = SSHClient()
+    ssh_client.set_missing_host_key_policy(AutoAddPolicy)
+    with inst.client.hooks.span('ssh', 'process_alive', instance_id=inst.id) as event:
+        try:
+            ssh_client.connect(inst.ssh_host, port=int(inst.ssh_port), username='root',
+                               key_filename=inst.client._get_ssh_key_file(), timeout=30)
+            _, stdout, _ = ssh_client.exec_command("pgrep -f -- %s"%shlex.quote(pattern))
+            event.status = stdout.channel.recv_exit_status()
+        finally:
+            ssh_client.close()
+    return event.status == 0
+
+class BudgetGuard:
+    """ Enforces `Budget`s and `IdleRule`s on a client's instances.
+    """
+    def __init__(self, client, budgets=(), idle_rules=(), check_every_s=60, max_workers=8, dry_run=False,
+                 clock=time.time, telemetry=None, process_check=process_alive):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            budgets (list of Budget): Spending limits.
+            idle_rules (list of IdleRule): Idle instance rules.
+            check_every_s (float): Seconds between background checks. (default: 60)
+            max_workers (int): Stops, destroys and process checks to run at once. (default: 8)
+            dry_run (bool): Only record what would be done, in `actions`. (default: False)
+            telemetry (TelemetryStore or TelemetryCollector, optional): High resolution samples for idle rules.
+            process_check (callable): `process_check(instance, pattern) -> bool`, for idle rules with a
+                `process`. (default: `process_alive`)
+        """
+        self.client = client
+        self.budgets = list(budgets)
+        self.idle_rules = list(idle_rules)
+        self.check_every_s = check_every_s
+        self.max_workers = max_workers
+        self.dry_run = dry_run
+        self.clock = clock
+        self.actions = []
+        """ `(time, instance id, action, reason)` for each instance acted on """
+        self.totals = None
+        """ `FleetCosts.total()` as of the last check """
+        self.idle_since = {}
+        """ `{instance id: time}` since which each running instance has been idle """
+        self.telemetry = getattr(telemetry, 'store', telemetry)
+        self.process_check = process_check
+        self.active_at = {}
+        """ `{instance id: time}` an idle rule's process was last found running """
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = threading.Event()
+        self._track_idle(InstanceDiff(list(client.instances), [], {}))
+        client.refresh_listeners.append(self._track_idle)
+
+    def _track_idle(self, diff):
+        """ Updates `idle_since` for instances which were added or changed. """
+        with self._lock:
+            self._track_idle_locked(diff, self.clock())
+
+    def _track_idle_locked(self, diff, now):
+        known = self.client._instance_index
+        for inst_id in list(self.idle_since) + list(self._pending) + list(self.active_at):
+            if inst_id not in known:
+                self.idle_since.pop(inst_id, None)
+                self._pending.pop(inst_id, None)
+                self.active_at.pop(inst_id, None)
+        updated = [inst.id for inst in diff.added] + [inst_id for inst_id, changes in diff.changed.items()
+                   if 'gpu_util' in changes or 'actual_status' in changes or 'intended_status' in changes]
+        threshold = max([rule.max_gpu_util for rule in self.idle_rules] or [None])
+        for inst_id in updated:
+            inst = known.get(inst_id)
+            if inst is None:
+                continue
+            if self._pending.get(inst_id) == 'stop' and not _is_running(inst):
+                del self._pending[inst_id]
+            util = getattr(inst, 'gpu_util', None)
+            if threshold is None or not _is_running(inst) or util is None or util > threshold:
+                self.idle_since.pop(inst_id, None)
+            elif inst_id not in self.idle_since:
+                self.idle_since[inst_id] = now
+
+    def _budget_actions(self, instances, costs, decisions):
+        """ Decides on instances over budget. `costs` must be the `FleetCosts` of `instances`. """
+        pending = np.array([inst.id in self._pending for inst in instances], dtype=bool)
+        running = np.array([_is_running(inst) for inst in instances], dtype=bool) & ~pending
+        for budget in self.budgets:
+            group = np.ones(len(costs), dtype=bool) if budget.label is None else \
+                    np.array([label == budget.label for label in costs.labels], dtype=bool)
+            if budget.per_hour:
+                # Count stops and destroys which are already under way as done.
+                plan = dict(self._pending)
+                plan.update((inst_id, decision[1]) for inst_id, decision in decisions.items())
+                excess = costs.burn_rate(plan)[group].sum() - budget.limit
+                if excess <= 0:
+                    continue
+                candidates = np.flatnonzero(group & running & ~np.isin(costs.ids, list(plan)))
+                savings = costs.compute[candidates] + (costs.storage[candidates] if budget.action == "destroy" else 0.)
+                order = np.argsort(-savings, kind="stable")
+                count = min(len(order), int(np.searchsorted(np.cumsum(savings[order]), excess - 1e-9)) + 1)
+                chosen = candidates[order[:count]]
+                reason = "%r: burning $%.2f/hr"%(budget, budget.limit + excess)
+            else:
+                spent = costs.accrued()[group].sum()
+                if spent <= budget.limit:
+                    continue
+                chosen = np.flatnonzero(group & (running if budget.action == "stop" else ~pending))
+                reason = "%r: spent $%.2f"%(budget, spent)
+            for i in chosen:
+                self._decide(decisions, instances[i], budget.action, reason)
+
+    def _idle_actions(self, now, decisions):
+        """ Decides on idle instances.
+        Returns:
+            list: `(instance, rule, reason)` for idle instances whose rule needs a process check first.
+        """
+        candidates = list(self.idle_since)
+        if self.telemetry is not None:
+            candidates += [inst_id for inst_id in self.telemetry.instances() if inst_id not in self.idle_since]
+        probes = []
+        for inst_id in candidates:
+            inst = self.client._instance_index.get(inst_id)
+            if inst is None or inst_id in self._pending or not _is_running(inst):
+                continue
+            for rule in self.idle_rules:
+                if rule.label is not None and getattr(inst, 'label', None) != rule.label:
+                    continue
+                idle_for = self._idle_for(inst, rule, now)
+                if idle_for is None:
+                    continue
+                reason = "%r: idle for %.0f min"%(rule, idle_for/60)
+                if rule.process is None:
+                    self._decide(decisions, inst, rule.action, reason)
+                else:
+                    probes.append((inst, rule, reason))
+        return probes
+
+    def _idle_for(self, inst, rule, now):
+        """ Seconds an instance has been idle under `rule`, or None if it hasn't been for `rule.minutes`. """
+        window = rule.minutes*60
+        if now - self.active_at.get(inst.id, -np.inf) < window:
+            return None
+        peaks = None if self.telemetry is None else self.telemetry.peaks(inst.id, window, now)
+        if peaks is not None:
+            if peaks['gpu_util'] <= rule.max_gpu_util and \
+                    (rule.max_cpu_util is None or peaks['cpu_util'] <= rule.max_cpu_util):
+                return window
+            return None
+        since = self.idle_since.get(inst.id)
+        if since is None or inst.gpu_util > rule.max_gpu_util or now - since < window:
+            return None
+        return now - since
+
+    def _probe(self, probes, now):
+        """ Runs the process checks of `probes` concurrently.
+        Returns:
+            list: the probes which found no matching process.
+        """
+        def alive(probe):
+            inst, rule, _ = probe
+            try:
+                return self.process_check(inst, rule.process)
+            except Exception as err:
+                print("Process check on instance %s failed, treating it as busy: %s"%(inst.id, err))
+                return True
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(probes))) as executor:
+            results = list(executor.map(alive, probes))
+        idle = []
+        with self._lock:
+            for probe, is_alive in zip(probes, results):
+                if is_alive:
+                    self.active_at[probe[0].id] = now
+                else:
+                    idle.append(probe)
+        return idle
+
+    def _decide(self, decisions, inst, action, reason):
+        if inst.id in decisions and decisions[inst.id][1] == "destroy":
+            return
+        decisions[inst.id] = (inst, action, reason)
+
+    def check(self):
+        """ Refreshes the instances once and acts on every budget or idle rule they break.
+        Returns:
+            list: `(instance, action, reason)` for each instance acted on.
+        """
+        self.client.refresh_instances()
+        now = self.clock()
+        decisions = OrderedDict()
+        # Other threads may refresh `client.instances`, so costs and actions use the same list.
+        instances = self.client.instances
+        costs = FleetCosts(instances, now)
+        self.totals = costs.total()
+        with self._lock:
+            if self.budgets:
+                self._budget_actions(instances, costs, decisions)
+            probes = self._idle_actions(now, decisions) if self.idle_rules else []
+        idle = self._probe(probes, now) if probes else []
+        with self._lock:
+            for inst, rule, reason in idle:
+                self._decide(decisions, inst, rule.action, reason)
+            decisions = list(decisions.values())
+            for inst, action, reason in decisions:
+                print("Budget guard: %s%s instance %s. %s"%("would " if self.dry_run else "", action, inst.id, reason))
+                self.actions.append((now, inst.id, action, reason))
+                self.idle_since.pop(inst.id, None)
+                if not self.dry_run:
+                    self._pending[inst.id] = action
+        if decisions and not self.dry_run:
+            self._apply(decisions)
+        return decisions
+
+    def _apply(self, decisions):
+        def act(decision):
+            inst, action, _ = decision
+            try:
+                inst.destroy() if action == "destroy" else inst.stop()
+            except Exception as err:
+                print("Failed to %s instance %s: %s"%(action, inst.id, err))
+                with self._lock:
+                    self._pending.pop(inst.id, None)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(decisions))) as executor:
+            list(executor.map(act, decisions))
+
+    def start(self):
+        """ Checks every `check_every_s` seconds in a background thread.
+        Returns:
+            BudgetGuard: self
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name="vastai-budget-guard", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closing.is_set():
+            try:
+                self.check()
+            except Exception as err:
+                print("Budget guard check failed: %s"%err)
+            self._closing.wait(self.check_every_s)
+
+    def close(self):
+        """ Stops the background checks, and stops tracking refreshes. """
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._track_idle in self.client.refresh_listeners:
+            self.client.refresh_listeners.remove(self._track_idle)
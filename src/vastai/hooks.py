@@ -0,0 +1,247 @@
+""" Instrumentation hooks for api requests, json decoding, ssh commands, tunnels and status polling.
+
+Hooks are callables which receive a `CallEvent` after each instrumented call:
+
+    from vastai.hooks import hooks, HistogramCollector
+    collector = hooks.register(HistogramCollector())
+    client.get_instances()
+    print(collector.summary())
+
+Instrumented calls check whether any hook is registered before doing anything else,
+so with no hooks registered the overhead is one truth test per call.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+
+_id_re = re.compile(r"/\d+(?=/|$)")
+
+def endpoint_name(url, base_url=""):
+    """ Reduces a request url to an endpoint name, e.g. `/instances/{id}/`.
+    Args:
+        url (str): Full request url.
+        base_url (str): Prefix to strip, e.g. the api base url.
+    """
+    path = url.split("?", 1)[0]
+    if base_url and path.startswith(base_url):
+        path = path[len(base_url):]
+    return _id_re.sub("/{id}", path)
+
+class CallEvent:
+    """ One instrumented call.
+    Attrs:
+        kind (str): 'http', 'json', 'ssh', 'tunnel' or 'wait'.
+        name (str): Endpoint (e.g. `/instances/{id}/`) or operation name (e.g. `run_command`).
+        method (str): HTTP method, or None.
+        status: HTTP status code, command exit status or instance status, or None.
+        bytes_sent (int): Request body size, or None.
+        bytes_received (int): Response body size, or None.
+        retries (int): Number of earlier attempts of this call.
+        start (float): Start time, in seconds since the epoch.
+        duration (float): Seconds taken.
+        error (Exception): Exception raised by the call, or None.
+        attrs (dict): Other call specific attributes, e.g. `instance_id`.
+    """
+    __slots__ = ("kind", "name", "method", "status", "bytes_sent", "bytes_received", "retries",
+                 "start", "duration", "error", "attrs")
+
+    def __init__(self, kind, name, method=None, status=None, bytes_sent=None, bytes_received=None,
+                 retries=0, start=None, duration=None, error=None, **attrs):
+        self.kind, self.name, self.method, self.status = kind, name, method, status
+        self.bytes_sent, self.bytes_received, self.retries = bytes_sent, bytes_received, retries
+        self.start, self.duration, self.error, self.attrs = start, duration, error, attrs
+
+    def __repr__(self):
+        return "CallEvent(%s)"%", ".join("%s=%r"%(k, getattr(self, k)) for k in self.__slots__
+                                        if getattr(self, k) not in (None, {}))
+
+class _Span:
+    """ Times a block and emits a `CallEvent` when it exits. See `HookRegistry.span`. """
+    __slots__ = ("registry", "event", "_t0")
+
+    def __init__(self, registry, event):
+        self.registry, self.event = registry, event
+
+    def __enter__(self):
+        self.event.start = time.time()
+        self._t0 = time.perf_counter()
+        return self.event
+
+    def __exit__(self, exc_type, exc, tb):
+        self.event.duration = time.perf_counter() - self._t0
+        self.event.error = exc
+        self.registry.emit(self.event)
+
+class _NullSpan:
+    """ Stands in for `_Span` when no hooks are registered. """
+    __slots__ = ("event",)
+
+    def __init__(self):
+        self.event = CallEvent(None, None)
+
+    def __enter__(self):
+        return self.event
+
+    def __exit__(self, *exc):
+        # Discard anything the block attached, so the shared event never grows.
+        self.event.attrs = {}
+
+class HookRegistry:
+    """ Holds hooks and dispatches `CallEvent`s to them. Evaluates as False while empty.
+    """
+    def __init__(self):
+        self._hooks = []
+        self._null_span = _NullSpan()
+
+    def __bool__(self):
+        return bool(self._hooks)
+
+    def __len__(self):
+        return len(self._hooks)
+
+    def register(self, hook):
+        """ Adds a hook.
+        Args:
+            hook (callable): Called with each `CallEvent`.
+        Returns:
+            The hook, so registration can be chained with construction.
+        """
+        self._hooks = self._hooks + [hook]
+        return hook
+
+    def unregister(self, hook):
+        """ Removes a hook registered with `register`. """
+        self._hooks = [h for h in self._hooks if h != hook]
+
+    def clear(self):
+        self._hooks = []
+
+    def emit(self, event):
+        """ Passes `event` to every hook. Errors raised by hooks are printed, not raised.
+        """
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception as err:
+                print("Error in hook %r: %s"%(hook, err))
+
+    def span(self, kind, name, **attrs):
+        """ Context manager which times its block and emits a `CallEvent`. The event is returned
+            by `__enter__`, so the block can set e.g. `event.status`.
+
+                with hooks.span('ssh', 'run_command', instance_id=inst.id) as event:
+                    ...
+                    event.status = exit_status
+        """
+        if not self._hooks:
+            return self._null_span
+        return _Span(self, CallEvent(kind, name, **attrs))
+
+hooks = HookRegistry()
+""" Default registry, used by every `VastClient` unless given another one. """
+
+class HistogramCollector:
+    """ In-memory latency histograms, keyed by `(kind, name, method)`.
+        Durations are counted in logarithmically spaced buckets, from 100us to 100s.
+        Events may be passed from several threads at once.
+    """
+    bucket_edges = [10**(-4 + i/4.) for i in range(25)]
+    """ Upper bucket edges, in seconds. Longer calls go in an overflow bucket. """
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        """ `{(kind, name, method): list of bucket counts}` """
+        self.totals = OrderedDict()
+        """ `{(kind, name, method): dict(count, errors, seconds, bytes_sent, bytes_received, retries)}` """
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event.kind, event.name, event.method)
+        bucket = bisect_left(self.bucket_edges, event.duration)
+        error = event.error is not None or (type(event.status) is int and event.status >= 400)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = [0]*(len(self.bucket_edges) + 1)
+                self.totals[key] = dict(count=0, errors=0, seconds=0., bytes_sent=0, bytes_received=0, retries=0)
+            self.histograms[key][bucket] += 1
+            totals = self.totals[key]
+            totals["count"] += 1
+            totals["errors"] += error
+            totals["seconds"] += event.duration
+            totals["bytes_sent"] += event.bytes_sent or 0
+            totals["bytes_received"] += event.bytes_received or 0
+            totals["retries"] += event.retries or 0
+
+    def quantile(self, key, q):
+        """ Approximate `q` quantile of durations for `key`, as the upper edge of its bucket. """
+        with self._lock:
+            counts = list(self.histograms[key])
+        idx = bisect_left(list(accumulate(counts)), q * sum(counts))
+        return self.bucket_edges[idx] if idx < len(self.bucket_edges) else float("inf")
+
+    def summary(self):
+        """ Per key call counts, errors, bytes, mean and approximate p50/p90/p99 durations.
+        Returns:
+            pandas.DataFrame: indexed by kind, name and method, slowest total time first.
+        """
+        import pandas as pd
+        with self._lock:
+            snapshot = [(key, dict(totals)) for key, totals in self.totals.items()]
+        rows = []
+        for key, totals in snapshot:
+            row = dict(zip(("kind", "name", "method"), key), **totals)
+            row["mean"] = totals["seconds"]/totals["count"]
+            for q in (.5, .9, .99):
+                row["p%i"%(q*100)] = self.quantile(key, q)
+            rows.append(row)
+        df = pd.DataFrame(rows, columns=["kind", "name", "method", "count", "errors", "seconds", "mean",
+                                         "p50", "p90", "p99", "bytes_sent", "bytes_received", "retries"])
+        return df.set_index(["kind", "name", "method"]).sort_values("seconds", ascending=False)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.totals.clear()
+
+class OpenTelemetryExporter:
+    """ Exports `CallEvent`s as OpenTelemetry spans. Requires the `opentelemetry-api` package,
+        plus an sdk and exporter configured by the application.
+    """
+    def __init__(self, tracer_provider=None, tracer_name="vastai"):
+        """
+        Args:
+            tracer_provider (optional): OpenTelemetry tracer provider. (default: the global provider)
+            tracer_name (str): Instrumentation name. (default: 'vastai')
+        Raises:
+            ImportError: if `opentelemetry` isn't installed.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetryExporter requires opentelemetry: pip install opentelemetry-api")
+        self._trace = trace
+        self.tracer = trace.get_tracer(tracer_name, tracer_provider=tracer_provider)
+
+    def __call__(self, event):
+        start_ns = int(event.start * 1e9)
+        attributes = {"vastai.kind": event.kind, "vastai.retries": event.retries}
+        if event.method is not None:
+            attributes["http.method"] = event.method.upper()
+        if type(event.status) is int:
+            attributes["http.status_code" if event.kind == "http" else "vastai.status"] = event.status
+        elif event.status is not None:
+            attributes["vastai.status"] = str(event.status)
+        for key in ("bytes_sent", "bytes_received"):
+            if getattr(event, key) is not None:
+                attributes["vastai." + key] = getattr(event, key)
+        for key, value in event.attrs.items():
+            if value is not None:
+                attributes["vastai." + key] = value if isinstance(value, (str, bool, int, float)) else str(value)
+        span = self.tracer.start_span("%s %s"%(event.kind, event.name), start_time=start_ns, attributes=attributes)
+        if event.error is not None:
+            span.record_exception(event.error)
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, str(event.error)))
+        span.end(end_time=start_ns + int(event.duration * 1e9))
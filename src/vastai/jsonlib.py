@@ -0,0 +1,100 @@
+""" JSON encoding and decoding through the fastest library available.
+
+`/bundles` responses run to tens of megabytes, and decoding them (and encoding them again
+for `--raw` output) is a large share of a command's run time. `loads` and `dumps` use
+`orjson` when it's installed, and the standard library `json` otherwise. Set
+`VAST_JSON=json` to force the standard library, or switch at run time with `use`:
+
+    from vastai import jsonlib
+    jsonlib.backend                 # 'orjson' or 'json'
+    rows = jsonlib.loads(resp.content)
+    print(jsonlib.dumps(rows, indent=1, sort_keys=True))
+
+Call them as `jsonlib.loads`/`jsonlib.dumps` rather than importing the functions, so `use`
+takes effect everywhere. Both backends lay JSON out like `json.dumps`, but the output isn't
+always byte for byte the same: orjson doesn't escape non-ASCII characters, writes e.g.
+`1e-05` as `1e-5`, and writes nan as null. It also decodes integers over 64 bits as floats.
+"""
+import json
+import os
+
+backends = ("orjson", "json")
+""" Supported backends, fastest first. """
+
+backend = None
+""" Name of the backend in use. """
+
+def _json_loads(data):
+    return json.loads(data)
+
+def _json_dumps(obj, indent=None, sort_keys=False):
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys)
+
+def _orjson_functions():
+    import orjson
+    base_option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, which orjson rejects. Invalid JSON raises the standard library's error.
+            return json.loads(data)
+
+    def dumps(obj, indent=None, sort_keys=False):
+        # orjson writes compact JSON, or JSON indented by 2. Lay it out like `json.dumps` from the indented form:
+        # strings can't hold raw newlines or tabs, so every newline and tab below is layout.
+        option = base_option | orjson.OPT_INDENT_2 | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            out = orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError: # Types orjson can't serialize, e.g. integers over 64 bits.
+            return _json_dumps(obj, indent, sort_keys)
+        if indent == 2:
+            return out
+        # Turn each level of indentation into a tab, deepest first so no line is matched twice.
+        depth = 1
+        while "\n" + "  "*depth in out:
+            depth += 1
+        for depth in range(depth - 1, 0, -1):
+            out = out.replace("\n" + "  "*depth, "\n" + "\t"*depth)
+        if indent is not None:
+            return out.replace("\t", " "*indent)
+        # Unindented, json.dumps separates items with ", " and keys from values with ": ".
+        return out.replace("\t", "").replace(",\n", ", ").replace("\n", "")
+
+    return loads, dumps
+
+def use(name=None):
+    """ Switches the backend used by `loads` and `dumps`.
+    Args:
+        name (str, optional): One of `backends`. (default: the fastest one installed)
+    Raises:
+        ValueError: if `name` isn't one of `backends`.
+        ImportError: if the backend isn't installed.
+    Returns:
+        str: the backend now in use
+    """
+    global backend, loads, dumps
+    if name is None:
+        for name in backends[:-1]:
+            try:
+                return use(name)
+            except ImportError:
+                continue
+        name = "json"
+    if name not in backends:
+        raise ValueError("JSON backend should be one of %s, got %r."%(", ".join(backends), name))
+    loads, dumps = _orjson_functions() if name == "orjson" else (_json_loads, _json_dumps)
+    backend = name
+    return backend
+
+loads = _json_loads
+""" Decodes JSON from bytes or str.
+    Raises:
+        ValueError: if the data isn't valid JSON.
+"""
+
+dumps = _json_dumps
+""" Encodes an object as JSON, like `json.dumps(obj, indent=None, sort_keys=False)`. Returns str. """
+
+use(os.environ.get("VAST_JSON") or None)
@@ -0,0 +1,223 @@
+""" Warm pool of standby instances.
+
+Cold starting an instance (rent an offer, pull the image, start the container) takes
+minutes. A `WarmPool` keeps a number of instances of one spec launched ahead of time,
+either running or stopped, and hands them out with `WarmPool.claim`. Stopped standby
+instances only bill storage, but still take a container start to claim.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class WarmPool:
+    """ Keeps `size` standby instances matching `query` ready to be claimed.
+        Standby instances are tagged with `label`, so a new pool with the same label
+        adopts instances left over by a previous one.
+    """
+    def __init__(self, client, query, size=1, standby='stopped', label='vastai-warm-pool',
+                 claimed_label=None, sort_order='dph_total', check_every_s=15, **create_kwargs):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            query (str): Offer query, see `VastClient.search_offers`.
+            size (int): Number of standby instances to keep. (default: 1)
+            standby (str): Keep standby instances 'stopped' (only storage is billed) or
+                'running' (claimed instantly). (default: 'stopped')
+            label (str): Label marking standby instances. (default: 'vastai-warm-pool')
+            claimed_label (str, optional): Label set on claimed instances. (default: `label`+'-claimed')
+            sort_order (str): Order to rank offers by. (default: 'dph_total')
+            check_every_s (float): Seconds between background refills. (default: 15)
+            **create_kwargs: Passed to `VastClient.create_instances`, e.g. `image`, `disk`, `onstart_cmd`.
+        """
+        if standby not in ('stopped', 'running'):
+            raise ValueError("standby should be 'stopped' or 'running', got %r."%standby)
+        self.client = client
+        self.query = query
+        self.size = size
+        self.standby = standby
+        self.label = label
+        self.claimed_label = claimed_label or label+'-claimed'
+        self.sort_order = sort_order
+        self.check_every_s = check_every_s
+        self.create_kwargs = create_kwargs
+        self.members = OrderedDict()
+        """ `{instance_id: state}` where state is 'launching', 'stopping' or 'ready' """
+        self.claim_latencies = []
+        """ Seconds taken by each `claim` """
+        self.standby_cost = 0.
+        """ $ spent on standby instances so far, as accrued by `refill` """
+        self._last_refill = None
+        self._claimed = set()
+        self._lock = threading.Condition()
+        self._thread = None
+        self._closing = threading.Event()
+        self._refill_now = threading.Event()
+
+    def refill(self):
+        """ Checks on standby instances and launches new ones to bring the pool back up to `size`.
+            Uses one `/instances` request, plus one `/bundles` request if instances need launching.
+        """
+        instances = {inst.id: inst for inst in self.client.get_instances()}
+        now = time.time()
+        to_stop, to_destroy = [], []
+        with self._lock:
+            if self._last_refill is not None:
+                self.standby_cost += self.standby_cost_per_hour(instances) * (now - self._last_refill)/3600.
+            self._last_refill = now
+            # Claimed ids only need remembering until the instance is relabeled or gone.
+            self._claimed = {inst_id for inst_id in self._claimed if inst_id in instances
+                             and getattr(instances[inst_id], 'label', None) == self.label}
+            for inst in instances.values():
+                if getattr(inst, 'label', None) == self.label and inst.id not in self.members \
+                        and inst.id not in self._claimed:
+                    self.members[inst.id] = 'launching'
+            for inst_id, state in list(self.members.items()):
+                inst = instances.get(inst_id)
+                if inst is not None and inst.setup_error():
+                    print("Standby instance %s failed to launch: %s"%(inst_id, inst.setup_error()))
+                    to_destroy.append(inst)
+                    inst = None
+                if inst is None:
+                    del self.members[inst_id]
+                elif state == 'launching' and inst._has_status('running'):
+                    if self.standby == 'stopped':
+                        to_stop.append(inst)
+                        self.members[inst_id] = 'stopping'
+                    else:
+                        self.members[inst_id] = 'ready'
+                elif state == 'launching' and self.standby == 'stopped' and inst._has_status(['exited', 'stopped']) \
+                        and getattr(inst, 'intended_status', None) == 'stopped':
+                    self.members[inst_id] = 'ready'
+                elif state == 'stopping' and inst._has_status(['exited', 'stopped']):
+                    self.members[inst_id] = 'ready'
+            deficit = self.size - len(self.members)
+            self._lock.notify_all()
+        for inst in to_stop:
+            inst.stop()
+        for inst in to_destroy:
+            inst.destroy()
+        if deficit > 0:
+            offers = self.client.search_offers(sort_order=self.sort_order, query=self.query)
+            created = self.client.create_instances(offers, deficit, label=self.label, **self.create_kwargs)
+            with self._lock:
+                for inst_id in created:
+                    self.members[inst_id] = 'launching'
+
+    def claim(self, timeout=600, check_every_s=5):
+        """ Hands out a standby instance, starting it first if it's stopped.
+            If no standby instance is ready, waits for the background refill to provide one.
+        Args:
+            timeout (float): Seconds to wait for an instance to be ready and running. (default: 600)
+            check_every_s (float): Seconds between status checks while starting. (default: 5)
+        Raises:
+            TimeoutError: if no instance could be claimed within `timeout`.
+            `vastai.exceptions.UnhandledSetupError`: if the claimed instance fails to start.
+                An instance which can't be started is destroyed, since it's no longer in the pool.
+        Returns:
+            Instance: A running instance, labeled with `claimed_label`. It no longer belongs to the pool.
+        """
+        start_time = time.time()
+        with self._lock:
+            while True:
+                ready = [inst_id for inst_id, state in self.members.items() if state == 'ready']
+                if ready:
+                    inst_id = ready[0]
+                    del self.members[inst_id]
+                    self._claimed.add(inst_id)
+                    self._refill_now.set()
+                    break
+                remaining = timeout - (time.time() - start_time)
+                if remaining <= 0:
+                    raise TimeoutError("No standby instance was ready within %is."%timeout)
+                self._lock.wait(remaining)
+        inst = self.client.get_instance(inst_id)
+        if inst is None:
+            # Destroyed since the last refill, try the next one.
+            return self.claim(timeout - (time.time() - start_time), check_every_s)
+        try:
+            inst.set_label(self.claimed_label)
+            if not inst._has_status('running'):
+                inst.start()
+                inst = inst.wait_until_running(check_every_s=check_every_s,
+                                               timeout=max(0, timeout - (time.time() - start_time)))
+        except Exception:
+            print("Claimed instance %s failed to start, destroying it."%inst_id)
+            try:
+                inst.destroy()
+                with self._lock:
+                    self._claimed.discard(inst_id)
+            except Exception as err:
+                print("Couldn't destroy instance %s: %s"%(inst_id, err))
+            raise
+        self.claim_latencies.append(time.time() - start_time)
+        return inst
+
+    def standby_cost_per_hour(self, instances=None):
+        """ Current $/hr of all pool members: `dph_total` while running, `storage_total_cost` while stopped.
+        Args:
+            instances (dict, optional): Refreshed instances by id. (default: `client.instances`)
+        """
+        if instances is None:
+            instances = {inst.id: inst for inst in self.client.instances}
+        cost = 0.
+        for inst_id in self.members:
+            inst = instances.get(inst_id)
+            if inst is None: continue
+            if not inst.setup_error() and inst._has_status('running'):
+                cost += inst.dph_total or 0.
+            else:
+                cost += getattr(inst, 'storage_total_cost', None) or 0.
+        return cost
+
+    def report(self):
+        """ Weighs standby cost against launch latency saved by claiming instead of cold starting.
+            The cold start latency is the median accepted-to-running time in `client.timeline`.
+        Returns:
+            dict: claims, mean claim latency, cold start latency, total seconds saved, standby cost
+                accrued, standby cost per hour, and $ per hour of latency saved.
+        """
+        latencies = self.client.timeline.latencies()["start"].dropna()
+        cold_start_s = float(latencies.median()) if len(latencies) else None
+        claims = len(self.claim_latencies)
+        mean_claim_s = sum(self.claim_latencies)/claims if claims else None
+        saved_s = sum(max(0., cold_start_s - s) for s in self.claim_latencies) if cold_start_s is not None else None
+        return dict(claims=claims, mean_claim_s=mean_claim_s, cold_start_s=cold_start_s, saved_s=saved_s,
+                    standby_cost=self.standby_cost, standby_cost_per_hour=self.standby_cost_per_hour(),
+                    cost_per_hour_saved=self.standby_cost/(saved_s/3600.) if saved_s else None)
+
+    def start(self):
+        """ Refills the pool every `check_every_s` seconds in a background thread.
+        Returns:
+            WarmPool: self
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name="vastai-warm-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closing.is_set():
+            self._refill_now.clear()
+            try:
+                self.refill()
+            except Exception as err:
+                print("Warm pool refill failed: %s"%err)
+            # Wakes up early after a claim, or when closing.
+            self._refill_now.wait(self.check_every_s)
+
+    def close(self, destroy=False):
+        """ Stops the background refill.
+        Args:
+            destroy (bool): Also destroy all unclaimed standby instances. (default: False)
+        """
+        self._closing.set()
+        self._refill_now.set()
+        if self._thread is not None:
+            self._thread.join()
+        if destroy:
+            with self._lock:
+                members, self.members = list(self.members), OrderedDict()
+            for inst in self.client.get_instances():
+                if inst.id in members:
+                    inst.destroy()
@@ -0,0 +1,215 @@
+""" Pricing autopilot for hosts: reprices listed machines against the market.
+
+A `PricingAutopilot` compares each listed machine with the offers it competes with: those
+with the same `gpu_name` and `num_gpus`, and a `reliability2` within `reliability_band` of
+the machine's (or the whole group, when that leaves too few). A `PricingStrategy` turns a
+percentile of their per GPU prices into a target price, and new asks for every machine
+whose price should change are sent concurrently through `MachineList.list`:
+
+    strategy = PricingStrategy(percentile=40, undercut=.02, min_price={"RTX 3090": .25})
+    autopilot = PricingAutopilot(client, strategy, check_every_s=3600).start()
+    autopilot.changes   # (time, machine id, old price, new price)
+
+Each check makes two requests, `/machines` and `/bundles`, plus one per repriced machine.
+Competitor prices for all machines are computed from the one offer search with numpy.
+"""
+import threading
+import time
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from vastai.api import MachineList
+
+PriceChange = namedtuple('PriceChange', ['machine_id', 'old', 'new', 'competitors'])
+""" A listing price change planned by `PricingAutopilot`: `old` and `new` $/gpu/hr, and the number of
+    competing offers the new price is based on. """
+
+def market_prices(machines, offers, percentile=50., reliability_band=.02, min_competitors=3):
+    """ A percentile of the per GPU price (`dph_base/num_gpus`) of the offers competing with each machine.
+        Offers on the machines themselves are left out.
+    Args:
+        machines (list of Machine): Host machines.
+        offers (list of dict): Market offers, e.g. from `VastClient.search_offers`.
+        percentile (float): Percentile of competitor prices. (default: 50)
+        reliability_band (float): Compare with offers whose `reliability2` is within this of the machine's,
+            if there are at least `min_competitors` of them. (default: .02)
+        min_competitors (int): Fewest offers to price against. (default: 3)
+    Returns:
+        tuple: `(prices, competitors)` arrays in the order of `machines`. Prices are nan for machines
+            with fewer than `min_competitors` offers of the same `gpu_name` and `num_gpus`.
+    """
+    own = {machine.id for machine in machines}
+    offers = [offer for offer in offers if offer.get('machine_id') not in own and offer.get('num_gpus')]
+    codes = {}
+    offer_keys = np.array([codes.setdefault(offer.get('gpu_name'), len(codes))*1000 + offer['num_gpus']
+                           for offer in offers], dtype=np.int64)
+    offer_prices = np.array([offer.get('dph_base', np.nan)/offer['num_gpus'] for offer in offers], dtype=float)
+    offer_reliability = np.array([offer.get('reliability2', np.nan) for offer in offers], dtype=float)
+    machine_keys = np.array([codes.setdefault(getattr(m, 'gpu_name', None), len(codes))*1000 +
+                             (getattr(m, 'num_gpus', 0) or 0) for m in machines], dtype=np.int64)
+    machine_reliability = np.array([getattr(m, 'reliability2', np.nan) for m in machines], dtype=float)
+
+    order = np.argsort(offer_keys, kind="stable")
+    offer_keys, offer_prices, offer_reliability = offer_keys[order], offer_prices[order], offer_reliability[order]
+    prices = np.full(len(machines), np.nan)
+    competitors = np.zeros(len(machines), dtype=int)
+    for key in np.unique(machine_keys):
+        group = np.flatnonzero(machine_keys == key)
+        lo, hi = np.searchsorted(offer_keys, key, 'left'), np.searchsorted(offer_keys, key, 'right')
+        if hi - lo < min_competitors:
+            continue
+        group_prices = offer_prices[lo:hi]
+        in_band = np.abs(offer_reliability[lo:hi][None, :] - machine_reliability[group][:, None]) <= reliability_band
+        counts = in_band.sum(axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning) # Machines with no offers in their band.
+            banded = np.nanpercentile(np.where(in_band, group_prices[None, :], np.nan), percentile, axis=1)
+        enough = counts >= min_competitors
+        prices[group] = np.where(enough, banded, np.nanpercentile(group_prices, percentile))
+        competitors[group] = np.where(enough, counts, hi - lo)
+    return prices, competitors
+
+class PricingStrategy:
+    """ Prices at a percentile of the competition, less an undercut, within limits.
+    """
+    def __init__(self, percentile=50., undercut=0., min_price=None, max_price=None, reliability_band=.02,
+                 min_competitors=3, hysteresis=.005):
+        """
+        Args:
+            percentile (float): Percentile of competitors' per GPU prices to price at. (default: 50)
+            undercut (float): Fraction to price below that. (default: 0)
+            min_price (float or dict, optional): Lowest $/gpu/hr, or `{gpu_name: $/gpu/hr}`. (default: no floor)
+            max_price (float or dict, optional): Highest $/gpu/hr, or `{gpu_name: $/gpu/hr}`. (default: no cap)
+            reliability_band (float): See `market_prices`. (default: .02)
+            min_competitors (int): Machines with fewer competing offers keep their price. (default: 3)
+            hysteresis (float): Only reprice a machine whose target is more than this many $/gpu/hr
+                away from its current price. (default: .005)
+        """
+        self.percentile = percentile
+        self.undercut = undercut
+        self.min_price = min_price
+        self.max_price = max_price
+        self.reliability_band = reliability_band
+        self.min_competitors = min_competitors
+        self.hysteresis = hysteresis
+
+    def target(self, market_price, gpu_name=None):
+        """ The $/gpu/hr to list at, given the competitors' price percentile. """
+        price = market_price*(1 - self.undercut)
+        floor = self.min_price.get(gpu_name) if isinstance(self.min_price, dict) else self.min_price
+        cap = self.max_price.get(gpu_name) if isinstance(self.max_price, dict) else self.max_price
+        if cap is not None:
+            price = min(price, cap)
+        if floor is not None:
+            price = max(price, floor)
+        return round(price, 4)
+
+class PricingAutopilot:
+    """ Keeps the listing prices of a host's machines in line with the market.
+    """
+    def __init__(self, client, strategy=None, query=None, include_unlisted=False, check_every_s=3600,
+                 max_workers=8, dry_run=False, clock=time.time, **search_kwargs):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            strategy (PricingStrategy, optional): (default: `PricingStrategy()`)
+            query (str, optional): Offer query for the market, see `VastClient.search_offers`, e.g. to
+                only fetch offers of the GPU models the host has. (default: all offers)
+            include_unlisted (bool): Also list machines which aren't listed. (default: False)
+            check_every_s (float): Seconds between background checks. (default: 3600)
+            max_workers (int): Asks to send at once. (default: 8)
+            dry_run (bool): Only record what would be done, in `changes`. (default: False)
+            **search_kwargs: Passed to `VastClient.search_offers`, e.g. `instance_type`.
+        """
+        self.client = client
+        self.strategy = strategy or PricingStrategy()
+        self.query = query
+        self.include_unlisted = include_unlisted
+        self.check_every_s = check_every_s
+        self.max_workers = max_workers
+        self.dry_run = dry_run
+        self.clock = clock
+        self.search_kwargs = search_kwargs
+        self.changes = []
+        """ `(time, machine id, old $/gpu/hr, new $/gpu/hr)` for each price change """
+        self._thread = None
+        self._closing = threading.Event()
+
+    def plan(self, machines=None, offers=None):
+        """ Works out new prices without changing anything.
+        Args:
+            machines (MachineList, optional): (default: `client.get_machines()`)
+            offers (list of dict, optional): Market offers. (default: one `client.search_offers` request)
+        Returns:
+            list of PriceChange
+        """
+        if machines is None:
+            machines = self.client.get_machines()
+        machines = [m for m in machines if self.include_unlisted or getattr(m, 'listed', False)]
+        if not machines:
+            return []
+        if offers is None:
+            offers = self.client.search_offers(query=self.query, **self.search_kwargs)
+        strategy = self.strategy
+        prices, competitors = market_prices(machines, offers, strategy.percentile, strategy.reliability_band,
+                                            strategy.min_competitors)
+        changes = []
+        for machine, price, count in zip(machines, prices.tolist(), competitors.tolist()):
+            if np.isnan(price):
+                continue
+            new = strategy.target(price, getattr(machine, 'gpu_name', None))
+            old = getattr(machine, 'listed_gpu_cost', None) if getattr(machine, 'listed', False) else None
+            if old is None or abs(new - old) > strategy.hysteresis:
+                changes.append(PriceChange(machine.id, old, new, count))
+        return changes
+
+    def check(self):
+        """ Fetches the machines and the market once, and relists every machine whose price should change.
+            Storage and bandwidth prices are kept as they are.
+        Returns:
+            list of PriceChange: the changes made.
+        """
+        changes = self.plan()
+        now = self.clock()
+        if changes and self.dry_run:
+            for change in changes:
+                print("Pricing autopilot: would reprice machine %s from %s to $%.4f/gpu/hr, against %i offers."%(
+                      change.machine_id, change.old, change.new, change.competitors))
+        elif changes:
+            batch = MachineList(self.client._machine_index[change.machine_id] for change in changes)
+            result = batch.list(price_gpu={change.machine_id: change.new for change in changes},
+                                price_disk=lambda m: getattr(m, 'listed_storage_cost', None),
+                                price_inetu=lambda m: getattr(m, 'listed_inet_up_cost', None),
+                                price_inetd=lambda m: getattr(m, 'listed_inet_down_cost', None),
+                                max_workers=self.max_workers)
+            succeeded = set(result.succeeded)
+            changes = [change for change in changes if change.machine_id in succeeded]
+        self.changes.extend((now, change.machine_id, change.old, change.new) for change in changes)
+        return changes
+
+    def start(self):
+        """ Checks every `check_every_s` seconds in a background thread.
+        Returns:
+            PricingAutopilot: self
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name="vastai-pricing", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closing.is_set():
+            try:
+                self.check()
+            except Exception as err:
+                print("Pricing autopilot check failed: %s"%err)
+            self._closing.wait(self.check_every_s)
+
+    def close(self):
+        """ Stops the background checks. """
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,187 @@
+""" Phase timing for `vast.py --profile`.
+
+`CliProfiler` breaks one command line invocation down into imports, argument parsing,
+http requests (dns, connect, tls and wait/transfer per request), json decoding and
+everything else the command does, which is mostly formatting and printing output.
+It can also write a cProfile file, or a collapsed stack file for flame graph tools
+such as `flamegraph.pl` or speedscope.
+"""
+import cProfile
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import requests
+import urllib3.util.connection
+
+from vastai import jsonlib
+from vastai.hooks import endpoint_name
+
+class CliProfiler:
+    """ Times the phases of a `vast.py` command. Network timings are collected by temporarily
+        wrapping `socket.getaddrinfo`, urllib3's `create_connection`, `ssl.SSLContext.wrap_socket`,
+        `requests.Session.send`, `requests.Response.json` and `vastai.jsonlib.loads` between `start`
+        and `stop`.
+    """
+    def __init__(self, base_url="", cprofile_path=None, stacks_path=None, sample_interval_s=.001):
+        """
+        Args:
+            base_url (str): Api url, stripped from request urls in the report.
+            cprofile_path (str, optional): Write cProfile stats of the command to this file.
+            stacks_path (str, optional): Write sampled, collapsed stacks of the command to this file.
+            sample_interval_s (float): Seconds between stack samples. (default: .001)
+        """
+        self.base_url = base_url
+        self.cprofile_path = cprofile_path
+        self.stacks_path = stacks_path
+        self.sample_interval_s = sample_interval_s
+        self.phases = OrderedDict()
+        """ `{phase: seconds}` measured outside of `start`/`stop`, e.g. imports and argument parsing. """
+        self.requests = []
+        """ One dict per http request: method, endpoint, status, bytes, dns, connect, tls, transfer and total seconds. """
+        self.json_s = 0.
+        self.command_s = None
+        self.stacks = Counter()
+        self._local = threading.local()
+        self._originals = None
+        self._profile = None
+        self._sampler = None
+        self._sampling = threading.Event()
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.) + seconds
+
+    def start(self):
+        """ Installs the network and json wrappers and starts timing the command. """
+        self._install()
+        if self.stacks_path:
+            self._sampling.set()
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                             name="vastai-profile-sampler", daemon=True)
+            self._sampler.start()
+        if self.cprofile_path:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        """ Stops timing, removes the wrappers and writes any requested profile files. """
+        self.command_s = time.perf_counter() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+        if self._sampler is not None:
+            self._sampling.clear()
+            self._sampler.join()
+            with open(self.stacks_path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write("%s %i\n"%(stack, count))
+        self._uninstall()
+
+    def report(self, file=None):
+        """ Prints the phase breakdown, by default to stderr so it doesn't mix with command output. """
+        file = file or sys.stderr
+        http_s = sum(r["total"] for r in self.requests)
+        phases = list(self.phases.items())
+        if self.command_s is not None:
+            phases += [("http requests", http_s), ("json decode", self.json_s),
+                       ("formatting/output", max(0., self.command_s - http_s - self.json_s))]
+        print("Profile (%.1f ms):"%(1000*sum(s for _, s in phases)), file=file)
+        for name, seconds in phases:
+            print("  %-20s %9.1f ms"%(name, 1000*seconds), file=file)
+            if name == "http requests":
+                for r in self.requests:
+                    print("    %-6s %-28s %s %8s  dns %.1f  connect %.1f  tls %.1f  wait/transfer %.1f  total %.1f ms"%(
+                          r["method"], r["endpoint"], r["status"], _format_bytes(r["bytes"]), 1000*r["dns"],
+                          1000*r["connect"], 1000*r["tls"], 1000*r["transfer"], 1000*r["total"]), file=file)
+        if self.cprofile_path:
+            print("cProfile stats written to %s"%self.cprofile_path, file=file)
+        if self.stacks_path:
+            print("Collapsed stacks written to %s"%self.stacks_path, file=file)
+
+    def _current(self):
+        return getattr(self._local, "request", None)
+
+    def _install(self):
+        getaddrinfo = socket.getaddrinfo
+        create_connection = urllib3.util.connection.create_connection
+        wrap_socket = ssl.SSLContext.wrap_socket
+        send = requests.Session.send
+        json = requests.Response.json
+        loads = jsonlib.loads
+        self._originals = (getaddrinfo, create_connection, wrap_socket, send, json, loads)
+        profiler = self
+
+        def timed(key, func):
+            def wrapper(*args, **kwargs):
+                request = profiler._current()
+                if request is None:
+                    return func(*args, **kwargs)
+                start, dns = time.perf_counter(), request["dns"]
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    # Connecting includes a dns lookup, which is reported separately.
+                    request[key] += time.perf_counter() - start - (request["dns"] - dns)
+            return wrapper
+
+        def profiled_send(session, prepared, **kwargs):
+            request = dict(method=prepared.method, endpoint=endpoint_name(prepared.url, profiler.base_url),
+                           status=None, bytes=0, dns=0., connect=0., tls=0.)
+            profiler._local.request = request
+            start = time.perf_counter()
+            try:
+                resp = send(session, prepared, **kwargs)
+                request["status"], request["bytes"] = resp.status_code, len(resp.content)
+                return resp
+            finally:
+                profiler._local.request = None
+                request["total"] = time.perf_counter() - start
+                request["transfer"] = max(0., request["total"] - request["dns"] - request["connect"] - request["tls"])
+                profiler.requests.append(request)
+
+        def decoding(func):
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profiler.json_s += time.perf_counter() - start
+            return wrapper
+
+        socket.getaddrinfo = timed("dns", getaddrinfo)
+        urllib3.util.connection.create_connection = timed("connect", create_connection)
+        ssl.SSLContext.wrap_socket = timed("tls", wrap_socket)
+        requests.Session.send = profiled_send
+        requests.Response.json = decoding(json)
+        jsonlib.loads = decoding(loads)
+
+    def _uninstall(self):
+        if self._originals is None:
+            return
+        (socket.getaddrinfo, urllib3.util.connection.create_connection, ssl.SSLContext.wrap_socket,
+         requests.Session.send, requests.Response.json, jsonlib.loads) = self._originals
+        self._originals = None
+
+    def _sample(self, thread_id):
+        """ Samples the stack of thread `thread_id` until `stop`. """
+        while self._sampling.is_set():
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s"%(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.sample_interval_s)
+
+def _format_bytes(n):
+    for unit in ("B", "kB", "MB"):
+        if n < 1024 or unit == "MB":
+            return ("%i%s" if unit == "B" else "%.1f%s")%(n, unit)
+        n /= 1024.
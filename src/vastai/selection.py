@@ -0,0 +1,148 @@
+""" Multi-objective offer selection: Pareto frontier and weighted top-k.
+
+Objectives and weights are given per offer field. Objective strings use the same
+syntax as sort orders (see `vastai.vast.parse_order`): a field postfixed with `-`
+is sorted descending, meaning larger values are better.
+e.g. `dph_total,dlperf-` prefers cheap offers with a high DL-perf score.
+"""
+import numpy as np
+from vastai.vast import parse_order, query_field_alias
+
+default_objectives = "dph_total,dlperf-,total_flops-,reliability2-,inet_down-,gpu_ram-"
+""" Objectives used by `pareto_front` when none are given. """
+
+default_weights = {"dph_total": -1.0, "dlperf": 1.0, "total_flops": 1.0,
+                   "reliability2": 1.0, "inet_down": 1.0, "gpu_ram": 1.0}
+""" Weights used by `top_k` when none are given. Negative weights mean lower is better. """
+
+def parse_objectives(objectives):
+    """ Normalizes objectives to a list of `(field, direction)` pairs.
+    Args:
+        objectives (str or list): e.g. `"dph_total,dlperf-"` or `[("dph_total","asc"), ("dlperf","desc")]`
+    Returns:
+        list: `[field, direction]` pairs where direction is `asc` (minimize) or `desc` (maximize)
+    """
+    if objectives is None:
+        objectives = default_objectives
+    if isinstance(objectives, str):
+        return parse_order(objectives)
+    return [[query_field_alias.get(field, field), direction] for field, direction in objectives]
+
+def parse_weights(weights):
+    """ Normalizes weights to a dict of `{field: weight}`.
+    Args:
+        weights (str or dict): e.g. `"dph=-2,dlperf=1"` or `{"dph_total": -2, "dlperf": 1}`
+    Raises:
+        ValueError: if a weight can't be parsed.
+    """
+    if weights is None:
+        return dict(default_weights)
+    if isinstance(weights, str):
+        parsed = {}
+        for item in weights.split(","):
+            if not item.strip(): continue
+            field, sep, weight = item.partition("=")
+            if not sep:
+                raise ValueError("Expected field=weight, got %r."%item.strip())
+            parsed[field.strip()] = float(weight)
+        weights = parsed
+    return {query_field_alias.get(field, field):float(w) for field, w in weights.items()}
+
+def _column(offers, field):
+    """ Offer field as a float array. Missing or None values become nan.
+    """
+    return np.array([offer.get(field) for offer in offers], dtype=float)
+
+def _cost_matrix(offers, objectives):
+    """ Builds an (n_offers, n_objectives) array in which lower is always better.
+        Missing values are treated as the worst possible value.
+    """
+    costs = np.empty((len(offers), len(objectives)))
+    for j, (field, direction) in enumerate(objectives):
+        col = _column(offers, field)
+        costs[:, j] = -col if direction == "desc" else col
+    costs[np.isnan(costs)] = np.inf
+    return costs
+
+def pareto_front(offers, objectives=None):
+    """ Finds the offers which aren't dominated by any other offer.
+        An offer is dominated if another offer is at least as good in every objective
+        and strictly better in one. Of several identical offers only the first is kept.
+        Each pass eliminates everything dominated by one frontier point, so the python
+        loop runs once per frontier offer rather than once per pair of offers.
+    Args:
+        offers (list of dict): e.g. an `OfferList`.
+        objectives (str or list, optional): see `parse_objectives`. (default: `default_objectives`)
+    Returns:
+        numpy.ndarray: indices into `offers` of the frontier, in their original order.
+    """
+    if len(offers) == 0:
+        return np.array([], dtype=int)
+    costs = _cost_matrix(offers, parse_objectives(objectives))
+    # Visit points in lexicographic order, so every point visited is on the frontier.
+    order = np.lexsort(costs.T[::-1])
+    costs = costs[order]
+    keep = np.arange(len(costs))
+    i = 0
+    while i < len(costs):
+        undominated = np.any(costs < costs[i], axis=1)
+        undominated[i] = True
+        keep = keep[undominated]
+        costs = costs[undominated]
+        i = np.count_nonzero(undominated[:i]) + 1
+    return np.sort(order[keep])
+
+def score(offers, weights=None):
+    """ Weighted sum of min-max normalized offer fields.
+    Args:
+        offers (list of dict): e.g. an `OfferList`.
+        weights (str or dict, optional): see `parse_weights`. (default: `default_weights`)
+    Returns:
+        numpy.ndarray: one score per offer, higher is better.
+    """
+    total = np.zeros(len(offers))
+    if len(offers) == 0:
+        return total
+    for field, weight in parse_weights(weights).items():
+        col = _column(offers, field)
+        present = ~np.isnan(col)
+        norm = np.full(len(col), np.nan)
+        if present.any():
+            lo, hi = col[present].min(), col[present].max()
+            norm[present] = (col[present] - lo)/(hi - lo) if hi > lo else 0.
+        # Missing values count as the worst value for this weight.
+        norm[np.isnan(norm)] = 0. if weight > 0 else 1.
+        total += weight * norm
+    return total
+
+def top_k(offers, k, weights=None):
+    """ Ranks offers by `score` and returns the best `k`.
+    Args:
+        offers (list of dict): e.g. an `OfferList`.
+        k (int): number of offers to return.
+        weights (str or dict, optional): see `parse_weights`.
+    Returns:
+        numpy.ndarray: indices into `offers`, best first.
+    """
+    scores = score(offers, weights)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int)
+    best = np.argpartition(-scores, k-1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+def select(offers, pareto=None, k=None, weights=None):
+    """ Applies `pareto_front` and then `top_k` to `offers`.
+    Args:
+        offers (list of dict): e.g. an `OfferList`.
+        pareto (bool, str or list, optional): Pareto objectives, or True to use `default_objectives`.
+        k (int, optional): Keep only the best `k` offers by weighted score.
+        weights (str or dict, optional): Weights used to rank offers.
+    Returns:
+        list: selected offers. Sorted by score if `k` or `weights` is set, else in original order.
+    """
+    if pareto:
+        offers = [offers[i] for i in pareto_front(offers, None if pareto is True else pareto)]
+    if k is not None or weights is not None:
+        offers = [offers[i] for i in top_k(offers, len(offers) if k is None else k, weights)]
+    return offers
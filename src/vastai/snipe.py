@@ -0,0 +1,204 @@
+""" Low-latency offer sniping: poll for rare offers and rent them the moment they appear.
+
+Rare configurations are often rented by someone else within seconds of being listed.
+`OfferSniper` shortens the path from seeing a matching offer to renting it:
+
+- The `/bundles` url, with the query, price cap, order and a small `limit` so the server
+  only returns the best few matches, is built once.
+- The offer query is compiled once into a single Python predicate (`compile_predicate`).
+- The `/asks/{id}/` request body is serialized once.
+- All requests go through the client's pooled session, so both the poll and the rent
+  reuse warm connections. Polls whose response is identical to the last one aren't parsed.
+
+    sniper = OfferSniper(client, "num_gpus>=8 gpu_ram>=80", max_price=12., image="pytorch/pytorch")
+    contracts = sniper.run(timeout=3600)
+    sniper.latencies    # seconds from match to the rent being accepted
+    sniper.errors       # transient poll and rent failures, which were retried
+
+`OfferSniper` doesn't print; callers report progress from `rented`, `latencies` and `errors`.
+
+"""
+import time
+from collections import deque
+
+from vastai import jsonlib
+from vastai.vast import parse_query, parse_order
+
+_op_source = {
+    "eq": "{v} == {c}", "neq": "{v} != {c}", "in": "{v} in {c}", "notin": "{v} not in {c}",
+    "gt": "({v} is not None and {v} > {c})", "gte": "({v} is not None and {v} >= {c})",
+    "lt": "({v} is not None and {v} < {c})", "lte": "({v} is not None and {v} <= {c})",
+}
+
+def _coerce(value):
+    """ Converts a query value string to what the api compares it as. """
+    if isinstance(value, list):
+        return [_coerce(v) for v in value]
+    if not isinstance(value, str):
+        return value
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    try:
+        return float(value)
+    except ValueError:
+        return value.replace("_", " ")
+
+def compile_predicate(query):
+    """ Compiles an offer query into one function, so matching an offer costs a single call.
+    Args:
+        query (str or dict): e.g. `"num_gpus>=8 gpu_name=H100_SXM"`, or a query parsed by `parse_query`.
+    Returns:
+        callable: `predicate(offer) -> bool`
+    Raises:
+        ValueError: if `query` can't be parsed, or uses an unknown operator.
+    """
+    if isinstance(query, str):
+        query = parse_query(query)
+    consts, terms = [], []
+    for field, ops in query.items():
+        if not isinstance(ops, dict):
+            continue # e.g. 'order', 'type', 'limit'
+        for op, value in ops.items():
+            if op not in _op_source:
+                raise ValueError("Unknown operator %r for %s."%(op, field))
+            value = _coerce(value)
+            consts.append(frozenset(value) if op in ("in", "notin") else value)
+            terms.append(_op_source[op].format(v="get(%r)"%field, c="c[%i]"%(len(consts)-1)))
+    source = "lambda offer, c=c: (lambda get: %s)(offer.get)"%(" and ".join(terms) or "True")
+    return eval(compile(source, "<offer query>", "eval"), {"c": consts})
+
+class OfferSniper:
+    """ Polls for offers matching a query and rents them as soon as they're listed.
+    """
+    def __init__(self, client, query, max_price=None, count=1, instance_type="on-demand", price=None,
+                 sort_order="dph_total", limit=10, interval_s=1., **create_kwargs):
+        """
+        Args:
+            client (VastClient): Authenticated client.
+            query (str): Offer query, see `VastClient.search_offers`.
+            max_price (float, optional): Only rent offers up to this many $/hr (`dph_total`), or up to the
+                query's own `dph_total<=` limit if that's lower.
+            count (int): Number of instances to rent. (default: 1)
+            instance_type (str): 'on-demand' or 'bid'. (default: 'on-demand')
+            price (float, optional): Bid price for interruptible instances. (default: `max_price`)
+            sort_order (str): Order in which the server ranks matches. (default: 'dph_total')
+            limit (int): Number of matches the server returns per poll. (default: 10)
+            interval_s (float): Seconds between polls. (default: 1)
+            **create_kwargs: As for `VastClient.create_instance`, e.g. `image`, `disk`, `label`, `onstart_cmd`.
+        Raises:
+            ValueError: if `query` can't be parsed.
+        """
+        self.client = client
+        self.count = count
+        self.interval_s = interval_s
+        query_args = parse_query(query)
+        if max_price is not None:
+            dph_total = query_args.setdefault("dph_total", {})
+            dph_total["lte"] = str(min(float(dph_total.get("lte", max_price)), max_price))
+        self.predicate = compile_predicate(query_args)
+        query_args["order"] = parse_order(sort_order)
+        query_args["type"] = instance_type
+        query_args["limit"] = limit
+        self.bundles_url = client._apiurl("/bundles", q=query_args)
+        if instance_type == "bid" and price is None:
+            price = max_price
+        ask_url, ask_json = client._create_instance_request(0, price=price, **create_kwargs)
+        # Split around the offer id, since the quoted api key may contain '%'.
+        self._ask_url = ask_url.partition("/asks/0/")[::2]
+        self._ask_body = jsonlib.dumps(ask_json).encode("utf-8")
+        self._headers = {"Content-Type": "application/json"}
+        self._last_body = None
+        self.tried = set()
+        """ Offer ids already tried """
+        self.rented = []
+        """ Contract ids of instances rented """
+        self.latencies = []
+        """ `(offer id, seconds from match to rent response, whether it was rented)` for each attempt """
+        self.errors = deque(maxlen=100)
+        """ `(time, offer id, error)` for the latest transient failures, which are retried. The offer
+            id is None for failed polls. """
+        self.polls = 0
+
+    def poll(self):
+        """ Polls once, and tries to rent each new matching offer until `count` instances are rented.
+        Returns:
+            list of int: contract ids rented by this poll
+        """
+        self.polls += 1
+        resp = self.client._http("get", self.bundles_url)
+        resp.raise_for_status()
+        body = resp.content
+        if body == self._last_body:
+            return []
+        self._last_body = body
+        rented = []
+        for offer in jsonlib.loads(body)["offers"]:
+            if len(self.rented) >= self.count:
+                break
+            if offer["id"] in self.tried or not self.predicate(offer):
+                continue
+            contract = self.rent(offer["id"], time.perf_counter())
+            if contract is not None:
+                rented.append(contract)
+        return rented
+
+    def rent(self, offer_id, matched_at=None):
+        """ Sends the pre-built `/asks/{offer_id}/` request. Offers which are rejected are not tried again,
+            but ones which fail with a 429 or 5xx error are retried on the next poll.
+        Args:
+            offer_id (int): Offer to rent.
+            matched_at (float, optional): `time.perf_counter()` when the offer was matched, for `latencies`.
+        Returns:
+            int: The new contract id, or None if the offer couldn't be rented.
+        """
+        requested = time.time()
+        url = "%s/asks/%i/%s"%(self._ask_url[0], offer_id, self._ask_url[1])
+        resp = self.client._http("put", url, data=self._ask_body, headers=self._headers)
+        done = time.perf_counter()
+        contract = None
+        if resp.status_code == 429 or resp.status_code >= 500:
+            self._last_body = None # So the next poll retries it, even if the offers haven't changed.
+            try:
+                resp.raise_for_status()
+            except OSError as err:
+                self.errors.append((time.time(), offer_id, err))
+            return None
+        self.tried.add(offer_id)
+        if resp.status_code == 200:
+            data = jsonlib.loads(resp.content)
+            if isinstance(data, dict) and data.get("success"):
+                contract = data["new_contract"]
+                self.rented.append(contract)
+                self.client.timeline.record(contract, "requested", requested)
+                self.client.timeline.record(contract, "accepted")
+        if matched_at is not None:
+            self.latencies.append((offer_id, done - matched_at, contract is not None))
+        return contract
+
+    def run(self, timeout=None, iterations=None, sleep=time.sleep):
+        """ Polls every `interval_s` seconds until `count` instances are rented.
+        Args:
+            timeout (float, optional): Give up after this many seconds. (default: never)
+            iterations (int, optional): Give up after this many polls. (default: never)
+        Raises:
+            requests.exceptions.HTTPError: if the api key is rejected. Other request errors are
+                recorded in `errors` and retried.
+        Returns:
+            list of int: contract ids of all instances rented
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        polls = 0
+        while len(self.rented) < self.count:
+            if (iterations is not None and polls >= iterations) or (deadline is not None and time.time() > deadline):
+                break
+            polls += 1
+            try:
+                self.poll()
+            except OSError as err:
+                response = getattr(err, "response", None)
+                if response is not None and response.status_code in (401, 403):
+                    raise
+                self.errors.append((time.time(), None, err))
+            if len(self.rented) < self.count:
+                sleep(self.interval_s)
+        return self.rented
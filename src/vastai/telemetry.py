@@ -0,0 +1,455 @@
+""" GPU and system telemetry streamed from running instances over long-lived ssh channels.
+
+`gpu_util` and `gpu_temp` in `/instances` are coarse and lag behind, and sampling
+`nvidia-smi` with `Instance.run_command` costs an ssh handshake per sample. A
+`TelemetryCollector` instead opens one ssh channel per running instance, which runs a
+small shell loop printing one sample line every `interval_s` seconds. A single reader
+thread multiplexes all the channels, so hundreds of instances cost one thread plus
+paramiko's transport threads, and samples go into a `TelemetryStore`:
+
+    collector = TelemetryCollector(client, interval_s=2).start()
+    ...
+    collector.store.summary()          # p50/p90/p99 of each metric per instance
+    collector.store.history(1234)      # recent samples of one instance, as a DataFrame
+
+The store keeps the latest `raw_capacity` samples per instance in a ring buffer, plus
+`bucket_s` averages in a second ring buffer for longer history.
+"""
+import queue
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+metrics = ("gpu_util", "gpu_mem_util", "gpu_temp", "cpu_util", "ram_util", "disk_util")
+""" Metrics in each sample: GPU utilization (%, mean over GPUs), GPU memory used (%), GPU temperature
+    (C, hottest GPU), CPU utilization (%), RAM used (%) and root disk used (%). """
+
+def sampler_command(interval_s):
+    """ Shell loop run on each instance. Prints one `S|time|gpus|cpu|mem|disk` line per sample. """
+    return ("while :; do "
+            "g=$(nvidia-smi --query-gpu=utilization.gpu,memory.used,memory.total,temperature.gpu "
+            "--format=csv,noheader,nounits 2>/dev/null | tr '\\n' ';'); "
+            "c=$(head -1 /proc/stat); "
+            "m=$(awk '/^MemTotal|^MemAvailable/{print $2}' /proc/meminfo | tr '\\n' ' '); "
+            "d=$(df -P / | awk 'NR==2{print $3, $2}'); "
+            "echo \"S|$(date +%%s.%%N)|$g|$c|$m|$d\"; sleep %g; done"%interval_s)
+
+def parse_sample(line, previous_cpu=None):
+    """ Parses a line printed by `sampler_command`.
+    Args:
+        line (str): One sample line.
+        previous_cpu (tuple, optional): `(busy, total)` jiffies returned with the previous sample.
+    Returns:
+        tuple: `(timestamp, values, cpu)`: values is a float array in the order of `metrics`, with nan
+            for anything not reported; cpu is `(busy, total)` jiffies, for the next call.
+    Raises:
+        ValueError: if `line` isn't a sample line.
+    """
+    parts = line.rstrip("\n").split("|")
+    if len(parts) != 6 or parts[0] != "S":
+        raise ValueError("Not a telemetry sample: %r"%line[:80])
+    values = np.full(len(metrics), np.nan)
+    gpus = [[float(x) for x in gpu.split(",")] for gpu in parts[2].split(";") if gpu.strip()]
+    gpus = np.array([gpu for gpu in gpus if len(gpu) == 4])
+    if len(gpus):
+        values[0] = gpus[:, 0].mean()
+        values[1] = 100.*gpus[:, 1].sum()/gpus[:, 2].sum() if gpus[:, 2].sum() else np.nan
+        values[2] = gpus[:, 3].max()
+    cpu = None
+    jiffies = [float(x) for x in parts[3].split()[1:]]
+    if len(jiffies) >= 4:
+        total = sum(jiffies)
+        cpu = (total - jiffies[3] - (jiffies[4] if len(jiffies) > 4 else 0.), total)
+        if previous_cpu is not None and total > previous_cpu[1]:
+            values[3] = 100.*(cpu[0] - previous_cpu[0])/(total - previous_cpu[1])
+    mem = parts[4].split()
+    if len(mem) == 2 and float(mem[0]):
+        values[4] = 100.*(1 - float(mem[1])/float(mem[0]))
+    disk = parts[5].split()
+    if len(disk) == 2 and float(disk[1]):
+        values[5] = 100.*float(disk[0])/float(disk[1])
+    return float(parts[1]), values, cpu
+
+def _percentiles(rows, q):
+    """ Linearly interpolated percentiles along axis 1 of `rows`, ignoring nan, like `np.nanpercentile`
+        but vectorized over the other axes.
+    Returns:
+        np.ndarray: shaped `(len(rows), len(q), rows.shape[2])`
+    """
+    ordered = np.sort(rows, axis=1) # nan sorts last
+    counts = (~np.isnan(rows)).sum(axis=1)
+    out = np.full((len(rows), len(q), rows.shape[2]), np.nan)
+    if not ordered.shape[1]:
+        return out
+    for j, p in enumerate(q):
+        position = np.maximum(counts - 1, 0)*p/100.
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, np.maximum(counts - 1, 0))
+        below = np.take_along_axis(ordered, low[:, None], axis=1)[:, 0]
+        above = np.take_along_axis(ordered, high[:, None], axis=1)[:, 0]
+        out[:, j] = np.where(counts > 0, below + (above - below)*(position - low), np.nan)
+    return out
+
+class RingBuffer:
+    """ Fixed size buffer of timestamped rows, overwriting the oldest when full.
+    """
+    def __init__(self, capacity, width):
+        self.times = np.full(capacity, np.nan)
+        self.rows = np.full((capacity, width), np.nan)
+        self.capacity = capacity
+        self.count = 0
+
+    def append(self, timestamp, row):
+        i = self.count % self.capacity
+        self.times[i] = timestamp
+        self.rows[i] = row
+        self.count += 1
+
+    def values(self, since=None):
+        """ Rows appended at or after `since`, oldest first.
+        Returns:
+            tuple: `(times, rows)` arrays
+        """
+        if self.count <= self.capacity:
+            times, rows = self.times[:self.count], self.rows[:self.count]
+        else:
+            order = np.roll(np.arange(self.capacity), -(self.count % self.capacity))
+            times, rows = self.times[order], self.rows[order]
+        if since is not None:
+            keep = times >= since
+            times, rows = times[keep], rows[keep]
+        return times, rows
+
+class TelemetryStore:
+    """ Per-instance ring buffers of raw samples and of `bucket_s` averages. Safe to share between threads.
+    """
+    def __init__(self, raw_capacity=900, bucket_s=60., bucket_capacity=24*60):
+        """
+        Args:
+            raw_capacity (int): Raw samples kept per instance. (default: 900)
+            bucket_s (float): Seconds averaged into each downsampled value. (default: 60)
+            bucket_capacity (int): Downsampled values kept per instance. (default: 1440, a day of minutes)
+        """
+        self.raw_capacity = raw_capacity
+        self.bucket_s = bucket_s
+        self.bucket_capacity = bucket_capacity
+        self._raw = {}
+        self._buckets = {}
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def add(self, instance_id, timestamp, values):
+        """ Stores one sample, a float array in the order of `metrics`. """
+        with self._lock:
+            raw = self._raw.get(instance_id)
+            if raw is None:
+                raw = self._raw[instance_id] = RingBuffer(self.raw_capacity, len(metrics))
+                self._buckets[instance_id] = RingBuffer(self.bucket_capacity, len(metrics))
+            raw.append(timestamp, values)
+            bucket = timestamp//self.bucket_s
+            current = self._current.get(instance_id)
+            if current is not None and current[0] != bucket:
+                self._flush(instance_id, current)
+                current = None
+            if current is None:
+                current = self._current[instance_id] = [bucket, np.zeros(len(metrics)), np.zeros(len(metrics))]
+            present = ~np.isnan(values)
+            current[1][present] += values[present]
+            current[2][present] += 1
+
+    def _flush(self, instance_id, current):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(current[2] > 0, current[1]/current[2], np.nan)
+        self._buckets[instance_id].append(current[0]*self.bucket_s, means)
+
+    def remove(self, instance_id):
+        with self._lock:
+            for store in (self._raw, self._buckets, self._current):
+                store.pop(instance_id, None)
+
+    def instances(self):
+        with self._lock:
+            return list(self._raw)
+
+    def latest(self, instance_id):
+        """ The last sample of an instance.
+        Returns:
+            dict: `{metric: value}`, plus the sample's `time`. None if there are no samples.
+        """
+        with self._lock:
+            raw = self._raw.get(instance_id)
+            if raw is None or not raw.count:
+                return None
+            i = (raw.count - 1) % raw.capacity
+            return dict(zip(metrics, raw.rows[i].tolist()), time=float(raw.times[i]))
+
+    def _window(self, instance_id, window_s, now):
+        """ Samples of the last `window_s` seconds, from the raw buffer if it covers them, else downsampled. """
+        raw, buckets = self._raw[instance_id], self._buckets[instance_id]
+        since = None if window_s is None else now - window_s
+        times, rows = raw.values()
+        if raw.count > raw.capacity and (since is None or times[0] > since):
+            return buckets.values(since)[1]
+        return raw.values(since)[1]
+
+    def percentiles(self, instance_id, q=(50, 90, 99), window_s=None, now=None):
+        """ Percentiles of each metric of one instance.
+        Args:
+            q (tuple of float): Percentiles to compute. (default: (50, 90, 99))
+            window_s (float, optional): Only use the last `window_s` seconds. (default: all kept samples)
+        Returns:
+            dict: `{metric: [percentile values]}`, with nan where there are no samples.
+        """
+        with self._lock:
+            rows = self._window(instance_id, window_s, time.time() if now is None else now)
+        values = _percentiles(rows[None], q)[0]
+        return {metric: values[:, i].tolist() for i, metric in enumerate(metrics)}
+
+    def peaks(self, instance_id, window_s, now=None):
+        """ Highest value of each metric of one instance over the last `window_s` seconds: of the raw
+            samples in the window, and of the `bucket_s` averages (flushed or not) for the part of the window
+            older than them.
+        Returns:
+            dict: `{metric: value}`, with nan for metrics with no values. None if the kept samples
+                don't go back `window_s` seconds.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            raw = self._raw.get(instance_id)
+            if raw is None:
+                return None
+            oldest = [raw.values()[0][0]]
+            if self._buckets[instance_id].count:
+                oldest.append(self._buckets[instance_id].values()[0][0])
+            since = now - window_s
+            if min(oldest) > since:
+                return None
+            raw_times, raw_rows = raw.values(since)
+            bucket_times, bucket_rows = self._buckets[instance_id].values(since)
+            parts = [raw_rows, bucket_rows[bucket_times < raw.values()[0][0]]]
+            current = self._current.get(instance_id)
+            if current is not None and current[0]*self.bucket_s >= since:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    parts.append(np.where(current[2] > 0, current[1]/current[2], np.nan)[None])
+            rows = np.concatenate(parts)
+        values = _percentiles(rows[None], (100,))[0][0]
+        return dict(zip(metrics, values.tolist()))
+
+    def summary(self, q=(50, 90, 99), window_s=None):
+        """ Percentiles of every metric of every instance.
+        Returns:
+            pandas.DataFrame: indexed by instance id, with a `<metric>_p<q>` column for each metric and percentile.
+        """
+        import pandas as pd
+        now = time.time()
+        with self._lock:
+            ids = list(self._raw)
+            windows = [self._window(instance_id, window_s, now) for instance_id in ids]
+        # Pad every window with nan to one array, so all percentiles are computed at once.
+        padded = np.full((len(ids), max([len(w) for w in windows] or [0]), len(metrics)), np.nan)
+        for i, rows in enumerate(windows):
+            padded[i, :len(rows)] = rows
+        values = _percentiles(padded, q)
+        columns = ["%s_p%g"%(metric, p) for metric in metrics for p in q]
+        return pd.DataFrame(values.transpose(0, 2, 1).reshape(len(ids), -1), index=ids, columns=columns)
+
+    def history(self, instance_id, downsampled=False):
+        """ Kept samples of one instance, oldest first.
+        Args:
+            downsampled (bool): Return the `bucket_s` averages rather than raw samples. (default: False)
+        Returns:
+            pandas.DataFrame: indexed by sample time
+        """
+        import pandas as pd
+        with self._lock:
+            times, rows = (self._buckets if downsampled else self._raw)[instance_id].values()
+        return pd.DataFrame(rows, columns=metrics, index=pd.to_datetime(times, unit="s"))
+
+class _SshStream:
+    """ The sampler command running in an ssh channel. Has the `fileno`, `recv` and `close` of a socket. """
+    def __init__(self, instance, interval_s):
+        from paramiko.client import SSHClient, AutoAddPolicy
+        self.ssh_client = SSHClient()
+        self.ssh_client.set_missing_host_key_policy(AutoAddPolicy)
+        self.ssh_client.connect(instance.ssh_host, port=int(instance.ssh_port), username='root',
+                                key_filename=instance.client._get_ssh_key_file(), timeout=30)
+        transport = self.ssh_client.get_transport()
+        transport.set_keepalive(30)
+        self.channel = transport.open_session()
+        self.channel.exec_command(sampler_command(interval_s))
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def recv(self, size):
+        return self.channel.recv(size)
+
+    def close(self):
+        self.channel.close()
+        self.ssh_client.close()
+
+class TelemetryCollector:
+    """ Streams telemetry from every running instance of a client into a `TelemetryStore`.
+    """
+    def __init__(self, client, interval_s=5., store=None, max_connects=16, reconnect_s=60., connect=None):
+        """
+        Args:
+            client (VastClient): Authenticated client. Instances are picked up and dropped as its
+                instances are refreshed.
+            interval_s (float): Seconds between samples on each instance. (default: 5)
+            store (TelemetryStore, optional): Where to keep samples. (default: a new `TelemetryStore`)
+            max_connects (int): ssh connections to open at once. (default: 16)
+            reconnect_s (float): Seconds to wait before reconnecting to an instance whose channel
+                failed or closed. (default: 60)
+            connect (callable, optional): `connect(instance, interval_s)` returning a socket-like stream
+                of sample lines. (default: an ssh channel running `sampler_command`)
+        """
+        self.client = client
+        self.interval_s = interval_s
+        self.store = store or TelemetryStore()
+        self.max_connects = max_connects
+        self.reconnect_s = reconnect_s
+        self.connect = connect or _SshStream
+        self.errors = {}
+        """ `{instance id: (time, error)}` for the last failed connection of each instance """
+        self.samples = 0
+        self._streams = {}
+        self._connecting = set()
+        self._connected = queue.Queue()
+        self._selector = None
+        self._executor = None
+        self._sync_needed = threading.Event()
+        self._closing = threading.Event()
+        self._thread = None
+
+    def _on_refresh(self, diff):
+        if diff.added or diff.removed or any('actual_status' in changes for changes in diff.changed.values()):
+            self._sync_needed.set()
+
+    def _wanted(self):
+        now = time.time()
+        return {inst.id: inst for inst in self.client.instances if getattr(inst, 'actual_status', None) == 'running'
+                and now - self.errors.get(inst.id, (0, None))[0] >= self.reconnect_s}
+
+    def _sync(self):
+        """ Opens channels to newly running instances, and closes those of instances no longer running. """
+        self._sync_needed.clear()
+        running = {inst.id for inst in self.client.instances if getattr(inst, 'actual_status', None) == 'running'}
+        for inst_id in [i for i in self._streams if i not in running]:
+            self._drop(inst_id)
+        for inst_id, inst in self._wanted().items():
+            if inst_id not in self._streams and inst_id not in self._connecting:
+                self._connecting.add(inst_id)
+                self._executor.submit(self._open, inst)
+
+    def _open(self, inst):
+        try:
+            stream = self.connect(inst, self.interval_s)
+        except Exception as err:
+            self._connected.put((inst.id, None, err))
+        else:
+            self._connected.put((inst.id, stream, None))
+
+    def _drop(self, inst_id, error=None):
+        entry = self._streams.pop(inst_id, None)
+        if entry is None:
+            return
+        self._selector.unregister(entry[0])
+        try:
+            entry[0].close()
+        except Exception:
+            pass
+        if error is not None:
+            self.errors[inst_id] = (time.time(), error)
+
+    def _read(self, inst_id):
+        stream, buffer, cpu = self._streams[inst_id]
+        try:
+            data = stream.recv(1 << 16)
+        except Exception as err:
+            return self._drop(inst_id, err)
+        if not data:
+            return self._drop(inst_id, EOFError("Telemetry channel closed."))
+        lines = (buffer + data).split(b"\n")
+        for line in lines[:-1]:
+            try:
+                timestamp, values, cpu = parse_sample(line.decode("utf-8", "replace"), cpu)
+            except ValueError:
+                continue # e.g. a login banner
+            self.store.add(inst_id, timestamp, values)
+            self.samples += 1
+        self._streams[inst_id] = [stream, lines[-1][-(1 << 16):], cpu]
+
+    def poll(self, timeout=1.):
+        """ Handles new connections and reads available samples, waiting up to `timeout` seconds for them.
+            Called in a loop by the background thread.
+        """
+        if self._sync_needed.is_set():
+            self._sync()
+        while True:
+            try:
+                inst_id, stream, err = self._connected.get_nowait()
+            except queue.Empty:
+                break
+            self._connecting.discard(inst_id)
+            if err is not None:
+                self.errors[inst_id] = (time.time(), err)
+                print("Telemetry connection to instance %s failed: %s"%(inst_id, err))
+            elif self._closing.is_set() or inst_id in self._streams:
+                stream.close()
+            else:
+                self._streams[inst_id] = [stream, b"", None]
+                self._selector.register(stream, selectors.EVENT_READ, inst_id)
+        if not self._streams:
+            self._closing.wait(timeout)
+            return
+        for key, _ in self._selector.select(timeout):
+            if key.data in self._streams:
+                self._read(key.data)
+
+    def start(self):
+        """ Connects to all running instances and collects samples in a background thread.
+        Returns:
+            TelemetryCollector: self
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._closing.clear()
+        self._selector = selectors.DefaultSelector()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_connects)
+        self.client.refresh_listeners.append(self._on_refresh)
+        self._sync_needed.set()
+        self._thread = threading.Thread(target=self._run, name="vastai-telemetry", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last_sync = time.time()
+        while not self._closing.is_set():
+            try:
+                if time.time() - last_sync > self.reconnect_s:
+                    self._sync_needed.set() # Retry failed connections.
+                    last_sync = time.time()
+                self.poll()
+            except Exception as err:
+                print("Telemetry collection failed: %s"%err)
+                self._closing.wait(1)
+
+    def close(self):
+        """ Stops collecting and closes all channels. Samples stay in `store`. """
+        self._closing.set()
+        if self._on_refresh in self.client.refresh_listeners:
+            self.client.refresh_listeners.remove(self._on_refresh)
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        for inst_id in list(self._streams):
+            self._drop(inst_id)
+        while not self._connected.empty():
+            _, stream, _ = self._connected.get_nowait()
+            if stream is not None:
+                stream.close()
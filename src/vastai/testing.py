@@ -0,0 +1,392 @@
+""" A local, in-process stand-in for the vast.ai REST api, for offline tests and benchmarks.
+
+`LocalVastServer` serves `/users/current/`, `/instances`, `/instances/{id}/`,
+`/instances/bid_price/{id}/`, `/bundles`, `/asks/{id}/`, `/machines` and the host
+machine endpoints (listing, default jobs, min bids) over real HTTP on localhost, with
+keep-alive connections, so connection handling, concurrency and latency of the client
+can be measured. Instances go through a launch lifecycle
+(loading, running, exited) on a configurable schedule.
+
+    with LocalVastServer(num_offers=100000, latency_s=.05) as server:
+        client = VastClient(api_key_file=None, api_url=server.url)
+        client.api_key = server.api_key
+        offers = client.search_offers(query="num_gpus>=4")
+"""
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+gpu_models = (
+    # name, gpu_ram MB, TFLOPs per gpu, DL-perf per gpu, typical $/hr per gpu
+    ("GTX 1070 Ti", 8119, 8.2, 6.0, 0.08),
+    ("GTX 1080 Ti", 11178, 11.3, 9.5, 0.15),
+    ("RTX 2080 Ti", 11019, 13.4, 14.0, 0.25),
+    ("RTX 3090", 24268, 35.6, 28.0, 0.40),
+    ("RTX A6000", 48685, 38.7, 31.0, 0.60),
+    ("A100 SXM4", 40537, 19.5, 45.0, 1.10),
+)
+
+def generate_offers(n, seed=0, start_id=1):
+    """ Generates `n` synthetic `/bundles` offers with the fields the real api returns.
+    Args:
+        n (int): Number of offers.
+        seed (int): Random seed, the same seed gives the same offers. (default: 0)
+        start_id (int): Id of the first offer. (default: 1)
+    Returns:
+        list of dict
+    """
+    rnd = random.Random(seed)
+    offers = []
+    for i in range(n):
+        name, gpu_ram, flops, dlperf, price = rnd.choice(gpu_models)
+        num_gpus = rnd.choice((1, 1, 1, 2, 2, 4, 4, 8))
+        cpu_cores = rnd.choice((4, 8, 16, 32, 64))
+        dph_base = round(num_gpus * price * rnd.uniform(.6, 1.6), 4)
+        storage_cost = rnd.choice((.1, .15, .2))
+        storage_total_cost = storage_cost * 5 / (30*24.)
+        dph_total = dph_base + storage_total_cost
+        reliability = rnd.uniform(.9, 1.)
+        offers.append(dict(
+            id=start_id + i, ask_contract_id=start_id + i, bundle_id=start_id + i, machine_id=rnd.randint(1, n//4 + 1),
+            host_id=rnd.randint(1, n//16 + 1), gpu_name=name, num_gpus=num_gpus, gpu_ram=gpu_ram,
+            gpu_frac=num_gpus/8., gpu_mem_bw=rnd.uniform(200, 1500), gpu_lanes=16, gpu_display_active=False,
+            total_flops=flops*num_gpus, dlperf=dlperf*num_gpus*rnd.uniform(.8, 1.),
+            dph_base=dph_base, dph_total=dph_total, min_bid=round(dph_base*rnd.uniform(.3, .7), 4),
+            dlperf_per_dphtotal=dlperf*num_gpus/dph_total, flops_per_dphtotal=flops*num_gpus/dph_total,
+            storage_cost=storage_cost, storage_total_cost=storage_total_cost,
+            inet_up=rnd.uniform(10, 1000), inet_down=rnd.uniform(10, 1000),
+            inet_up_cost=.02, inet_down_cost=.02, reliability2=reliability, score=reliability*dlperf*num_gpus/dph_total,
+            cpu_name="Xeon E5-2620 v4", cpu_cores=cpu_cores, cpu_cores_effective=cpu_cores*num_gpus/8.,
+            cpu_ram=rnd.choice((16000, 32000, 64000, 128000)), disk_space=rnd.uniform(50, 2000), disk_bw=rnd.uniform(500, 3000),
+            disk_name="Samsung SSD", mobo_name="X399 Taichi", pci_gen=3.0, pcie_bw=rnd.uniform(3, 25),
+            compute_cap=rnd.choice((610, 750, 860)), cuda_max_good=rnd.choice((10.0, 11.2, 12.0)),
+            driver_version="470.57", has_avx=1, duration=rnd.uniform(1, 90)*24*3600.,
+            end_date=time.time() + 90*24*3600., external=False, rentable=True, rented=False,
+            verified=rnd.random() < .8, is_bid=False, webpage=None, logo="/static/logos/vastai_small2.png",
+        ))
+    return offers
+
+def generate_machines(n, seed=0, start_id=1):
+    """ Generates `n` synthetic `/machines` entries for a host account.
+    """
+    rnd = random.Random(seed)
+    machines = []
+    for i in range(n):
+        name, gpu_ram, flops, dlperf, price = rnd.choice(gpu_models)
+        num_gpus = rnd.choice((1, 2, 4, 8))
+        listed = rnd.random() < .8
+        machines.append(dict(
+            id=start_id + i, hostname="rig-%03i"%(start_id + i), gpu_name=name, num_gpus=num_gpus,
+            gpu_ram=gpu_ram, total_flops=flops*num_gpus, disk_space=rnd.uniform(100, 4000), cpu_ram=64000,
+            reliability2=rnd.uniform(.9, 1.), listed=listed, verification="verified",
+            listed_gpu_cost=round(price*rnd.uniform(.8, 1.2), 3) if listed else None,
+            listed_storage_cost=.15 if listed else None, listed_inet_up_cost=.02 if listed else None,
+            listed_inet_down_cost=.02 if listed else None, min_bid_price=round(price*.5, 3),
+            current_rentals_running=rnd.randint(0, num_gpus), current_rentals_on_demand=0,
+            num_reports=0, timeout=0, end_date=None, earn_day=rnd.uniform(0, 50),
+            inet_up=rnd.uniform(10, 1000), inet_down=rnd.uniform(10, 1000), gpu_occupancy="D "*num_gpus,
+        ))
+    return machines
+
+_ops = {
+    "eq":    lambda a, b: a == b,
+    "neq":   lambda a, b: a != b,
+    "gt":    lambda a, b: a is not None and a > b,
+    "gte":   lambda a, b: a is not None and a >= b,
+    "lt":    lambda a, b: a is not None and a < b,
+    "lte":   lambda a, b: a is not None and a <= b,
+    "in":    lambda a, b: a in b,
+    "notin": lambda a, b: a not in b,
+}
+
+def _coerce(value, like):
+    """ Converts a query value (usually a string) to the type of the offer field `like`.
+    """
+    if isinstance(value, list):
+        return [_coerce(v, like) for v in value]
+    if isinstance(value, str):
+        if isinstance(like, bool) or value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        if isinstance(like, (int, float)):
+            try:
+                return float(value)
+            except ValueError:
+                return value
+        return value.replace("_", " ") if isinstance(like, str) else value
+    return value
+
+def filter_offers(offers, query):
+    """ Applies a `/bundles` query (as built by `parse_query`) to a list of offers.
+        Supports the comparison operators, `order`, `type` and `limit`.
+    """
+    query = dict(query)
+    order = query.pop("order", [])
+    limit = query.pop("limit", None)
+    instance_type = query.pop("type", "on-demand")
+    query.pop("disable_bundling", None)
+    checks = []
+    for field, ops in query.items():
+        if not isinstance(ops, dict):
+            continue
+        like = next((o.get(field) for o in offers[:1]), None)
+        for op, value in ops.items():
+            if op in _ops:
+                checks.append((field, _ops[op], _coerce(value, like)))
+    result = [o for o in offers if all(check(o.get(field), value) for field, check, value in checks)]
+    if instance_type == "bid":
+        result = [dict(o, dph_total=o["min_bid"], is_bid=True) for o in result]
+    for field, direction in reversed(order):
+        if result and field in result[0]:
+            result.sort(key=lambda o: (o.get(field) is None, o.get(field) or 0), reverse=direction == "desc")
+    if limit is not None:
+        result = result[:int(limit)]
+    return result
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes. With Nagle's algorithm on, the body waits
+        # for the client's delayed ack of the headers, adding ~40ms to every keep-alive request.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self): self.server.stand_in._handle(self, "GET")
+    def do_PUT(self): self.server.stand_in._handle(self, "PUT")
+    def do_POST(self): self.server.stand_in._handle(self, "POST")
+    def do_DELETE(self): self.server.stand_in._handle(self, "DELETE")
+
+class LocalVastServer:
+    """ Stateful, in-process HTTP stand-in for the vast.ai api. See the module docs for an example.
+    """
+    def __init__(self, api_key="local-test-api-key", offers=None, num_offers=1000, num_machines=10,
+                 latency_s=0., jitter_s=0., error_rate=0., error_codes=(429, 500, 502, 503),
+                 pull_s=2., start_s=1., stop_s=.5, seed=0, port=0):
+        """
+        Args:
+            api_key (str): Api key accepted by the server. (default: 'local-test-api-key')
+            offers (list of dict, optional): Offers to serve. (default: `generate_offers(num_offers)`)
+            num_offers (int): Number of synthetic offers, if `offers` isn't given. (default: 1000)
+            num_machines (int): Number of synthetic host machines. (default: 10)
+            latency_s (float): Added latency of every response, in seconds. (default: 0)
+            jitter_s (float): Random extra latency, uniform in [0, jitter_s). (default: 0)
+            error_rate (float): Fraction of requests answered with an error from `error_codes`. (default: 0)
+            error_codes (tuple of int): Injected error statuses. 429s carry a Retry-After header.
+            pull_s (float): Seconds a new instance spends loading its image. (default: 2)
+            start_s (float): Seconds from image loaded (or start request) to running. (default: 1)
+            stop_s (float): Seconds from stop request to exited. (default: .5)
+            seed (int): Random seed for synthetic data, jitter and errors. (default: 0)
+            port (int): Port to listen on. (default: any free port)
+        """
+        self.api_key = api_key
+        self.offers = offers if offers is not None else generate_offers(num_offers, seed=seed)
+        self.machines = generate_machines(num_machines, seed=seed)
+        self.instances = {}
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.pull_s, self.start_s, self.stop_s = pull_s, start_s, stop_s
+        self.requests = Counter()
+        """ Request counts by `"METHOD /path"`, with ids replaced by `{id}` """
+        self.connections = set()
+        """ Client addresses seen, i.e. the number of distinct TCP connections """
+        self._rnd = random.Random(seed)
+        self._lock = threading.RLock()
+        self._rented = set()
+        self._next_contract = 1000000
+        self._server = _ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """ Api base url to pass to `VastClient` or `--url`. """
+        return "http://127.0.0.1:%i/api/v0"%self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="vastai-local-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_instances(self, n, status="running", **fields):
+        """ Adds `n` instances to the account, e.g. to simulate a large fleet.
+        Args:
+            n (int): Number of instances.
+            status (str): Their `actual_status`. (default: 'running')
+            **fields: Extra instance fields.
+        Returns:
+            list of int: new instance ids
+        """
+        ids = []
+        with self._lock:
+            for offer in self.offers[:n] if n <= len(self.offers) else generate_offers(n, seed=len(self.instances)):
+                inst = self._new_instance(offer, {"image": "vastai/test", "label": None})
+                inst.update(actual_status=status, cur_state=status, intended_status=status, next_state=status,
+                            status_msg="Successfully loaded vastai/test", **fields)
+                inst["_schedule"] = []
+                ids.append(inst["id"])
+        return ids
+
+    def _new_instance(self, offer, req):
+        self._next_contract += 1
+        now = time.time()
+        image = req.get("image") or "vastai/test"
+        inst = {k: v for k, v in offer.items() if k not in ("ask_contract_id", "score", "rentable", "rented")}
+        inst.update(id=self._next_contract, image_uuid=image, label=req.get("label"),
+                    actual_status=None, cur_state="running", intended_status="running", next_state="running",
+                    status_msg=None, start_date=now, ssh_host="ssh5.vast.ai", ssh_port=10000 + self._next_contract % 50000,
+                    ssh_idx="5", image_runtype=req.get("runtype", "ssh"), image_args=[], jupyter_token="token",
+                    gpu_util=0., gpu_temp=35., inet_up_billed=0., inet_down_billed=0., is_bid=req.get("price") is not None,
+                    bundle_id=None, disk_space=float(req.get("disk") or 10))
+        inst["_schedule"] = [
+            (now, dict(actual_status="loading", status_msg="Pulling image %s"%image)),
+            (now + self.pull_s, dict(status_msg="Successfully loaded %s"%image)),
+            (now + self.pull_s + self.start_s, dict(actual_status="running")),
+        ]
+        self.instances[inst["id"]] = inst
+        return inst
+
+    def _instance_view(self, inst):
+        """ Applies due lifecycle transitions and returns the public fields of an instance.
+        """
+        now = time.time()
+        schedule = inst["_schedule"]
+        while schedule and schedule[0][0] <= now:
+            inst.update(schedule.pop(0)[1])
+        inst["duration"] = now - inst["start_date"]
+        return {k: v for k, v in inst.items() if not k.startswith("_")}
+
+    def _handle(self, handler, method):
+        self.connections.add(handler.client_address)
+        parsed = urlparse(handler.path)
+        path = parsed.path[len("/api/v0"):] if parsed.path.startswith("/api/v0") else parsed.path
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        with self._lock:
+            self.requests["%s %s"%(method, re.sub(r"/\d+/", "/{id}/", path))] += 1
+            delay = self.latency_s + (self._rnd.random()*self.jitter_s if self.jitter_s else 0.)
+            inject = self.error_rate and self._rnd.random() < self.error_rate
+            status = self._rnd.choice(self.error_codes) if inject else None
+        if delay:
+            time.sleep(delay)
+        if status is not None:
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            return self._respond(handler, status, {"success": False, "msg": "Injected error %i"%status}, headers)
+        try:
+            data = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError:
+            return self._respond(handler, 400, {"success": False, "msg": "Invalid json"})
+        if not (method == "PUT" and path == "/users/current/") and params.get("api_key") != self.api_key:
+            return self._respond(handler, 401, {"success": False, "msg": "Invalid api key"})
+        status, resp = self._route(method, path, params, data)
+        return self._respond(handler, status, resp)
+
+    def _route(self, method, path, params, data):
+        with self._lock:
+            if path == "/users/current/":
+                if method == "PUT" and data.get("password") is None:
+                    return 401, {"success": False, "msg": "Invalid login"}
+                return 200, {"id": 1234, "username": data.get("username", "local"), "api_key": self.api_key,
+                             "ssh_key": "", "balance": 100.}
+            if path == "/instances" and method == "GET":
+                return 200, {"instances": [self._instance_view(inst) for inst in self.instances.values()]}
+            if path == "/bundles" and method == "GET":
+                query = json.loads(params.get("q", "{}"))
+                available = [o for o in self.offers if o["id"] not in self._rented]
+                return 200, {"offers": filter_offers(available, query)}
+            if path == "/machines" and method == "GET":
+                return 200, {"machines": self.machines}
+            m = re.match(r"^/asks/(\d+)/$", path)
+            if m and method == "PUT":
+                offer_id = int(m.group(1))
+                offer = next((o for o in self.offers if o["id"] == offer_id), None)
+                if offer is None or offer_id in self._rented:
+                    return 400, {"success": False, "error": "no_such_ask", "msg": "Offer %i is no longer available."%offer_id}
+                self._rented.add(offer_id)
+                inst = self._new_instance(offer, data)
+                return 200, {"success": True, "new_contract": inst["id"]}
+            m = re.match(r"^/instances/(?:bid_price/)?(\d+)/$", path)
+            if m:
+                inst = self.instances.get(int(m.group(1)))
+                if inst is None:
+                    return 404, {"success": False, "msg": "No such instance"}
+                if method == "DELETE":
+                    del self.instances[inst["id"]]
+                    return 200, {"success": True}
+                if method == "PUT" and "/bid_price/" in path:
+                    price = data.get("price")
+                    if type(price) not in (int, float):
+                        return 400, {"success": False, "msg": "Expected a numeric price, got %r"%(price,)}
+                    inst.update(dph_base=price, dph_total=price + inst["storage_total_cost"])
+                    return 200, {"success": True}
+                if method == "PUT":
+                    self._instance_view(inst)
+                    now = time.time()
+                    if "label" in data:
+                        inst["label"] = data["label"]
+                    if data.get("state") == "stopped":
+                        inst.update(intended_status="stopped", cur_state="stopped", next_state="stopped")
+                        inst["_schedule"] = [(now + self.stop_s, dict(actual_status="exited"))]
+                    elif data.get("state") == "running":
+                        inst.update(intended_status="running", cur_state="running", next_state="running")
+                        inst["_schedule"] = [(now + self.start_s, dict(actual_status="running"))]
+                    return 200, {"success": True}
+            m = re.match(r"^/machines/(\d+)/", path)
+            if m or path in ("/machines/create_asks/", "/machines/create_bids/"):
+                machine_id = int(m.group(1)) if m else data.get("machine")
+                machine = next((mach for mach in self.machines if mach["id"] == machine_id), None)
+                if machine is None:
+                    return 200, {"success": False, "msg": "No such machine: %s"%machine_id}
+                if path == "/machines/create_asks/" and method == "PUT":
+                    machine.update(listed=True, listed_storage_cost=data.get("price_disk") or .15,
+                                   listed_inet_up_cost=data.get("price_inetu"),
+                                   listed_inet_down_cost=data.get("price_inetd"))
+                    if data.get("price_gpu") is not None:
+                        machine["listed_gpu_cost"] = data["price_gpu"]
+                elif path == "/machines/create_bids/" and method == "PUT":
+                    machine["defjob"] = dict(image=data.get("image"), args=data.get("args"),
+                                             price_gpu=data.get("price_gpu"))
+                elif path.endswith("/asks/") and method == "DELETE":
+                    machine.update(listed=False, listed_gpu_cost=None)
+                elif path.endswith("/defjob/") and method == "DELETE":
+                    machine["defjob"] = None
+                elif path.endswith("/minbid/") and method == "PUT":
+                    machine["min_bid_price"] = data.get("price")
+                return 200, {"success": True}
+        return 404, {"success": False, "msg": "Not found: %s %s"%(method, path)}
+
+    def _respond(self, handler, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.write(body)
@@ -0,0 +1,134 @@
+""" Launch latency instrumentation.
+
+`LaunchTimeline` timestamps each instance from the `create_instance` request until the
+first successful ssh connection, so slow stages can be attributed to gpu models, hosts
+or images. A `VastClient` keeps one in `VastClient.timeline`; instances are observed
+whenever `get_instances` refreshes them (e.g. while waiting in `Instance.wait_until_running`).
+"""
+import time
+import pandas as pd
+
+milestones = ("requested", "accepted", "pulling", "loaded", "running", "ssh")
+""" Launch milestones, in the order they normally happen. """
+
+stages = (
+    ("api",             "requested", "accepted"),
+    ("queue",           "accepted",  "pulling"),
+    ("image_pull",      "pulling",   "loaded"),
+    ("container_start", "loaded",    "running"),
+    ("start",           "accepted",  "running"),
+    ("ssh",             "running",   "ssh"),
+    ("total",           "requested", "ssh"),
+)
+""" `(name, from milestone, to milestone)` for each reported stage. Stages whose milestones
+    weren't observed (e.g. an image pull finishing between two polls) are left blank. """
+
+group_fields = ("gpu_name", "host_id", "image_uuid")
+""" Instance fields recorded with each launch, for grouping latencies. """
+
+def _milestone(actual_status, status_msg):
+    """ Maps an observed `actual_status`/`status_msg` pair to a launch milestone, or None.
+    """
+    if actual_status == "running":
+        return "running"
+    msg = (status_msg or "").lower()
+    if msg.startswith("successfully loaded") or "downloaded newer image" in msg or "image is up to date" in msg:
+        return "loaded"
+    if actual_status == "loading" or "pull" in msg or "download" in msg:
+        return "pulling"
+    return None
+
+class LaunchTimeline:
+    """ Records launch events keyed by contract (instance) id.
+    """
+    def __init__(self):
+        self.events = {}
+        """ `{contract_id: [(timestamp, actual_status, status_msg), ...]}` for each observed transition """
+        self.times = {}
+        """ `{contract_id: {milestone: timestamp}}` for the first time each milestone was seen """
+        self.attributes = {}
+        """ `{contract_id: {field: value}}` for the fields in `group_fields` """
+
+    def __contains__(self, contract_id):
+        return contract_id in self.times
+
+    def record(self, contract_id, milestone, timestamp=None):
+        """ Records the first time `contract_id` reached `milestone`.
+        Args:
+            contract_id (int): New contract (instance) id.
+            milestone (str): One of `milestones`.
+            timestamp (float, optional): Seconds since the epoch. (default: now)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.times.setdefault(contract_id, {}).setdefault(milestone, timestamp)
+
+    def observe(self, instance, timestamp=None):
+        """ Records a status transition of a tracked instance. Untracked instances are ignored.
+        Args:
+            instance (Instance): A refreshed instance.
+            timestamp (float, optional): Seconds since the epoch. (default: now)
+        """
+        if instance.id not in self.times:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        status = (getattr(instance, 'actual_status', None), getattr(instance, 'status_msg', None))
+        events = self.events.setdefault(instance.id, [])
+        if events and events[-1][1:] == status:
+            return
+        events.append((timestamp,) + status)
+        attributes = self.attributes.setdefault(instance.id, {})
+        for field in group_fields:
+            if getattr(instance, field, None) is not None:
+                attributes[field] = getattr(instance, field)
+        milestone = _milestone(*status)
+        if milestone is not None:
+            self.record(instance.id, milestone, timestamp)
+
+    def mark_ssh(self, contract_id, timestamp=None):
+        """ Records the first successful ssh connection to a tracked instance.
+        """
+        if contract_id in self.times:
+            self.record(contract_id, "ssh", timestamp)
+
+    def latencies(self):
+        """ Per launch stage latencies.
+        Returns:
+            pandas.DataFrame: One row per contract id with `group_fields` and a column of
+                seconds for each stage in `stages`.
+        """
+        rows = []
+        for contract_id, times in self.times.items():
+            row = dict(id=contract_id)
+            row.update({field: self.attributes.get(contract_id, {}).get(field) for field in group_fields})
+            for name, start, end in stages:
+                row[name] = times[end] - times[start] if start in times and end in times else None
+            rows.append(row)
+        columns = ["id"] + list(group_fields) + [name for name, _, _ in stages]
+        return pd.DataFrame(rows, columns=columns).set_index("id").astype({name: float for name, _, _ in stages})
+
+    def summary(self, by="gpu_name", stage="start"):
+        """ Latency statistics of one stage, grouped by an instance field.
+        Args:
+            by (str): One of `group_fields`. (default: 'gpu_name')
+            stage (str): One of the names in `stages`. (default: 'start')
+        Returns:
+            pandas.DataFrame: count, mean, median and p90 seconds per group, fastest first.
+        """
+        grouped = self.latencies().dropna(subset=[stage]).groupby(by)[stage]
+        return pd.DataFrame({"count": grouped.count(), "mean": grouped.mean(),
+                             "median": grouped.median(), "p90": grouped.quantile(.9)}).sort_values("median")
+
+    def histogram(self, by="gpu_name", stage="start", bins=10):
+        """ Latency histogram of one stage, grouped by an instance field. All groups share bin edges.
+        Args:
+            by (str): One of `group_fields`. (default: 'gpu_name')
+            stage (str): One of the names in `stages`. (default: 'start')
+            bins (int or list of float): Number of bins, or bin edges in seconds. (default: 10)
+        Returns:
+            pandas.DataFrame: Launch counts with one row per group and one column per bin.
+        """
+        df = self.latencies().dropna(subset=[stage])
+        binned = pd.cut(df[stage], bins, include_lowest=True)
+        return df.groupby([df[by], binned], observed=False).size().unstack(fill_value=0)
@@ -2,14 +2,32 @@
 
 from __future__ import unicode_literals, print_function
 
+import time
+_import_started = time.perf_counter() # Reported as the imports phase by `--profile`.
+
 import re
 import json
+import functools
+from collections import OrderedDict
 import sys
 import argparse
 import os
+
+if __name__ == "__main__" and "--no-daemon" not in sys.argv:
+    # Hand the command to a running `vast start daemon` before importing anything else.
+    try:
+        from vastai.daemon import forward
+    except ImportError:
+        pass
+    else:
+        _status = forward(sys.argv[1:])
+        if _status is not None:
+            sys.exit(_status)
+
 import requests
 import getpass
 
+from vastai import jsonlib
 
 
 try:
@@ -34,6 +52,8 @@ api_key_file_base = "~/.vast_api_key"
 """ /path/to/.vast_api_key (default: `~/.vast_api_key`) """
 api_key_file = os.path.expanduser(api_key_file_base)
 api_key_guard = object()
+session = requests.Session()
+""" Used for all requests, so a process running several commands (see `vastai.daemon`) reuses connections. """
 
 class argument(object):
     def __init__(self, *args, **kwargs):
@@ -54,37 +74,39 @@ class hidden_aliases(object):
         self.l.append(x)
 
 class apwrap(object):
+    """ argparse wrapper which turns `verb__obj` functions into `verb obj` commands.
+        Commands are only recorded in `commands` when they're declared. `parse_args` builds a parser
+        with just the selected command's arguments, and the top level help lists every command
+        from `commands` without building their arguments.
+    """
     def __init__(self, *args, **kwargs):
         kwargs["formatter_class"] = argparse.RawDescriptionHelpFormatter
-        self.parser = argparse.ArgumentParser(*args, **kwargs)
-        self.parser.set_defaults(func=self.fail_with_help)
-        self.subparsers_ = None
-        self.subparser_objs = []
+        self.parser_args = (args, kwargs)
+        self.commands = OrderedDict()
+        """ `{name: (func, arguments, aliases, help, add_parser kwargs)}` in declaration order """
+        self.command_names = {}
+        """ `{name or alias: name}` """
+        self.global_arguments = []
+        self.parsers = {}
+        """ Built parsers, keyed by the name of their fully built command (None for the help parser) """
         self.added_help_cmd = False
+        self.added_global_arguments = False
         self.post_setup = []
         self.verbs = set()
         self.objs = set()
 
+    @property
+    def parser(self):
+        return self.build_parser()
+
     def fail_with_help(self, *a, **kw):
-        self.parser.print_help(sys.stderr)
+        self.build_parser().print_help(sys.stderr)
         raise SystemExit
 
     def add_argument(self, *a, **kw):
-        if not kw.get("parent_only"):
-            for x in self.subparser_objs:
-                try:
-                    x.add_argument(*a, **kw)
-                except argparse.ArgumentError:
-                    # duplicate - or maybe other things, hopefully not
-                    pass
-        return self.parser.add_argument(*a, **kw)
-
-    def subparsers(self, *a, **kw):
-        if self.subparsers_ is None:
-            kw["metavar"] = "command"
-            kw["help"] = "command to run. one of:"
-            self.subparsers_ = self.parser.add_subparsers(*a, **kw)
-        return self.subparsers_
+        parent_only = kw.pop("parent_only", False)
+        self.global_arguments.append((a, kw, parent_only))
+        self.parsers.clear()
 
     def get_name(self, verb, obj):
         if obj:
@@ -113,12 +135,10 @@ class apwrap(object):
             for x in aliases:
                 verb, _, obj = x.partition(" ")
                 aliases_transformed.append(self.get_name(verb, obj))
-            kwargs["formatter_class"] =argparse.RawDescriptionHelpFormatter
-            sp = self.subparsers().add_parser(name, aliases=aliases_transformed, help=help_, **kwargs)
-            self.subparser_objs.append(sp)
-            for arg in arguments:
-                sp.add_argument(*arg.args, **arg.kwargs)
-            sp.set_defaults(func=func)
+            self.commands[name] = (func, arguments, aliases_transformed, help_, dict(kwargs))
+            for x in [name] + list(aliases_transformed):
+                self.command_names[x] = name
+            self.parsers.clear()
             return func
         if len(arguments) == 1 and type(arguments[0]) != argument:
             func = arguments[0]
@@ -126,6 +146,43 @@ class apwrap(object):
             return inner(func)
         return inner
 
+    def build_parser(self, name=None):
+        """ Builds the parser for command `name`, or returns it if it's already built.
+        Args:
+            name (str, optional): Command to build. If None, builds a parser listing every command
+                for help and error messages, without any of their arguments.
+        Returns:
+            argparse.ArgumentParser
+        """
+        if name in self.parsers:
+            return self.parsers[name]
+        args, kwargs = self.parser_args
+        parser = argparse.ArgumentParser(*args, **kwargs)
+        parser.set_defaults(func=self.fail_with_help)
+        for a, kw, parent_only in self.global_arguments:
+            parser.add_argument(*a, **kw)
+        subparsers = parser.add_subparsers(metavar="command", help="command to run. one of:")
+        for cmd_name, (func, arguments, aliases, help_, kw) in self.commands.items():
+            if name is None:
+                subparsers.add_parser(cmd_name, aliases=aliases, help=help_, add_help=False)
+            elif cmd_name == name:
+                kw = dict(kw, formatter_class=argparse.RawDescriptionHelpFormatter)
+                if kw.get("epilog"):
+                    kw["epilog"] = deindent(kw["epilog"])
+                sp = subparsers.add_parser(cmd_name, aliases=aliases, help=help_, **kw)
+                for arg in arguments:
+                    sp.add_argument(*arg.args, **arg.kwargs)
+                for a, kw, parent_only in self.global_arguments:
+                    if parent_only: continue
+                    try:
+                        sp.add_argument(*a, **kw)
+                    except argparse.ArgumentError:
+                        # duplicate - or maybe other things, hopefully not
+                        pass
+                sp.set_defaults(func=func)
+        self.parsers[name] = parser
+        return parser
+
     def parse_args(self, argv=None, *a, **kw):
         if argv is None:
             argv = sys.argv[1:]
@@ -135,11 +192,13 @@ class apwrap(object):
                 argv_[-1] += " " + x
             else:
                 argv_.append(x)
-        args = self.parser.parse_args(argv_, *a, **kw)
+        name = next((self.command_names[x] for x in argv_ if x in self.command_names), None)
+        args = self.build_parser(name).parse_args(argv_, *a, **kw)
         for func in self.post_setup:
             func(args)
         return args
 
+_imports_done = time.perf_counter()
 parser = apwrap()
 
 def apiurl(args, subpath, query_args=None):
@@ -163,10 +222,43 @@ def apiurl(args, subpath, query_args=None):
         '''
         #an_iterator = (<expression> for <l-expression> in <expression>)
         return args.url + subpath + "?" + "&".join(
-                "{x}={y}".format(x=x, y=quote_plus(y if isinstance(y, str) else json.dumps(y))) for x, y in query_args.items())
+                "{x}={y}".format(x=x, y=quote_plus(y if isinstance(y, str) else jsonlib.dumps(y))) for x, y in query_args.items())
     else:
         return args.url + subpath
 
+def cached_get(args, kind, req_url, key=""):
+    """ GETs a list of instances, offers or machines, through the state cache (see `vastai.cache`).
+        With `--cached`, rows from the cache are returned if there are any, and with `--max-age`, if
+        they're younger than `args.max_age` seconds. Otherwise they're requested, and stored in the
+        cache if either option was given or the cache file already exists.
+    Params:
+        args (dict): parsed command line arguments.
+        kind (str): 'instances', 'offers' or 'machines', as in the response json.
+        req_url (str): url to request.
+        key (str): identifies the request among others of the same `kind`, e.g. the offer query. It's
+            scoped to `args.url` and `args.api_key`, see `vastai.cache.scoped_key`.
+    Returns:
+        list of dict: rows of the response.
+    """
+    from vastai.cache import StateCache, default_cache_path, scoped_key
+    key = scoped_key(args.url, args.api_key, key)
+    cached, max_age = getattr(args, "cached", False), getattr(args, "max_age", None)
+    cache = None
+    if cached or max_age is not None or os.path.exists(default_cache_path):
+        cache = StateCache()
+    if cache is not None and (cached or max_age is not None):
+        hit = cache.load(kind, key, max_age_s=max_age)
+        if hit is not None:
+            if not args.raw:
+                print("Using %s cached %.0fs ago."%(kind, time.time() - hit[1]), file=sys.stderr)
+            return hit[0]
+    r = session.get(req_url)
+    r.raise_for_status()
+    rows = jsonlib.loads(r.content)[kind]
+    if cache is not None:
+        cache.store(kind, rows, key)
+    return rows
+
 def deindent(message):
     """
     deindent a quoted string
@@ -224,134 +316,296 @@ instance_fields = (
 Instance fields for use in `display_table` to print a table of instances.
 """
 
+machine_fields = (
+    ("id",                      "ID",       "{}",       None, True),
+    ("hostname",                "Hostname", "{}",       None, True),
+    ("num_gpus",                "Num",      "{} x",     None, False),
+    ("gpu_name",                "Model",    "{}",       None, True),
+    ("listed",                  "Listed",   "{}",       lambda x: "yes" if x else "no", True),
+    ("listed_gpu_cost",         "$/gpu/hr", "{:0.3f}",  None, True),
+    ("min_bid_price",           "Min bid",  "{:0.3f}",  None, True),
+    ("current_rentals_running", "Rented",   "{}",       None, False),
+    ("reliability2",            "R",        "{:0.1f}",  lambda x: x * 100, True),
+    ("earn_day",                "$/day",    "{:0.2f}",  None, True),
+    ("disk_space",              "Storage",  "{:.0f}",   None, True),
+    ("inet_up",                 "Net up",   "{:0.1f}",  None, True),
+    ("inet_down",               "Net down", "{:0.1f}",  None, True),
+    ("verification",            "Verified", "{}",       None, True),
+)
+"""
+Machine fields for use in `display_table` to print a table of host machines.
+"""
+
+output_formats = ("table", "ndjson", "csv")
+""" Output formats of `write_rows`. """
+
+query_op_names = {
+    ">=": "gte",
+    ">": "gt",
+    "gt": "gt",
+    "gte": "gte",
+    "<=": "lte",
+    "<": "lt",
+    "lt": "lt",
+    "lte": "lte",
+    "!=": "neq",
+    "==": "eq",
+    "=": "eq",
+    "eq": "eq",
+    "neq": "neq",
+    "noteq": "neq",
+    "not eq": "neq",
+    "notin": "notin",
+    "not in": "notin",
+    "nin": "notin",
+    "in": "in",
+}
+"""
+Maps query operators to the operator names understood by the `/bundles` endpoint.
+"""
+
+query_field_alias = {
+    "cuda_vers":        "cuda_max_good",
+    "display_active":   "gpu_display_active",
+    "reliability":      "reliability2",
+    "dlperf_usd":       "dlperf_per_dphtotal",
+    "dph":              "dph_total",
+    "flops_usd":        "flops_per_dphtotal",
+}
+"""
+Short field names accepted in queries and sort orders, mapped to their api field names.
+"""
+
+query_field_multiplier = {
+    "cpu_ram"   : 1000,
+    "duration"  : 1.0 / (24.0*60.0*60.0),
+}
+
+query_fields = {
+    "compute_cap",
+    "cpu_cores",
+    "cpu_cores_effective",
+    "cpu_ram",
+    "cuda_max_good",
+    "disk_bw",
+    "disk_space",
+    "dlperf",
+    "dlperf_per_dphtotal",
+    "dph_total",
+    "duration",
+    "external",
+    "flops_per_dphtotal",
+    "gpu_display_active",
+    #"gpu_ram_free_min",
+    "gpu_mem_bw",
+    "gpu_name",
+    "gpu_ram",
+    "has_avx",
+    "host_id",
+    "id",
+    "inet_down",
+    "inet_down_cost",
+    "inet_up",
+    "inet_up_cost",
+    "min_bid",
+    "mobo_name",
+    "num_gpus",
+    "pci_gen",
+    "pcie_bw",
+    "reliability2",
+    "rentable",
+    "rented",
+    "storage_cost",
+    "total_flops",
+    "verified"
+}
+"""
+Fields recognized by `parse_query`. Other fields are passed through with a warning.
+"""
+
+# One comparison: field, operator, value. Groups are (field, op, space, value, space).
+_query_term_re = re.compile(r"([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|[^ ]+)?( *)")
+
+def _query_error(message, query_str, offset):
+    """ Builds a ValueError pointing at `offset` in `query_str`.
+    """
+    return ValueError("{} (at offset {}):\n    {}\n    {}^".format(message, offset, query_str, " "*offset))
+
+@functools.lru_cache(maxsize=4096)
+def _compile_query(query_str):
+    """ Tokenizes and validates a stripped query string.
+    Returns:
+        tuple: `(field, op_name, value)` terms. `value` is a str, a tuple of str for 
+            `in`/`notin`, or None for a wildcard.
+    Raises:
+        ValueError: if `query_str` cannot be parsed
+    """
+    terms = []
+    pos = 0
+    while pos < len(query_str):
+        m = _query_term_re.match(query_str, pos)
+        if m is None:
+            raise _query_error("Unexpected character {!r}. Did you forget to quote your query?".format(query_str[pos]), 
+                               query_str, pos)
+        pos = m.end()
+        field, op, _, value, _ = m.groups("")
+        op = op.strip()
+        op_name = query_op_names.get(op)
+        field = query_field_alias.get(field, field)
+
+        if not op_name:
+            raise _query_error("Unknown operator. Did you forget to quote your query? " + repr(op), 
+                               query_str, m.start(2) if op else m.end(1))
+        value = value.strip(",[]")
+        if op_name in ["in", "notin"]:
+            value = tuple(x.strip() for x in value.split(",") if x.strip())
+        if not value:
+            raise _query_error("Value cannot be blank. Did you forget to quote your query? " + repr((field, op, value)),
+                               query_str, m.start(4) if m.group(4) else m.end(3))
+        if value in ["?", "*", "any"]:
+            if op_name != "eq":
+                raise _query_error("Wildcard only makes sense with equals.", query_str, m.start(4))
+            terms.append((field, op_name, None))
+            continue
+        if field in query_field_multiplier:
+            try:
+                value = str(float(value) * query_field_multiplier[field])
+            except (TypeError, ValueError):
+                raise _query_error("Expected a number for {}".format(field), query_str, m.start(4))
+        terms.append((field, op_name, value))
+    return tuple(terms)
+
 def parse_query(query_str, res=None):
     """ Parses a query string for querying instanes by field values. 
+        Parsed queries are cached, so repeatedly parsing the same string is cheap.
     Args:
         query_str (str): Query an Instance field. See `./vast.py --help` for query format.
         res (dict, optional): dict to be decorated with parsed query
     Returns:
         dict: `res` or a new dict decorated with parsed query
     Raises:
-        ValueError: if `query_str` cannot be parsed
+        ValueError: if `query_str` cannot be parsed. The message points at the failing offset.
     """
     if res is None: res = {}
     if type(query_str) == list:
         query_str = " ".join(query_str)
-    query_str = query_str.strip()
-    opts = re.findall("([a-zA-Z0-9_]+)( *[=><!]+| +(?:[lg]te?|nin|neq|eq|not ?eq|not ?in|in) )?( *)(\[[^\]]+\]|[^ ]+)?( *)", query_str)
-    #res = {}
-    op_names = {
-        ">=": "gte",
-        ">": "gt",
-        "gt": "gt",
-        "gte": "gte",
-        "<=": "lte",
-        "<": "lt",
-        "lt": "lt",
-        "lte": "lte",
-        "!=": "neq",
-        "==": "eq",
-        "=": "eq",
-        "eq": "eq",
-        "neq": "neq",
-        "noteq": "neq",
-        "not eq": "neq",
-        "notin": "notin",
-        "not in": "notin",
-        "nin": "notin",
-        "in": "in",
-    };
-    
-    field_alias = {
-        "cuda_vers":        "cuda_max_good",
-        "display_active":   "gpu_display_active",
-        "reliability":      "reliability2",
-        "dlperf_usd":       "dlperf_per_dphtotal",
-        "dph":              "dph_total",
-        "flops_usd":        "flops_per_dphtotal",
-    };
-    
-    field_multiplier = {
-        "cpu_ram"   : 1000,
-        "duration"  : 1.0 / (24.0*60.0*60.0),
-    }
-    
-    fields = {
-        "compute_cap",
-        "cpu_cores",
-        "cpu_cores_effective",
-        "cpu_ram",
-        "cuda_max_good",
-        "disk_bw",
-        "disk_space",
-        "dlperf",
-        "dlperf_per_dphtotal",
-        "dph_total",
-        "duration",
-        "external",
-        "flops_per_dphtotal",
-        "gpu_display_active",
-        #"gpu_ram_free_min",
-        "gpu_mem_bw",
-        "gpu_name",
-        "gpu_ram",
-        "has_avx",
-        "host_id",
-        "id",
-        "inet_down",
-        "inet_down_cost",
-        "inet_up",
-        "inet_up_cost",
-        "min_bid",
-        "mobo_name",
-        "num_gpus",
-        "pci_gen",
-        "pcie_bw",
-        "reliability2",
-        "rentable",
-        "rented",
-        "storage_cost",
-        "total_flops",
-        "verified"
-    };
-    
-    joined = "".join("".join(x) for x in opts)
-    if joined != query_str:
-        raise ValueError("Unconsumed text. Did you forget to quote your query? " + repr(joined) + " != " + repr(query_str))
-    for field, op, _, value, _ in opts:
-        value = value.strip(",[]")
-        v = res.setdefault(field, {})
-        op = op.strip()
-        op_name = op_names.get(op)
-        
-        if field in field_alias:
-            field = field_alias[field];
-        
-        if not field in fields:
+    for field, op_name, value in _compile_query(query_str.strip()):
+        # Warned here rather than in `_compile_query`, so a cached query warns every time it's parsed.
+        if not field in query_fields:
             print("Warning: Unrecognized field: {}, see list of recognized fields.".format(field), file=sys.stderr);
-        if not op_name:
-            raise ValueError("Unknown operator. Did you forget to quote your query? " + repr(op).strip("u"))
-        if op_name in ["in", "notin"]:
-            value = [x.strip() for x in value.split(",") if x.strip()]
-        if not value:
-            raise ValueError("Value cannot be blank. Did you forget to quote your query? " + repr((field, op, value)))
-        if not field:
-            raise ValueError("Field cannot be blank. Did you forget to quote your query? " + repr((field, op, value)))
-        if value in ["?", "*", "any"]:
-            if op_name != "eq":
-                raise ValueError("Wildcard only makes sense with equals.")
-            if field in v:
-                del v[field]
-            if field in res:
-                del res[field]
+        if value is None:
+            res.pop(field, None)
             continue
+        res.setdefault(field, {})[op_name] = list(value) if type(value) is tuple else value
+    return res
 
-        if field in field_multiplier:
-            value = str(float(value) * field_multiplier[field]);
+parse_query.cache_info = _compile_query.cache_info
+parse_query.cache_clear = _compile_query.cache_clear
 
-        v[op_name] = value
-        res[field] = v;
-    return res
+def parse_order(order_str):
+    """ Parses a comma-separated sort order, e.g. `num_gpus,total_flops-`.
+    Args:
+        order_str (str): Fields to sort on. Postfix field with `-` to sort descending.
+    Returns:
+        list: `[field, direction]` pairs, with field aliases resolved.
+    """
+    order = []
+    for name in order_str.split(","):
+        name = name.strip()
+        if not name: continue
+        direction = "asc"
+        if name.strip("-") != name:
+            direction = "desc"
+        field = name.strip("-");
+        order.append([query_field_alias.get(field, field), direction])
+    return order
+
+def format_row(row, fields):
+    """ Formats one instance or offer as table cells.
+    Args:
+        row (dict): instance or offer, or any object with a `get` method for accessing its attributes.
+        fields (tuple of tuples): like `displayable_fields` or `instance_fields`
+    Returns:
+        list of str: one formatted cell per field
+    """
+    cells = []
+    for key, name, fmt, conv, _ in fields:
+        val = row.get(key, None)
+        cells.append("-" if val is None else fmt.format(conv(val) if conv else val))
+    return cells
+
+def justify_row(cells, lengths, fields):
+    """ Pads cells from `format_row` to column `lengths` and joins them into a table line. """
+    return "  ".join(s.ljust(l) if f[4] else s.rjust(l) for l, s, f in zip(lengths, cells, fields))
+
+def format_table(rows, fields):
+    """ Formats a table of instances or offers.
+    Args:
+        rows (list of instances): list of instance objects with a `get` method for accessing its attributes.
+        fields (tuple of tuples): like `displayable_fields` or `instance_fields`
+    Returns:
+        list of str: header line followed by one line per row
+    """
+    out_rows = [[name for _, name, _, _, _ in fields]] + [format_row(row, fields) for row in rows]
+    lengths = [max(len(row[i]) for row in out_rows) for i in range(len(fields))]
+    return [justify_row(row, lengths, fields) for row in out_rows]
+
+def select_fields(fields, names=None):
+    """ Projects a field table onto the fields in `names`, in that order.
+    Args:
+        fields (tuple of tuples): like `displayable_fields` or `instance_fields`
+        names (list of str, optional): Field names. Names not in `fields` get a plain column. (default: all of `fields`)
+    Returns:
+        tuple of tuples
+    """
+    if not names:
+        return fields
+    by_key = {field[0]: field for field in fields}
+    return tuple(by_key.get(name, (name, name, "{}", None, True)) for name in names)
+
+def parse_fields(fields_str):
+    """ Parses a comma-separated list of field names, e.g. `id,gpu_name,listed_gpu_cost`. """
+    return [name.strip() for name in (fields_str or "").split(",") if name.strip()]
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return jsonlib.dumps(value)
+    return value
+
+def write_rows(rows, fields, fmt="table", names=None, out=None):
+    """ Writes instances, offers or machines as a table, as NDJSON (one json object per line) or as CSV.
+        NDJSON and CSV rows are written as they're formatted, so output starts right away however many
+        rows there are, and stays parseable by downstream tools.
+    Args:
+        rows (list of dict): rows to write
+        fields (tuple of tuples): like `instance_fields` or `machine_fields`; the table columns, and the
+            CSV columns unless `names` is given
+        fmt (str): one of `output_formats`. (default: 'table')
+        names (list of str, optional): only write these fields. (default: the table columns for a table
+            or CSV, every field for NDJSON)
+        out (file, optional): (default: `sys.stdout`)
+    Raises:
+        ValueError: if `fmt` isn't one of `output_formats`
+    """
+    out = out or sys.stdout
+    if fmt == "table":
+        lines = format_table(rows, select_fields(fields, names))
+        out.write("\n".join(lines) + "\n")
+    elif fmt == "ndjson":
+        encode = jsonlib.dumps
+        for row in rows:
+            out.write(encode({name: row.get(name) for name in names} if names else row) + "\n")
+    elif fmt == "csv":
+        import csv
+        names = names or [field[0] for field in fields]
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow([_csv_value(row.get(name)) for name in names])
+    else:
+        raise ValueError("Unknown output format %r, expected one of %s."%(fmt, ", ".join(output_formats)))
 
 def display_table(rows, fields):
     """ Prints a table of instances or offers.
@@ -359,33 +613,8 @@ def display_table(rows, fields):
         rows (list of instances): list of instance objects with a `get` method for accessing its attributes.
         fields (tuple of tuples): like `displayable_fields` or `instance_fields` 
     """
-    header = [name for _, name, _, _, _ in fields]
-    out_rows = [header]
-    lengths = [len(x) for x in header]
-    for instance in rows:
-        row = []
-        out_rows.append(row)
-        for key, name, fmt, conv, _ in fields:
-            conv = conv or (lambda x: x)
-            val = instance.get(key, None)
-            if val is None:
-                s = "-"
-            else:
-                val = conv(val)
-                s = fmt.format(val)
-            idx = len(row)
-            lengths[idx] = max(len(s), lengths[idx])
-            row.append(s)
-    for row in out_rows:
-        out = []
-        for l, s, f in zip(lengths, row, fields):
-            _, _, _, _, ljust = f
-            if ljust:
-                s = s.ljust(l)
-            else:
-                s = s.rjust(l)
-            out.append(s)
-        print("  ".join(out))
+    for line in format_table(rows, fields):
+        print(line)
 
 @parser.command(
     argument("-t", "--type", default="on-demand", help="whether to show `bid`(interruptible) or `on-demand` offers. default: on-demand"),
@@ -396,9 +625,13 @@ def display_table(rows, fields):
     argument("--disable-bundling", action="store_true", help="Show identical offers. This request is more heavily rate limited."),
     argument("--storage", type=float, default=5.0, help="amount of storage to use for pricing, in GiB. default=5.0GiB"),
     argument("-o", "--order", type=str, help="comma-separated list of fields to sort on. postfix field with - to sort desc. ex: -o 'num_gpus,total_flops-'.  default='score-'", default='score-'),
+    argument("--pareto",         help="only show offers on the Pareto frontier of these comma-separated fields. postfix field with - to prefer larger values. default: 'dph_total,dlperf-,total_flops-,reliability2-,inet_down-,gpu_ram-'",
+             nargs="?", const=True, default=None, metavar="OBJECTIVES"),
+    argument("--top",            help="only show the best TOP offers, ranked by --weights", type=int, default=None),
+    argument("--weights",        help="comma-separated field=weight pairs used to rank offers. ex: --weights 'dph=-2,dlperf=1'. negative weights prefer smaller values.", type=str, default=None),
     argument("query",            help="Query to search for. default: 'external=false rentable=true verified=true', pass -n to ignore default", nargs="*", default=None),
-    usage="vast search offers [--help] [--api-key API_KEY] [--raw] <query>",
-    epilog=deindent("""
+    usage="vast search offers [--help] [--api-key API_KEY] [--raw] [--pareto [OBJECTIVES]] [--top TOP] [--weights WEIGHTS] <query>",
+    epilog="""
         Query syntax:
         
             query = comparison comparison...
@@ -415,6 +648,7 @@ def display_table(rows, fields):
             ./vast search offers 'compute_cap > 610 total_flops < 5'
             ./vast search offers 'reliability > 0.99  num_gpus>=4' -o 'num_gpus-'
             ./vast search offers 'rentable = any'
+            ./vast search offers 'num_gpus>=4' --pareto 'dph,dlperf-,reliability-' --top 10
        
         Available fields:
             
@@ -452,7 +686,7 @@ def display_table(rows, fields):
             storage_cost:           float     storage cost in $/GB/month
             total_flops:            float     total TFLOPs from all GPUs
             verified:               bool      is the machine verified
-    """),
+    """,
     aliases=hidden_aliases(["search instances"]),
 )
 def search__offers(args):
@@ -468,15 +702,10 @@ def search__offers(args):
         raw (bool): return raw json output  
         type (str): query["type"]  
         disable_bundling (bool): query["disable_bundling"]  
+        pareto (str): only show offers on the Pareto frontier of these objectives  
+        top (int): only show the best `top` offers ranked by `weights`  
+        weights (str): field weights used to rank offers  
     """
-    field_alias = {
-        "cuda_vers"     : "cuda_max_good",
-        "reliability"   : "reliability2",
-        "dlperf_usd"    : "dlperf_per_dphtotal",
-        "dph"           : "dph_total",
-        "flops_usd"     : "flops_per_dphtotal",
-    };
-
     try:
 
         if args.no_default:
@@ -489,19 +718,7 @@ def search__offers(args):
         #print("query length: {}".format(len(query)));
         #for k,q in query.items():
             #print("{} {}".format(k, q));
-        order = []
-        for name in args.order.split(","):
-            name = name.strip()
-            if not name: continue
-            direction = "asc"
-            if name.strip("-") != name:
-                direction = "desc"
-            field = name.strip("-");
-            if field in field_alias:
-                field = field_alias[field];
-            order.append([field, direction])
-
-        query["order"] = order
+        query["order"] = parse_order(args.order)
         query["type"]  = args.type
         if args.disable_bundling:
             query["disable_bundling"] = True
@@ -511,11 +728,17 @@ def search__offers(args):
     
     url = apiurl(args, "/bundles", {"q":query});
     #url = apiurl(args, "/bundles") + "?q=" + quote_plus(json.dumps(query));
-    r = requests.get(url);
-    r.raise_for_status()
-    rows = r.json()["offers"]
+    from vastai.cache import offers_key
+    rows = cached_get(args, "offers", url, offers_key(query))
+    if args.pareto or args.top is not None or args.weights is not None:
+        from vastai.selection import select
+        try:
+            rows = select(rows, pareto=args.pareto, k=args.top, weights=args.weights)
+        except ValueError as e:
+            print("Error: ", e)
+            return 1
     if args.raw:
-        print(json.dumps(rows, indent=1, sort_keys=True))
+        print(jsonlib.dumps(rows, indent=1, sort_keys=True))
     else:
         #print(url);
         #print("{N} instances types: ".format(N=len(rows)) );
@@ -523,24 +746,33 @@ def search__offers(args):
 
 
 @parser.command(
-    usage="vast show instances [--api-key API_KEY] [--raw]",
+    argument("--watch", metavar="SECONDS", help="keep refreshing the table every SECONDS (default: 5), backing off while nothing changes", 
+             type=float, nargs="?", const=5., default=None),
+    usage="vast show instances [--api-key API_KEY] [--raw] [--watch [SECONDS]]",
 )
 def show__instances(args):
     """ Show list of configured instances.
     Expects `args` to be an object with the following attributes:
     Attrs:
         raw (bool): return raw json output (default: False) 
+        watch (float): if set, redraw the table in place every `watch` seconds until interrupted
         api_key (str): vast.ai api key
         get (func): an attribute accessor function
     Raises:
         `requests.exceptions.HTTPError`: if request fails
     """
     req_url = apiurl(args, "/instances", {"owner": "me"});
-    r = requests.get(req_url);
-    r.raise_for_status()
-    rows = r.json()["instances"]
+    if getattr(args, "watch", None) and not args.raw:
+        from vastai.watch import TableView, watch
+        def fetch():
+            r = session.get(req_url)
+            r.raise_for_status()
+            return r.content
+        watch(fetch, TableView(instance_fields, format_row, justify_row), interval_s=args.watch)
+        return
+    rows = cached_get(args, "instances", req_url)
     if args.raw:
-        print(json.dumps(rows, indent=1, sort_keys=True))
+        print(jsonlib.dumps(rows, indent=1, sort_keys=True))
     else:
         display_table(rows, instance_fields)
         #print("{N} instances: ".format(N=len(rows)) );
@@ -556,7 +788,9 @@ def show__instances(args):
 
 @parser.command(
     argument("-q", "--quiet", action="store_true", help="only display numeric ids"),
-    usage = "vast show machines [OPTIONS]",
+    argument("--format", choices=output_formats, default="table", help="output a table, one json object per line (ndjson), or csv. default: table"),
+    argument("--fields", help="comma-separated fields to output, e.g. 'id,gpu_name,listed_gpu_cost'. default: the table columns (all fields for ndjson)"),
+    usage = "vast show machines [OPTIONS] [--format {table,ndjson,csv}] [--fields FIELDS]",
 )
 def show__machines(args):
     """ Show list of configured machines.
@@ -564,24 +798,21 @@ def show__machines(args):
     Attrs:
         quiet (bool): only display numeric ids (default: False)
         raw (bool): return raw json output (default: False) 
+        format (str): one of `output_formats` (default: 'table')
+        fields (str): comma-separated fields to output (default: `machine_fields`)
         api_key (str): vast.ai api key
         get (func): an attribute accessor function
     Raises:
         `requests.exceptions.HTTPError`: if request fails
     """
     req_url = apiurl(args, "/machines", {"owner": "me"});
-    r = requests.get(req_url);
-    r.raise_for_status()
-    rows = r.json()["machines"]
+    rows = cached_get(args, "machines", req_url)
     if args.raw:
-        print(json.dumps(rows, indent=1, sort_keys=True))
+        print(jsonlib.dumps(rows, indent=1, sort_keys=True))
+    elif args.quiet:
+        sys.stdout.write("".join("{id}\n".format(id=machine["id"]) for machine in rows))
     else:
-        for machine in rows:
-            if args.quiet:
-                print("{id}".format(id=machine["id"]))
-            else:
-                print("{N} machines: ".format(N=len(rows)) );
-                print("{id}: {json}".format(id=machine["id"], json=json.dumps(machine, indent=4, sort_keys=True)))
+        write_rows(rows, machine_fields, getattr(args, "format", "table"), parse_fields(getattr(args, "fields", None)))
 
 
 @parser.command(
@@ -610,11 +841,11 @@ def list__machine(args):
     req_url = apiurl(args, "/machines/create_asks/");
 
     #print("PUT " + req_url);
-    r = requests.put(req_url, json = {'machine':args.id, 'price_gpu':args.price_gpu, 'price_disk':args.price_disk, 'price_inetu':args.price_inetu, 'price_inetd':args.price_inetd } );
+    r = session.put(req_url, json = {'machine':args.id, 'price_gpu':args.price_gpu, 'price_disk':args.price_disk, 'price_inetu':args.price_inetu, 'price_inetd':args.price_inetd } );
     
     if (r.status_code == 200) :
         #print(r.text);
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             price_gpu_   = str(args.price_gpu) if args.price_gpu is not None else "def";
             price_inetu_ = str(args.price_inetu);
@@ -644,11 +875,11 @@ def unlist__machine(args):
     req_url = apiurl(args, "/machines/{machine_id}/asks/".format(machine_id = args.id));
     #req_url = args.url + "/machines/{machine_id}/asks/".format(machine_id = args.id);
     #print(req_url);
-    r = requests.delete(req_url);
+    r = session.delete(req_url);
     
     if (r.status_code == 200) :
         #print(r.text);
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("all offers for machine {machine_id} removed, machine delisted.".format(machine_id = args.id));
         else :
@@ -674,11 +905,11 @@ def remove__defjob(args):
 
     req_url = apiurl(args, "/machines/{machine_id}/defjob/".format(machine_id = args.id));
     #print(req_url);
-    r = requests.delete(req_url);
+    r = session.delete(req_url);
     
     if (r.status_code == 200) :
         #print(r.text);
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("default instance for machine {machine_id} removed.".format(machine_id = args.id));
         else :
@@ -712,13 +943,13 @@ def start__instance(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/instances/{id}/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "state": "running"
     })
     r.raise_for_status()
 
     if (r.status_code == 200) :
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("starting instance {args.id}.".format(**(locals())) );
         else :
@@ -743,13 +974,13 @@ def stop__instance(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/instances/{id}/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "state": "stopped"
     })
     r.raise_for_status()
 
     if (r.status_code == 200) :
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("stopping instance {args.id}.".format(**(locals())) );
         else :
@@ -775,12 +1006,12 @@ def label__instance(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/instances/{id}/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "label": args.label
     })
     r.raise_for_status()
 
-    rj = r.json();
+    rj = jsonlib.loads(r.content);
     if rj["success"]:
         print("label for {args.id} set to {args.label}.".format(**(locals())) );
     else :
@@ -802,12 +1033,12 @@ def destroy__instance(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/instances/{id}/".format(id=args.id))
-    r = requests.delete(url, json={})
+    r = session.delete(url, json={})
     r.raise_for_status()
     
 
     if (r.status_code == 200) :
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("destroying instance {args.id}.".format(**(locals())) );
         else :
@@ -846,13 +1077,13 @@ def set__defjob(args):
     req_url    = apiurl(args, "/machines/create_bids/");
 
     #print("PUT " + req_url);
-    r = requests.put(req_url, json = 
+    r = session.put(req_url, json = 
         {'machine':args.id, 'price_gpu':args.price_gpu, 'price_inetu':args.price_inetu, 'price_inetd':args.price_inetd,
          'image':args.image, 'args':args.args } );
     
     if (r.status_code == 200) :
         #print(r.text);
-        rj = r.json();
+        rj = jsonlib.loads(r.content);
         if (rj["success"]) :
             print("bids created for machine {args.id},  @ ${args.price_gpu}/gpu/day, ${args.price_inetu}/GB up, ${args.price_inetd}/GB down".format(**locals()));
         else :
@@ -938,7 +1169,7 @@ def create__instance(args):
         runtype = 'jupyter'
 
     url = apiurl(args, "/asks/{id}/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "client_id": "me",
         "image": args.image,
         "args":  args.args,
@@ -956,7 +1187,7 @@ def create__instance(args):
         "force": args.force
     })
     print("Create Instance request:", url)
-    print(json.dumps({
+    print(jsonlib.dumps({
         "client_id": "me",
         "image": args.image,
         "args":  args.args,
@@ -975,18 +1206,18 @@ def create__instance(args):
     }))
     r.raise_for_status()
     if args.raw:
-        print(json.dumps(r.json(), indent=1))
+        print(jsonlib.dumps(jsonlib.loads(r.content), indent=1))
     else:
-        print("Started. {}".format(r.json()))
+        print("Started. {}".format(jsonlib.loads(r.content)))
 
 @parser.command(
     argument("id",            help="id of instance type to change bid", type=int),
     argument("--price",       help="per machine bid price in $/hour", type=float),
     usage = "vast change bid id [--price PRICE]",
-    epilog = deindent("""
+    epilog = """
         Change the current bid price of instance id to PRICE.
         If PRICE is not specified, then a winning bid price is used as the default.
-    """),
+    """,
 )
 def change__bid(args):
     """ Change the current bid price of instance id to PRICE.
@@ -1001,21 +1232,21 @@ def change__bid(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/instances/bid_price/{id}/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "client_id": "me",
         "price" : args.price,
     })
     r.raise_for_status()
-    print("Per gpu bid price changed".format(r.json()))
+    print("Per gpu bid price changed".format(jsonlib.loads(r.content)))
 
 
 @parser.command(
     argument("id",            help="id of machine to set min bid price for", type=int),
     argument("--price",       help="per gpu min bid price in $/hour", type=float),
     usage = "vast set min_bid id [--price PRICE]",
-    epilog = deindent("""
+    epilog = """
         Change the current min bid price of machine id to PRICE.
-    """),
+    """,
 )
 def set__min_bid(args):
     """ Change the current min bid price of machine id to PRICE.
@@ -1029,12 +1260,12 @@ def set__min_bid(args):
         `requests.exceptions.HTTPError`: if request fails
     """
     url = apiurl(args, "/machines/{id}/minbid/".format(id=args.id))
-    r = requests.put(url, json={
+    r = session.put(url, json={
         "client_id": "me",
         "price" : args.price,
     })
     r.raise_for_status()
-    print("Per gpu min bid price changed".format(r.json()))
+    print("Per gpu min bid price changed".format(jsonlib.loads(r.content)))
 
 
 
@@ -1089,10 +1320,10 @@ def create__account(args):
     url = apiurl(args, "/users/");
     #msg = 'ssh_key': _load_sshkey(args.ssh_key)
     
-    r = requests.post(url,
+    r = session.post(url,
             json={'username':args.username, 'password':  args.password, } );
     r.raise_for_status()
-    resp = r.json()
+    resp = jsonlib.loads(r.content)
     print("You are user {}! Your new api key: {}".format(resp["id"], resp["api_key"]))
     args.api_key = resp["api_key"]
     set_api_key(args)
@@ -1129,18 +1360,89 @@ def login(args):
     url = apiurl(args, "/users/current/");
     print(url)
     
-    r = requests.put(url,
+    r = session.put(url,
             json={'username': args.username, 'password': args.password} );
     r.raise_for_status()
-    resp = r.json()
+    resp = jsonlib.loads(r.content)
     print("You are user {}! Your existing api key: {}".format(resp["id"], resp["api_key"]))
     args.api_key = resp["api_key"]
     set__api_key(args)
 
-def main():
+@parser.command(
+    argument("--socket", help="unix socket to listen on. (default: $VAST_DAEMON_SOCKET or ~/.vast_daemon.sock)", type=str, default=None),
+    argument("--idle-timeout", help="exit after this many seconds without a command", type=float, default=None),
+    usage = "vast start daemon [--socket SOCKET] [--idle-timeout SECONDS]",
+    help = "start a background process which runs later vast commands, keeping connections warm",
+)
+def start__daemon(args):
+    """ Starts a background daemon. While it's running, vast.py forwards commands to it instead of
+        running them itself, skipping interpreter start, imports and connection setup.
+    Expects `args` to be an object with the following attributes:
+    Attrs:
+        socket (str): unix socket to listen on
+        idle_timeout (float): seconds without a command after which the daemon exits
+    """
+    from vastai import daemon
+    status = daemon.start(args.socket, args.idle_timeout)
+    print("vast daemon running with pid {pid} on {socket}.".format(**status))
+
+@parser.command(
+    argument("--socket", help="daemon socket. (default: $VAST_DAEMON_SOCKET or ~/.vast_daemon.sock)", type=str, default=None),
+    usage = "vast stop daemon [--socket SOCKET]",
+    help = "stop the background daemon started by `vast start daemon`",
+)
+def stop__daemon(args):
+    """ Stops the daemon started by `start daemon`, once running commands finish.
+    Expects `args` to be an object with the following attributes:
+    Attrs:
+        socket (str): daemon socket
+    """
+    from vastai import daemon
+    status = daemon.control("stop", args.socket)
+    if status is None:
+        print("vast daemon isn't running.")
+    else:
+        print("Stopping vast daemon with pid {pid} after {commands} commands.".format(**status))
+
+@parser.command(
+    argument("--socket", help="daemon socket. (default: $VAST_DAEMON_SOCKET or ~/.vast_daemon.sock)", type=str, default=None),
+    usage = "vast show daemon [--socket SOCKET] [--raw]",
+    help = "show whether the background daemon is running",
+)
+def show__daemon(args):
+    """ Shows the status of the daemon started by `start daemon`.
+    Expects `args` to be an object with the following attributes:
+    Attrs:
+        socket (str): daemon socket
+        raw (bool): return raw json output (default: False)
+    """
+    from vastai import daemon
+    status = daemon.control("status", args.socket)
+    if args.raw:
+        print(jsonlib.dumps(status, indent=1, sort_keys=True))
+    elif status is None:
+        print("vast daemon isn't running.")
+    else:
+        print("vast daemon running with pid {pid} on {socket}: up {uptime_s:.0f}s, "
+              "{commands} commands run, {active} running.".format(**status))
+
+def add_global_arguments():
+    """ Adds the options shared by every command. Only adds them once, so it's safe to call repeatedly.
+    """
+    if parser.added_global_arguments:
+        return
+    parser.added_global_arguments = True
     parser.add_argument("--url", help="server REST api url", default=server_url_default)
     parser.add_argument("--raw", action="store_true", help="output machine-readable json");
     parser.add_argument("--api-key",     help="api key. defaults to using the one stored in {}".format(api_key_file_base), type=str, required=False, default=api_key_guard)
+    parser.add_argument("--profile", action="store_true", help="print a timing breakdown of imports, argument parsing, each http request, json decoding and output to stderr")
+    parser.add_argument("--profile-cprofile", metavar="FILE", help="with --profile, also write cProfile stats of the command to FILE")
+    parser.add_argument("--profile-stacks", metavar="FILE", help="with --profile, also write sampled stacks of the command to FILE, in the collapsed format used by flame graph tools")
+    parser.add_argument("--cached", action="store_true", help="show instances, offers and machines from the local state cache if they're in it, instead of requesting them (see `vastai.cache`)")
+    parser.add_argument("--max-age", metavar="SECONDS", type=float, help="like --cached, but only use cached data younger than SECONDS")
+    parser.add_argument("--no-daemon", action="store_true", help="run the command in this process, even if a daemon is running (see `vast start daemon`)")
+
+def main():
 
     #func_dict = {
     #    "set defjob":               set_defjob,
@@ -1211,24 +1513,52 @@ def main():
 
     #parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter);
 
-    args = parser.parse_args()
+    sys.exit(run())
+
+def run(argv=None):
+    """ Parses `argv` and runs the command. Used by `main`, and by `vastai.daemon` to run forwarded commands.
+    Args:
+        argv (list of str, optional): Command line arguments. (default: `sys.argv[1:]`)
+    Raises:
+        SystemExit: if the arguments can't be parsed, or after printing help.
+    Returns:
+        int: exit status
+    """
+    add_global_arguments()
+    main_started = time.perf_counter()
+    args = parser.parse_args(argv)
     if args.api_key is api_key_guard:
         if os.path.exists(api_key_file):
             with open(api_key_file, "r") as reader:
                 args.api_key = reader.read().strip()
         else:
             args.api_key = None
+    parsed = time.perf_counter()
+    profiler = None
+    if args.profile or args.profile_cprofile or args.profile_stacks:
+        from vastai.profiling import CliProfiler
+        profiler = CliProfiler(base_url=args.url, cprofile_path=args.profile_cprofile, stacks_path=args.profile_stacks)
+        profiler.add_phase("imports", _imports_done - _import_started)
+        profiler.add_phase("parser setup", main_started - _imports_done)
+        profiler.add_phase("argument parsing", parsed - main_started)
+        profiler.add_phase("profiler setup", time.perf_counter() - parsed)
+        profiler.start()
     try:
-        sys.exit(args.func(args) or 0)
+        return args.func(args) or 0
     except requests.exceptions.HTTPError as e :
         try:
-            errmsg = e.response.json().get("msg");
+            errmsg = jsonlib.loads(e.response.content).get("msg");
         except JSONDecodeError:
             if e.response.status_code == 401:
                 errmsg = "Please log in or sign up"
             else:
                 errmsg = "(no detail message supplied)"
         print("failed with error {e.response.status_code}: {errmsg}".format(**locals()));            
+        return 0
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.report()
     #else:
     #    if cmd0 != "--help" : print("Unrecognized command '" + command_type.strip() + "'. Use vast --help for list of commands.")
     #    parser = argparse.ArgumentParser(
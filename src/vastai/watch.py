@@ -0,0 +1,210 @@
+""" Live-updating terminal tables, used by `vast show instances --watch`.
+
+`TableView` keeps the last rendered table and, on each update, only rewrites the
+terminal lines which changed. Cells are only re-formatted for rows whose data
+changed, and `watch` skips decoding entirely when a poll returns the same response
+body as the previous one, so a refresh of an unchanged fleet costs one request.
+Fields which change on every response, `vastai.api.volatile_fields`, are ignored
+when telling whether anything changed.
+"""
+import shutil
+import sys
+import time
+
+from vastai import jsonlib
+from vastai.api import _stable_body, volatile_fields
+
+bold_yellow = "\x1b[1;33m"
+green = "\x1b[32m"
+red = "\x1b[31m"
+reset = "\x1b[0m"
+
+class TableView:
+    """ Renders successive snapshots of a table, rewriting only changed lines.
+        Changes to the `highlight` fields are colored for `highlight_s` seconds:
+        text fields in bold yellow, numeric fields green when they go up and red when they go down.
+    """
+    def __init__(self, fields, format_row=None, justify_row=None, out=None, ansi=None, key="id",
+                 highlight=("actual_status", "gpu_util"), highlight_s=10, max_lines=None, clock=time.time,
+                 volatile=volatile_fields):
+        """
+        Args:
+            fields (tuple of tuples): e.g. `vastai.vast.instance_fields`.
+            format_row, justify_row (callable, optional): Cell formatting functions. (default: the
+                ones in `vastai.vast`)
+            out (file, optional): Where to draw the table. (default: `sys.stdout`)
+            ansi (bool, optional): Redraw in place with ANSI escape codes. If False, prints the whole
+                table whenever it changes. (default: whether `out` is a terminal)
+            key (str): Field identifying rows. (default: 'id')
+            highlight (tuple of str): Fields whose changes are highlighted.
+            highlight_s (float): Seconds to keep a change highlighted. (default: 10)
+            max_lines (int, optional): Rows to show. (default: fit the terminal)
+            volatile (tuple of str): Fields which change on every update, and don't on their own make
+                a row's cells be re-formatted. (default: `vastai.api.volatile_fields`)
+        """
+        if format_row is None or justify_row is None:
+            from vastai.vast import format_row, justify_row
+        self.fields = fields
+        self.format_row, self.justify_row = format_row, justify_row
+        self.out = out or sys.stdout
+        self.ansi = self.out.isatty() if ansi is None else ansi
+        self.key = key
+        self.highlight = {i: field[0] for i, field in enumerate(fields) if field[0] in highlight}
+        self.highlight_s = highlight_s
+        self.max_lines = max_lines
+        self.clock = clock
+        self.volatile = frozenset(volatile)
+        self.header = [name for _, name, _, _, _ in fields]
+        self.rows = {}
+        """ `{key: (row data, cells)}` for the last update """
+        self.highlights = {}
+        """ `{(key, column index): (color, expiry time)}` """
+        self.lines = []
+        self.status = None
+        self.lines_written = 0
+        """ Terminal lines written by the last update """
+
+    def _same(self, old, new):
+        """ Whether two rows are equal, apart from their volatile fields. """
+        if old == new:
+            return True
+        if not self.volatile or len(old) != len(new):
+            return False
+        return all(k in self.volatile or (k in old and old[k] == v) for k, v in new.items())
+
+    def _changes(self, old, new):
+        """ Yields `(column index, color)` for highlighted fields which differ between two rows. """
+        for i, field in self.highlight.items():
+            before, after = old.get(field), new.get(field)
+            if before == after:
+                continue
+            if isinstance(before, (int, float)) and isinstance(after, (int, float)):
+                yield i, green if after > before else red
+            else:
+                yield i, bold_yellow
+
+    def update(self, rows, status=None):
+        """ Draws `rows`, rewriting only the lines which changed since the last update.
+        Args:
+            rows (list of dict): Table rows, e.g. instances from `/instances`.
+            status (str, optional): Line shown below the table.
+        Returns:
+            int: number of lines written
+        """
+        now = self.clock()
+        cells = {}
+        for row in rows:
+            key = row.get(self.key)
+            previous = self.rows.get(key)
+            if previous is not None and self._same(previous[0], row):
+                cells[key] = previous[1]
+                continue
+            cells[key] = self.format_row(row, self.fields)
+            if previous is not None:
+                for i, color in self._changes(previous[0], row):
+                    self.highlights[(key, i)] = (color, now + self.highlight_s)
+        self.rows = {row.get(self.key): (row, cells[row.get(self.key)]) for row in rows}
+        self.highlights = {k: v for k, v in self.highlights.items() if v[1] > now and k[0] in cells}
+        keys = sorted(cells, key=lambda k: (k is None, k))
+        max_lines = self.max_lines
+        if max_lines is None and self.ansi:
+            max_lines = max(1, shutil.get_terminal_size().lines - 3)
+        if max_lines is not None and len(keys) > max_lines:
+            status = "%s (showing %i of %i)"%(status or "", max_lines, len(keys))
+            keys = keys[:max_lines]
+        lengths = [len(name) for name in self.header]
+        for key in keys:
+            lengths = [max(l, len(c)) for l, c in zip(lengths, cells[key])]
+        lines = [self.justify_row(self.header, lengths, self.fields)]
+        for key in keys:
+            line = self.justify_row(cells[key], lengths, self.fields)
+            if self.ansi:
+                line = self._colorize(key, cells[key], lengths, line)
+            lines.append(line)
+        return self._draw(lines, status)
+
+    def _colorize(self, key, cells, lengths, line):
+        colors = {i: color for (k, i), (color, _) in self.highlights.items() if k == key}
+        if not colors:
+            return line
+        parts = []
+        for i, (cell, length, field) in enumerate(zip(cells, lengths, self.fields)):
+            text = cell.ljust(length) if field[4] else cell.rjust(length)
+            color = colors.get(i)
+            parts.append(color + text + reset if color else text)
+        return "  ".join(parts)
+
+    def _draw(self, lines, status):
+        written = 0
+        if not self.ansi:
+            if lines != self.lines:
+                self.out.write("\n".join(lines + ([status] if status else [])) + "\n\n")
+                written = len(lines) + bool(status)
+        elif len(lines) != len(self.lines) or lines[0] != self.lines[0]:
+            # Rows were added or removed, or columns changed width: redraw everything.
+            self.out.write("\x1b[H\x1b[2J" + "\n".join(lines) + "\n")
+            written = len(lines)
+            self.status = None
+        else:
+            for i, (old, new) in enumerate(zip(self.lines, lines)):
+                if old != new:
+                    self.out.write("\x1b[%i;1H%s\x1b[K"%(i+1, new))
+                    written += 1
+        if self.ansi and status != self.status:
+            self.out.write("\x1b[%i;1H\x1b[K%s"%(len(lines)+2, status or ""))
+            written += 1
+        self.lines, self.status = lines, status
+        self.out.flush()
+        self.lines_written = written
+        return written
+
+def watch(fetch, view, interval_s=5., max_interval_s=None, iterations=None, sleep=time.sleep):
+    """ Polls `fetch` and draws the results in `view` until interrupted.
+        While nothing changes the poll interval backs off, up to `max_interval_s`.
+        It goes back to `interval_s` as soon as something changes.
+    Args:
+        fetch (callable): Returns the raw `/instances` response body, as bytes.
+        view (TableView): Where to draw the instances.
+        interval_s (float): Seconds between polls. (default: 5)
+        max_interval_s (float, optional): Longest interval to back off to. (default: 6 x `interval_s`)
+        iterations (int, optional): Stop after this many polls. (default: poll forever)
+    Raises:
+        requests.exceptions.HTTPError: if the api key is rejected. Other request errors and
+            responses which aren't valid JSON are shown in the status line and retried.
+    """
+    max_interval_s = max_interval_s or 6*interval_s
+    delay = interval_s
+    body, rows, error = None, [], None
+    polls = 0
+    if view.ansi:
+        view.out.write("\x1b[?25l") # Hide the cursor while drawing.
+    try:
+        while iterations is None or polls < iterations:
+            polls += 1
+            changed = False
+            try:
+                latest = fetch()
+                stable = _stable_body(latest)
+                if stable != body:
+                    # e.g. an html error page from a proxy raises ValueError, and is retried like other errors.
+                    rows, body, changed = jsonlib.loads(latest)["instances"], stable, True
+                error = None
+            except OSError as err:
+                response = getattr(err, "response", None)
+                if response is not None and response.status_code in (401, 403):
+                    raise
+                error = err
+            except (ValueError, KeyError, TypeError) as err:
+                error = ValueError("invalid response (%s)"%err)
+            delay = interval_s if changed else min(max_interval_s, delay*1.5)
+            status = "%i instances, $%.3f/hr. Updated %s, next in %.0fs. Ctrl-C to quit."%(
+                     len(rows), sum(row.get("dph_total") or 0 for row in rows), time.strftime("%H:%M:%S"), delay)
+            if error is not None:
+                status = "Request failed: %s. Retrying in %.0fs."%(error, delay)
+            view.update(rows, status)
+            if iterations is None or polls < iterations:
+                sleep(delay)
+    finally:
+        if view.ansi:
+            view.out.write("\x1b[%i;1H\x1b[?25h\n"%(len(view.lines)+2))
+            view.out.flush()
@@ -0,0 +1,41 @@
+from vastai.api import VastClient
+from vastai.bids import BidManager, BidStrategy
+from vastai.testing import LocalVastServer
+import pytest
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=50) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def test_strategy():
+    strategy = BidStrategy(margin=.02, max_price=1., hysteresis=.01)
+    assert strategy.new_bid(.5, None) == .52
+    assert strategy.new_bid(.5, .515) is None, "Small moves should be ignored."
+    assert strategy.new_bid(.5, .499) == .52, "Bids below min_bid should always be raised."
+    assert strategy.new_bid(.4, .52) == .42
+    assert BidStrategy(margin=.02, lower=False).new_bid(.4, .52) is None
+    assert strategy.new_bid(1.5, .52) == 1., "Bids should be capped."
+
+def test_rebids_on_market_moves(server, client, capsys):
+    ids = server.add_instances(4, is_bid=True, min_bid=.3, dph_base=.32)
+    server.add_instances(2, min_bid=.3, dph_base=.5)
+    manager = BidManager(client, BidStrategy(margin=.02, hysteresis=.015, max_price=.6))
+    assert manager.check() == [] and sorted(manager.bids) == ids
+    for inst_id, min_bid in zip(ids, (.4, .31, .7)):
+        server.instances[inst_id]["min_bid"] = min_bid
+    changed = manager.check()
+    assert sorted((inst.id, new) for inst, _, new in changed) == [(ids[0], .42), (ids[2], .6)]
+    assert server.requests["PUT /instances/bid_price/{id}/"] == 2 and server.requests["GET /instances"] == 2
+    assert server.instances[ids[0]]["dph_base"] == .42 and manager.capped == {ids[2]}
+    assert len(manager.reaction_times) == 2 and max(manager.reaction_times) < 5
+    assert manager.check() == [], "Accepted bids shouldn't be changed again."
+    manager.close()
+    assert client.refresh_listeners == []
@@ -0,0 +1,93 @@
+from vastai import cache as vast_cache
+from vastai.api import VastClient
+from vastai.cache import StateCache
+from vastai.testing import LocalVastServer
+from vastai import vast
+import json
+import os
+import pytest
+import time
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=30) as server:
+        server.add_instances(4)
+        yield server
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = str(tmp_path/"state.sqlite")
+    monkeypatch.setattr(vast_cache, "default_cache_path", path)
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    return path
+
+def test_store_and_query(cache_path):
+    cache = StateCache()
+    rows = [dict(id=i, machine_id=100+i, actual_status="running", gpu_name="RTX 3090", dph_total=.1*i)
+            for i in range(5)]
+    cache.store("instances", rows, fetched_at=time.time() - 60)
+    assert cache.load("instances")[0] == rows
+    assert cache.load("instances", max_age_s=30) is None
+    assert cache.load("offers") is None
+    cache.store("instances", rows[:2])
+    assert cache.sql("select id, status from instances order by id") == \
+        [dict(id=0, status="running"), dict(id=1, status="running")], "Instances should be a snapshot."
+    cache.store("offers", [dict(id=1, gpu_name="A100", dph_total=1.)], key="a")
+    cache.store("offers", [dict(id=2, gpu_name="A100", dph_total=2.)], key="b")
+    assert cache.df("select gpu_name, count(*) as n from offers group by gpu_name").n.tolist() == [2]
+    cache.close()
+
+def test_client_warm_start(server, cache_path, monkeypatch):
+    client = VastClient(api_key_file=None, api_url=server.url, cache=True)
+    client.api_key = server.api_key
+    assert len(client.instances) == 0
+    client.get_instances()
+    offers = client.search_offers(query="num_gpus>=2")
+    assert server.requests["GET /instances"] == 1 and server.requests["GET /bundles"] == 1
+
+    other = VastClient(api_key_file=None, api_url=server.url, cache=cache_path)
+    assert len(other.instances) == 0, "Another account's instances shouldn't be loaded."
+    monkeypatch.setenv('VAST_API_KEY', server.api_key)
+    warm = VastClient(api_key_file=None, api_url=server.url, cache=cache_path)
+    assert sorted(inst.id for inst in warm.instances) == sorted(inst.id for inst in client.instances)
+    assert len(warm.get_instances(max_age_s=60)) == 4
+    assert len(warm.search_offers(query="num_gpus>=2", max_age_s=60)) == len(offers)
+    assert server.requests["GET /instances"] == 1 and server.requests["GET /bundles"] == 1
+    warm.get_instances()
+    assert server.requests["GET /instances"] == 2
+
+def test_cli_cached(server, cache_path, capsys):
+    args = ["--url", server.url, "--api-key", server.api_key, "--raw"]
+    assert vast.run(["show", "instances"] + args) == 0
+    capsys.readouterr()
+    assert not os.path.exists(cache_path), "Without the options, only an existing cache should be used."
+    assert vast.run(["show", "instances", "--max-age", "60"] + args) == 0
+    first = json.loads(capsys.readouterr().out)
+    assert vast.run(["show", "instances", "--max-age", "60"] + args) == 0
+    assert json.loads(capsys.readouterr().out) == first
+    assert server.requests["GET /instances"] == 2
+    assert vast.run(["show", "instances"] + args) == 0
+    assert server.requests["GET /instances"] == 3 and len(StateCache().sql("select id from instances")) == 4
+    assert vast.run(["search", "offers", "num_gpus=1", "--cached"] + args) == 0
+    assert vast.run(["search", "offers", "num_gpus=1", "--cached"] + args) == 0
+    assert server.requests["GET /bundles"] == 1, "Each query should only be requested once."
+    assert vast.run(["search", "offers", "num_gpus=2", "--cached"] + args) == 0
+    assert server.requests["GET /bundles"] == 2
+    assert vast.run(["search", "offers", "num_gpus=2", "--cached", "--url", server.url, "--api-key", "other", "--raw"]) == 0
+    assert server.requests["GET /bundles"] == 3, "Responses should be cached per api key."
+    assert vast.run(["show", "instances", "--max-age", "60", "--url", server.url.replace("127.0.0.1", "localhost"), "--api-key", server.api_key]) == 0
+    assert server.requests["GET /instances"] == 4, "Responses should be cached per api url."
+
+def test_cache_file_mode(cache_path):
+    StateCache().close()
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
+
+def test_prune(cache_path):
+    cache = StateCache(retention_s=3600)
+    cache.store("offers", [dict(id=1, gpu_name="A100", dph_total=1.)], key="old", fetched_at=time.time() - 7200)
+    cache.store("instances", [dict(id=1, actual_status="exited")], fetched_at=time.time() - 7200)
+    cache.store("offers", [dict(id=2, gpu_name="A100", dph_total=2.)], key="new")
+    assert cache.load("offers", "old") is None and cache.load("offers", "new") is not None
+    assert [row["id"] for row in cache.sql("select id from offers")] == [2]
+    assert cache.load("instances") is not None, "The latest snapshot should be kept."
+    cache.close()
@@ -0,0 +1,62 @@
+from vastai.api import InstanceList, VastClient
+from vastai.costs import FleetCosts
+from vastai.testing import LocalVastServer
+import pytest
+
+now = 1.6e9
+
+def instance(id, status="running", label=None, gpu_name="RTX 3090", hours=10, **fields):
+    inst = dict(id=id, actual_status=status, label=label, gpu_name=gpu_name, machine_id=100+id,
+                dph_base=1., storage_total_cost=.1, dph_total=1.1, inet_up_cost=.02, inet_down_cost=.01,
+                inet_up_billed=50., inet_down_billed=100., start_date=now - hours*3600, end_date=now + 30*3600)
+    inst.update(fields)
+    return inst
+
+@pytest.fixture
+def costs():
+    return FleetCosts([instance(1, label="train"), instance(2, label="train", gpu_name="A100", dph_base=3.),
+                       instance(3, status="exited", label="eval"), instance(4, end_date=now + 2*3600)], now=now)
+
+def test_accrued_and_burn_rate(costs):
+    assert costs.accrued().tolist() == pytest.approx([13., 33., 3., 13.]), \
+        "Instances which aren't running shouldn't accrue compute."
+    assert costs.burn_rate().tolist() == pytest.approx([1.1, 3.1, .1, 1.1])
+    assert costs.projected(24).tolist() == pytest.approx([13 + 1.1*24, 33 + 3.1*24, 3 + .1*24, 13 + 1.1*2]), \
+        "Projections should stop at the end of the contract."
+    total = costs.total(hours=24)
+    assert total["instances"] == 4 and total["running"] == 3 and total["burn_rate"] == pytest.approx(5.4)
+
+def test_plans(costs):
+    plan = {1: "stop", 3: "start", 4: "destroy"}
+    assert costs.burn_rate(plan).tolist() == pytest.approx([.1, 3.1, 1.1, 0.])
+    assert costs.burn_rate().tolist() == pytest.approx([1.1, 3.1, .1, 1.1]), "Plans shouldn't change the fleet."
+    assert costs.total(plan=plan)["running"] == 2
+    with pytest.raises(ValueError):
+        costs.burn_rate({1: "pause"})
+    with pytest.raises(KeyError):
+        costs.burn_rate({99: "stop"})
+
+def test_groups(costs):
+    by_label = costs.by("label", hours=0)
+    assert by_label.loc["train"].tolist() == pytest.approx([2, 2, 46., 4.2, 46.])
+    assert list(by_label.index) == ["train", "", "eval"]
+    assert costs.by("gpu").loc["A100", "burn_rate"] == pytest.approx(3.1)
+    with pytest.raises(ValueError):
+        costs.by("region")
+
+def test_missing_fields():
+    costs = FleetCosts([dict(id=1, actual_status="running", dph_total=.5)], now=now)
+    assert costs.burn_rate().tolist() == [.5] and costs.accrued().tolist() == [0.]
+    assert costs.projected(10).tolist() == [5.]
+    assert len(FleetCosts([])) == 0 and FleetCosts([]).total()["projected"] == 0
+
+def test_instance_list_costs(monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    with LocalVastServer(num_offers=20) as server:
+        server.add_instances(10)
+        client = VastClient(api_key_file=None, api_url=server.url)
+        client.api_key = server.api_key
+        instances = client.get_instances()
+    assert isinstance(instances, InstanceList)
+    costs = instances.costs()
+    assert costs.total()["burn_rate"] == pytest.approx(sum(inst.dph_total for inst in instances))
@@ -0,0 +1,65 @@
+from vastai import daemon
+from vastai.testing import LocalVastServer
+import io
+import os
+import pytest
+import threading
+import time
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=20) as server:
+        server.add_instances(5)
+        yield server
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    monkeypatch.delenv("VAST_NO_DAEMON", raising=False)
+    path = str(tmp_path/"vast.sock")
+    status = daemon.start(path, idle_timeout_s=60)
+    yield path
+    assert daemon.control("stop", path)["pid"] == status["pid"]
+    deadline = time.time() + 5
+    while os.path.exists(path) and time.time() < deadline:
+        time.sleep(.05)
+    assert not os.path.exists(path), "The daemon should remove its socket when it exits."
+
+def forward(argv, socket_path):
+    out, err = io.StringIO(), io.StringIO()
+    status = daemon.forward(argv, socket_path, stdout=out, stderr=err)
+    return status, out.getvalue(), err.getvalue()
+
+def test_forwarded_commands(server, socket_path):
+    args = ["--url", server.url, "--api-key", server.api_key]
+    status, out, err = forward(["show", "instances", "--raw"] + args, socket_path)
+    assert status == 0 and out.count('"actual_status"') == 5
+    status, out, err = forward(["show", "instances", "--no-such-option"] + args, socket_path)
+    assert status == 2 and "unrecognized arguments" in err
+    assert server.requests["GET /instances"] == 1
+    assert daemon.control("status", socket_path)["commands"] == 2
+
+def test_concurrent_output_is_kept_apart(server, socket_path):
+    results = {}
+    def run(query):
+        results[query] = forward(["search", "offers", query, "--raw", "--url", server.url,
+                                  "--api-key", server.api_key], socket_path)
+    threads = [threading.Thread(target=run, args=("num_gpus=%i"%n,)) for n in (1, 2, 4, 8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    for query, (status, out, err) in results.items():
+        num_gpus = int(query.split("=")[1])
+        assert status == 0 and out.count('"num_gpus": %i,'%num_gpus) == out.count('"num_gpus"')
+
+def test_client_cwd_and_environment(server, socket_path, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("VAST_CACHE", "relative.sqlite")
+    status, out, err = forward(["show", "instances", "--max-age", "60", "--url", server.url,
+                                "--api-key", server.api_key], socket_path)
+    assert status == 0, err
+    assert os.path.exists(str(tmp_path/"relative.sqlite")), "The cache should follow the client's env and cwd."
+
+def test_local_fallback(tmp_path):
+    assert daemon.forward(["show", "instances"], str(tmp_path/"missing.sock")) is None
+    assert daemon.forward(["login"], str(tmp_path/"missing.sock")) is None
+    assert daemon.control("status", str(tmp_path/"missing.sock")) is None
+    assert daemon._absolute_paths(["create", "instance", "1", "--onstart", "run.sh"])[-1].endswith("/run.sh")
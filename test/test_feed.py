@@ -0,0 +1,41 @@
+from vastai.api import VastClient
+from vastai.feed import OfferFeed
+from vastai.testing import LocalVastServer, generate_offers
+import pytest
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=40) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def test_offer_deltas(server, client):
+    feed = OfferFeed(client, query="num_gpus>=1")
+    deltas = []
+    feed.subscribe(deltas.append)
+    first = feed.poll()
+    assert len(first.added) == 40 and not first.removed and not first.changed
+    same = feed.poll()
+    assert same.added == same.removed == same.changed == [] and len(deltas) == 1, \
+        "Unchanged results should give empty deltas, which aren't sent to subscribers."
+    moved, gone = server.offers[0], server.offers.pop(1)
+    moved["dph_total"] += .1
+    server.offers[2]["reliability2"] = .5 # Not one of `feed.fields`.
+    server.offers.extend(generate_offers(1, start_id=1000))
+    delta = feed.poll()
+    assert [o["id"] for o in delta.added] == [1000] and [o["id"] for o in delta.removed] == [gone["id"]]
+    assert [(old["id"], new["dph_total"] - old["dph_total"]) for old, new in delta.changed] == \
+        [(moved["id"], pytest.approx(.1))]
+    assert len(deltas) == 2 and server.requests["GET /bundles"] == 3
+
+def test_stream(server, client):
+    feed = OfferFeed(client, query="num_gpus>=1", interval_s=0)
+    sleeps = []
+    deltas = list(feed.stream(iterations=3, sleep=sleeps.append))
+    assert len(deltas) == 1 and len(deltas[0].added) == 40 and sleeps == [0, 0]
@@ -0,0 +1,117 @@
+from vastai.api import VastClient, InstanceList
+from vastai import guard as guard_module
+from vastai.costs import FleetCosts
+from vastai.guard import BudgetGuard, Budget, IdleRule
+from vastai.telemetry import TelemetryStore
+from vastai.testing import LocalVastServer
+import numpy as np
+import pytest
+import time
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=50, stop_s=0, start_s=0) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+    def __call__(self):
+        return self.now
+
+def test_refresh_instances(server, client):
+    ids = server.add_instances(3)
+    diff = client.refresh_instances()
+    assert sorted(inst.id for inst in diff.added) == ids and not diff.removed and not diff.changed
+    decoded = []
+    client._json = lambda resp, _json=client._json: decoded.append(resp) or _json(resp)
+    diff = client.refresh_instances()
+    assert not diff.added and not diff.changed, "Fields which change on every request should be ignored."
+    assert not decoded, "A response where only `duration` changed shouldn't be decoded."
+    server.instances[ids[0]]["gpu_util"] = 80.
+    del server.instances[ids[1]]
+    diff = client.refresh_instances()
+    assert diff.changed == {ids[0]: {"gpu_util": (0., 80.)}} and [inst.id for inst in diff.removed] == [ids[1]]
+    assert client.instances[0].gpu_util == 80. and len(client.instances) == 2
+
+def test_idle_rule(server, client):
+    ids = server.add_instances(4, label="train")
+    server.instances[ids[0]]["gpu_util"] = 90.
+    clock = Clock()
+    guard = BudgetGuard(client, idle_rules=[IdleRule(max_gpu_util=5, minutes=30)], clock=clock)
+    assert guard.check() == [] and len(guard.idle_since) == 3
+    server.instances[ids[1]]["gpu_util"] = 50.
+    clock.now += 31*60
+    acted = guard.check()
+    assert sorted(inst.id for inst, action, _ in acted) == ids[2:]
+    assert server.requests["GET /instances"] == 2 and server.requests["PUT /instances/{id}/"] == 2
+    clock.now += 60
+    assert guard.check() == [], "Instances being stopped shouldn't be stopped again."
+    assert {inst["intended_status"] for inst in server.instances.values()} == {"running", "stopped"}
+
+def test_budgets(server, client):
+    hours_ago = time.time() - 10*3600
+    train = server.add_instances(3, label="train", start_date=hours_ago)
+    server.add_instances(2, label="eval", start_date=hours_ago)
+    client.get_instances()
+    costs = client.instances.costs()
+    train_rates = sorted(((inst.dph_total, inst.id) for inst in client.instances if inst.label == "train"), reverse=True)
+    limit = sum(rate for rate, _ in train_rates) - train_rates[0][0]/2
+    guard = BudgetGuard(client, budgets=[Budget(limit, label="train", per_hour=True)], dry_run=True)
+    assert [inst.id for inst, _, _ in guard.check()] == [train_rates[0][1]], \
+        "Only the most expensive instance should need stopping."
+    guard = BudgetGuard(client, budgets=[Budget(costs.total()["accrued"]/2, action="destroy"),
+                                         Budget(1e-6, label="train", per_hour=True)])
+    acted = guard.check()
+    assert len(acted) == 5 and {action for _, action, _ in acted} == {"destroy"}
+    assert not server.instances and guard.totals["instances"] == 5
+    with pytest.raises(ValueError):
+        Budget(10, action="pause")
+
+def test_budget_uses_one_snapshot(server, client, monkeypatch):
+    hours_ago = time.time() - 10*3600
+    server.add_instances(4, label="train", start_date=hours_ago)
+    client.get_instances()
+    top = max(client.instances, key=lambda inst: inst.dph_total)
+    limit = sum(inst.dph_total for inst in client.instances) - top.dph_total/2
+
+    def costs_then_refresh(instances, now):
+        # A refresh from another thread lands between the cost and action steps.
+        costs = FleetCosts(instances, now)
+        client.instances = InstanceList(reversed(list(client.instances)))
+        return costs
+    monkeypatch.setattr(guard_module, "FleetCosts", costs_then_refresh)
+    guard = BudgetGuard(client, budgets=[Budget(limit, per_hour=True)], dry_run=True)
+    assert [inst.id for inst, _, _ in guard.check()] == [top.id]
+
+def test_idle_rule_telemetry_and_process(server, client):
+    ids = server.add_instances(4)
+    server.instances[ids[3]]["gpu_util"] = 90.
+    clock = Clock()
+    store = TelemetryStore(raw_capacity=100, bucket_s=60)
+    for t in range(0, 40*60, 30):
+        for inst_id in ids:
+            # ids[0] had a GPU spike the api snapshot missed, ids[3] reports busy but is idle.
+            gpu = 80. if inst_id == ids[0] and t == 20*60 else 1.
+            store.add(inst_id, clock.now - 40*60 + t, np.array([gpu, 0, 40, 2, 10, 10]))
+    probed = []
+    def process_check(inst, pattern):
+        probed.append((inst.id, pattern))
+        return inst.id == ids[1]
+    rule = IdleRule(max_gpu_util=5, max_cpu_util=5, minutes=30, process="train.py")
+    guard = BudgetGuard(client, idle_rules=[rule], telemetry=store, process_check=process_check, clock=clock)
+    acted = guard.check()
+    assert sorted(inst.id for inst, _, _ in acted) == [ids[2], ids[3]]
+    assert sorted(probed) == [(i, "train.py") for i in ids[1:]], "Only otherwise idle instances should be probed."
+    assert server.requests["GET /instances"] == 1
+    del probed[:]
+    clock.now += 60
+    assert guard.check() == [] and probed == [], "A live process should count as activity for the rule's window."
+    assert guard.active_at == {ids[1]: clock.now - 60}
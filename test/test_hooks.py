@@ -0,0 +1,109 @@
+from vastai.api import VastClient
+from vastai.hooks import HookRegistry, HistogramCollector, CallEvent, endpoint_name
+from vastai.testing import LocalVastServer
+import pytest
+import sys
+import threading
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=100, pull_s=0, start_s=0, stop_s=0) as server:
+        server.add_instances(3)
+        yield server
+
+@pytest.fixture
+def registry():
+    return HookRegistry()
+
+@pytest.fixture
+def client(server, registry, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url, hooks=registry)
+    client.api_key = server.api_key
+    return client
+
+def test_endpoint_name():
+    base = "https://vast.ai/api/v0"
+    assert endpoint_name(base + "/instances/123/?api_key=x", base) == "/instances/{id}/"
+    assert endpoint_name(base + "/instances/bid_price/42/", base) == "/instances/bid_price/{id}/"
+    assert endpoint_name(base + "/bundles?q=%7B%7D", base) == "/bundles"
+
+def test_disabled_registry_is_inert(registry):
+    assert not registry
+    with registry.span('ssh', 'run_command', instance_id=1) as event:
+        event.status = 0
+    events = []
+    registry.register(events.append)
+    assert registry
+    registry.unregister(events.append)
+    with registry.span('ssh', 'run_command'):
+        pass
+    assert events == [] and not registry
+
+def test_http_events(client, registry):
+    events = []
+    registry.register(events.append)
+    collector = registry.register(HistogramCollector())
+    instances = client.get_instances()
+    instances[0].stop()
+    client.search_offers(query="num_gpus=1")
+    http = [e for e in events if e.kind == 'http']
+    assert [(e.name, e.method, e.status) for e in http] == [
+        ("/instances", "GET", 200), ("/instances/{id}/", "PUT", 200), ("/bundles", "GET", 200)]
+    assert all(e.bytes_received > 0 and e.duration > 0 and e.error is None for e in http)
+    assert http[1].bytes_sent > 0
+    assert [e.name for e in events if e.kind == 'json'] == ["/instances", "/instances/{id}/", "/bundles"]
+    summary = collector.summary()
+    assert summary.loc[("http", "/instances", "GET"), "count"] == 1
+    assert summary.loc[("http", "/bundles", "GET"), "p50"] >= summary.loc[("http", "/bundles", "GET"), "mean"]
+
+def test_retries_and_errors_are_reported(client, registry, server):
+    events = []
+    registry.register(events.append)
+    server.error_rate, server.error_codes = 1., (503,)
+    with pytest.raises(Exception):
+        client.get_instances(retries=1, retry_delay_s=0)
+    assert [(e.status, e.retries) for e in events if e.kind == 'http'] == [(503, 0), (503, 1)]
+
+def test_wait_iterations(client, registry):
+    events = []
+    registry.register(events.append)
+    client.wait_until_all(client.get_instances(), 'running', check_every_s=0, timeout=1)
+    waits = [e for e in events if e.kind == 'wait']
+    assert len(waits) == 1 and waits[0].status == 3 and waits[0].attrs == dict(iteration=0, instances=3)
+
+def test_collector_quantiles():
+    collector = HistogramCollector()
+    for duration in [.001]*90 + [1.]*10:
+        collector(CallEvent('http', '/instances', method='GET', status=200, duration=duration))
+    key = ('http', '/instances', 'GET')
+    assert collector.quantile(key, .5) < .01 < collector.quantile(key, .99)
+    assert collector.totals[key]["count"] == 100 and collector.totals[key]["errors"] == 0
+
+def test_collector_concurrent_events():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    collector = HistogramCollector()
+    def emit():
+        for i in range(2000):
+            collector(CallEvent('http', '/instances/%i/'%(i % 50), method='GET', status=200, duration=.01,
+                                bytes_received=10))
+    try:
+        threads = [threading.Thread(target=emit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(collector.totals) == 50
+    assert sum(totals["count"] for totals in collector.totals.values()) == 16000
+    assert sum(sum(counts) for counts in collector.histograms.values()) == 16000
+    assert sum(totals["bytes_received"] for totals in collector.totals.values()) == 160000
+
+def test_failing_hook_does_not_break_calls(client, registry, capsys):
+    def broken(event):
+        raise RuntimeError("broken hook")
+    registry.register(broken)
+    assert len(client.get_instances()) == 3
+    assert "broken hook" in capsys.readouterr().out
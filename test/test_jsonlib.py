@@ -0,0 +1,38 @@
+from vastai import jsonlib
+from vastai.testing import generate_offers
+import json
+import math
+import pytest
+
+@pytest.fixture(params=jsonlib.backends)
+def backend(request):
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    jsonlib.use(request.param)
+    yield request.param
+    jsonlib.use()
+
+def test_dumps_matches_stdlib(backend):
+    rows = generate_offers(50) + [{"nested": [[], {}, {"a": [1, {"b": None}]}], "s": 'quote " and\nnewline\t'}]
+    for indent in (1, 2, 4):
+        assert jsonlib.dumps(rows, indent=indent, sort_keys=True) == json.dumps(rows, indent=indent, sort_keys=True)
+    for indent in (None, 0):
+        assert jsonlib.dumps(rows, indent=indent) == json.dumps(rows, indent=indent)
+    assert jsonlib.dumps({2: "b", 1: "a"}, sort_keys=True) == '{"1": "a", "2": "b"}'
+    assert json.loads(jsonlib.dumps([2**70])) == [2**70]
+
+def test_loads(backend):
+    body = json.dumps({"offers": generate_offers(50)})
+    assert jsonlib.loads(body.encode("utf-8")) == jsonlib.loads(body) == json.loads(body)
+    assert math.isnan(jsonlib.loads(b'{"price": NaN}')["price"])
+    with pytest.raises(ValueError):
+        jsonlib.loads(b'{"offers": [')
+
+def test_use():
+    try:
+        assert jsonlib.use("json") == jsonlib.backend == "json"
+        with pytest.raises(ValueError):
+            jsonlib.use("pickle")
+    finally:
+        jsonlib.use()
+    assert jsonlib.backend in jsonlib.backends
@@ -0,0 +1,136 @@
+from vastai.api import VastClient
+from vastai.exceptions import UnhandledSetupError
+from vastai.pool import WarmPool
+from vastai.testing import LocalVastServer, generate_offers, filter_offers
+from vastai.vast import parse_query
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+import threading
+import time
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=200, pull_s=.2, start_s=.1, stop_s=.1) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def test_filter_offers():
+    offers = generate_offers(500)
+    query = parse_query("num_gpus>=4 gpu_name in [RTX_3090, A100_SXM4] reliability>0.95")
+    query["order"] = [["dph_total", "asc"]]
+    result = filter_offers(offers, query)
+    assert result and all(o["num_gpus"] >= 4 and o["gpu_name"] in ("RTX 3090", "A100 SXM4") for o in result)
+    assert [o["dph_total"] for o in result] == sorted(o["dph_total"] for o in result)
+
+def test_unauthorized(server):
+    r = requests.get(server.url + "/instances?owner=me&api_key=wrong")
+    assert r.status_code == 401
+
+def test_instance_lifecycle(server, client):
+    offers = client.search_offers(sort_order="dph_total", query="num_gpus=1")
+    assert len(offers) > 2
+    instances = client.create_instances(offers[:2] + offers[:1] + offers[2:3], 3, max_workers=1)
+    assert len(instances) == 3, "The offer that was already rented should be skipped."
+    running = client.wait_until_all(instances, 'running', check_every_s=.05, timeout=5)
+    assert all(inst.status == 'running' for inst in running)
+    latencies = client.timeline.latencies()
+    # Accepted is recorded once the response arrives, slightly after the server schedules the launch.
+    assert (latencies["start"] >= .25).all()
+    inst = running[0]
+    inst.stop()
+    assert inst.wait_until_stopped(check_every_s=.05, timeout=5).status == 'exited'
+    inst.destroy()
+    assert client.get_instance(inst.id) is None
+    assert server.requests["PUT /asks/{id}/"] == 4
+
+def test_error_injection(server, client):
+    server.error_rate = 1.
+    server.error_codes = (429,)
+    r = requests.get(client._apiurl("/instances", owner="me"))
+    assert r.status_code == 429 and r.headers["Retry-After"] == "1"
+
+def test_keep_alive_round_trip(server):
+    session = requests.Session()
+    url = server.url + "/instances?owner=me&api_key=" + server.api_key
+    session.get(url)
+    times = []
+    for _ in range(10):
+        start = time.perf_counter()
+        session.get(url)
+        times.append(time.perf_counter() - start)
+    assert sorted(times)[5] < .02, "Requests on a kept-alive connection shouldn't stall on delayed acks."
+
+def test_bid_price_needs_a_price(server, client):
+    inst_id = server.add_instances(1)[0]
+    url = client._apiurl("/instances/bid_price/%i/"%inst_id)
+    r = requests.put(url, json={})
+    assert r.status_code == 400 and not r.json()["success"]
+    assert requests.put(url, json={"price": .5}).json()["success"]
+    assert server.instances[inst_id]["dph_base"] == .5
+
+def test_warm_pool_claim(server, client):
+    pool = WarmPool(client, "num_gpus=1", size=2, check_every_s=.05, image="vastai/test").start()
+    try:
+        inst = pool.claim(timeout=10, check_every_s=.05)
+        assert inst.status == 'running' and inst.label == pool.claimed_label
+        deadline = time.time() + 5
+        while len([s for s in pool.members.values() if s == 'ready']) < 2 and time.time() < deadline:
+            time.sleep(.05)
+        assert list(pool.members.values()) == ['ready', 'ready'], "Pool should be refilled after a claim."
+        pool.refill()
+        assert not pool._claimed, "Relabeled instances shouldn't be remembered as claimed."
+        report = pool.report()
+        assert report["claims"] == 1 and report["cold_start_s"] > 0
+    finally:
+        pool.close(destroy=True)
+    assert len(client.get_instances()) == 1
+
+def test_warm_pool_destroys_failed_instances(server, client):
+    pool = WarmPool(client, "num_gpus=1", size=2, image="vastai/test")
+    deadline = time.time() + 10
+    while list(pool.members.values()) != ['ready', 'ready']:
+        assert time.time() < deadline
+        pool.refill()
+        time.sleep(.05)
+    failed, claimed = list(pool.members)
+    server.instances[failed]["status_msg"] = "Unhandled setup error: no space left on device"
+    pool.refill()
+    assert failed not in pool.members and failed not in server.instances
+    server.instances[claimed]["status_msg"] = "Unhandled setup error: no space left on device"
+    with pytest.raises(UnhandledSetupError):
+        pool.claim(timeout=5, check_every_s=.05)
+    assert claimed not in pool.members and claimed not in server.instances, "Failed claims shouldn't leak."
+    assert not pool._claimed
+    pool.close(destroy=True)
+
+def test_coalesce_get_requests(server, client):
+    server.add_instances(3)
+    server.latency_s = .3
+    threads = 8
+    barrier = threading.Barrier(threads)
+    def get_instances():
+        barrier.wait()
+        return client.get_instances()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda _: get_instances(), range(threads)))
+    assert server.requests["GET /instances"] == 1 and client.coalesced["/instances"] == threads - 1
+    assert all(len(instances) == 3 for instances in results)
+    # Errors are shared too, and different urls aren't coalesced.
+    server.error_rate, server.error_codes = 1., (500,)
+    def search(query):
+        barrier.wait()
+        try:
+            return client.search_offers(query=query)
+        except requests.HTTPError as err:
+            return err.response.status_code
+    with ThreadPoolExecutor(threads) as pool:
+        statuses = list(pool.map(search, ["num_gpus=1"]*4 + ["num_gpus=2"]*4))
+    assert statuses == [500]*threads and server.requests["GET /bundles"] == 2
+    assert client.coalesced["/bundles"] == threads - 2 and not client._in_flight
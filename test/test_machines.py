@@ -0,0 +1,80 @@
+from vastai import cache as vast_cache
+from vastai import vast
+from vastai.api import VastClient, MachineList
+from vastai.exceptions import MachineError
+from vastai.testing import LocalVastServer
+import csv
+import io
+import json
+import pytest
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=10, num_machines=12) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def test_get_machines(server, client):
+    machines = client.get_machines()
+    assert isinstance(machines, MachineList) and [m.id for m in machines] == [m["id"] for m in server.machines]
+    assert machines[0].hostname == "rig-001" and list(machines.as_df().index) == list(range(1, 13))
+    server.machines[0]["min_bid_price"] = .01
+    assert client.get_machines()[0] is machines[0] and machines[0].min_bid_price == .01, \
+        "Known machines should be updated in place."
+    assert client.get_machine(3).id == 3 and client.get_machine(99) is None
+
+def test_machine_operations(server, client):
+    machine = client.get_machine(2)
+    assert machine.unlist() is machine and not server.machines[1]["listed"] and not machine.listed
+    machine.list(price_gpu=.45)
+    assert server.machines[1]["listed"] and server.machines[1]["listed_gpu_cost"] == .45 == machine.listed_gpu_cost
+    machine.set_min_bid(.2)
+    assert server.machines[1]["min_bid_price"] == .2 == machine.min_bid_price
+    machine.set_defjob("vastai/test", price_gpu=.1, args=["--foo"])
+    assert server.machines[1]["defjob"] == dict(image="vastai/test", args=["--foo"], price_gpu=.1)
+    machine.remove_defjob()
+    assert server.machines[1]["defjob"] is None
+    server.machines.pop(1)
+    with pytest.raises(MachineError):
+        machine.unlist()
+
+def test_bulk_operations(server, client):
+    machines = client.get_machines()
+    server.machines.pop()
+    result = machines.list(price_gpu={m.id: .1*m.id for m in machines}, max_workers=4)
+    assert result.succeeded == [m.id for m in machines[:-1]] and list(result.failed) == [12]
+    assert isinstance(result.failed[12], MachineError)
+    assert [m["listed_gpu_cost"] for m in server.machines] == [.1*i for i in range(1, 12)]
+    assert server.requests["PUT /machines/create_asks/"] == 12
+    result = MachineList(machines[:-1]).set_min_bid(lambda m: m.listed_gpu_cost/2)
+    assert not result.failed and [m["min_bid_price"] for m in server.machines] == [.05*i for i in range(1, 12)]
+    assert MachineList(machines[:3]).unlist().succeeded == [1, 2, 3]
+    assert [m["listed"] for m in server.machines[:4]] == [False, False, False, True]
+    assert MachineList().unlist() == ([], {})
+
+def test_show_machines_formats(server, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(vast_cache, "default_cache_path", str(tmp_path/"state.sqlite"))
+    server.machines[0]["defjob"] = {"image": "vastai/test"}
+    args = ["--url", server.url, "--api-key", server.api_key]
+    assert vast.run(["show", "machines"] + args) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 13 and lines[0].split()[:4] == ["ID", "Hostname", "Num", "Model"]
+    assert lines[1].startswith("1  ") and "rig-001" in lines[1]
+    assert vast.run(["show", "machines", "--format", "ndjson"] + args) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == server.machines
+    assert vast.run(["show", "machines", "--format", "csv", "--fields", "id,hostname,defjob"] + args) == 0
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert rows[0] == ["id", "hostname", "defjob"] and rows[1] == ["1", "rig-001", '{"image": "vastai/test"}']
+    assert rows[2] == ["2", "rig-002", ""] and len(rows) == 13
+    assert vast.run(["show", "machines", "--fields", "id,earn_day,defjob"] + args) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ["ID", "$/day", "defjob"] and lines[2].rstrip().endswith("-")
+    assert vast.run(["show", "machines", "-q"] + args) == 0
+    assert capsys.readouterr().out.split() == [str(i) for i in range(1, 13)]
@@ -0,0 +1,47 @@
+from vastai.vast import parse_query, parse_order
+import pytest
+
+def test_parse_operators_and_aliases():
+    res = parse_query("reliability > 0.99  num_gpus>=4 dph<0.5 cuda_vers gte 10.1")
+    assert res == {"reliability2": {"gt": "0.99"}, "num_gpus": {"gte": "4"}, 
+                   "dph_total": {"lt": "0.5"}, "cuda_max_good": {"gte": "10.1"}}
+    assert "reliability" not in res, "Aliased field names shouldn't be sent to the server."
+
+def test_parse_list_values_and_multipliers():
+    res = parse_query(["gpu_name in [RTX_2080, GTX_1080]", "cpu_ram>=16"])
+    assert res == {"gpu_name": {"in": ["RTX_2080", "GTX_1080"]}, "cpu_ram": {"gte": "16000.0"}}
+
+def test_parse_wildcard_removes_default():
+    default = {"verified": {"eq": True}, "rentable": {"eq": True}}
+    res = parse_query("rentable = any", default)
+    assert res is default
+    assert res == {"verified": {"eq": True}}
+
+def test_cached_results_are_independent():
+    parse_query.cache_clear()
+    first = parse_query("gpu_name in [A, B] num_gpus=2")
+    first["gpu_name"]["in"].append("C")
+    first["num_gpus"]["eq"] = "8"
+    second = parse_query("gpu_name in [A, B] num_gpus=2")
+    assert second == {"gpu_name": {"in": ["A", "B"]}, "num_gpus": {"eq": "2"}}
+    assert parse_query.cache_info().hits == 1
+
+def test_unrecognized_field_warns_every_time(capsys):
+    for _ in range(2):
+        assert parse_query("colour=red num_gpus=2") == {"colour": {"eq": "red"}, "num_gpus": {"eq": "2"}}
+        assert capsys.readouterr().err.count("Unrecognized field: colour") == 1
+
+@pytest.mark.parametrize("query_str, offset", [
+    ("num_gpus>=4 >", 12),
+    ("num_gpus", 8),
+    ("num_gpus>any", 9),
+    ("cpu_ram>lots", 8),
+])
+def test_errors_point_to_offset(query_str, offset):
+    with pytest.raises(ValueError) as err:
+        parse_query(query_str)
+    assert "(at offset %i)"%offset in str(err.value)
+    assert str(err.value).endswith("\n    " + " "*offset + "^")
+
+def test_parse_order():
+    assert parse_order("num_gpus, dph-,") == [["num_gpus", "asc"], ["dph_total", "desc"]]
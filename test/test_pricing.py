@@ -0,0 +1,68 @@
+from vastai.api import VastClient, Machine
+from vastai.pricing import PricingAutopilot, PricingStrategy, market_prices
+from vastai.testing import LocalVastServer, generate_offers
+import numpy as np
+import pytest
+
+def make_offers(specs):
+    """ Offers of `(gpu_name, num_gpus, $/gpu/hr, reliability2)`, on machines 100 and up. """
+    offers = generate_offers(len(specs))
+    for i, (offer, (name, num_gpus, price, reliability)) in enumerate(zip(offers, specs)):
+        offer.update(gpu_name=name, num_gpus=num_gpus, dph_base=price*num_gpus, reliability2=reliability,
+                     machine_id=100 + i)
+    return offers
+
+market = make_offers([("RTX 3090", 1, p, .99) for p in (.20, .22, .24, .26)] +
+                     [("RTX 3090", 1, p, .90) for p in (.10, .12, .14)] +
+                     [("RTX 3090", 4, p, .99) for p in (.30, .34, .38)] +
+                     [("A100 SXM4", 1, p, .99) for p in (1., 1.1)])
+
+@pytest.fixture
+def server():
+    with LocalVastServer(offers=market, num_machines=4) as server:
+        for machine, (name, num_gpus, reliability, price) in zip(server.machines, [
+                ("RTX 3090", 1, .99, .30), ("RTX 3090", 1, .91, .11), ("RTX 3090", 4, .95, .36), ("A100 SXM4", 1, .99, 1.)]):
+            machine.update(gpu_name=name, num_gpus=num_gpus, reliability2=reliability, listed=True,
+                           listed_gpu_cost=price, listed_storage_cost=.2)
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def test_market_prices():
+    machines = [Machine(None, id=1, gpu_name="RTX 3090", num_gpus=1, reliability2=.99),
+                Machine(None, id=2, gpu_name="RTX 3090", num_gpus=1, reliability2=.91),
+                Machine(None, id=3, gpu_name="RTX 3090", num_gpus=4, reliability2=.5),
+                Machine(None, id=4, gpu_name="A100 SXM4", num_gpus=1, reliability2=.99),
+                Machine(None, id=99, gpu_name="H100", num_gpus=1, reliability2=.99)]
+    prices, competitors = market_prices(machines, market)
+    assert np.allclose(prices[:3], [.23, .12, .34]) and competitors.tolist() == [4, 3, 3, 0, 0]
+    assert np.isnan(prices[3:]).all(), "Too few competitors to price against."
+    prices, _ = market_prices(machines[:1], market, percentile=100, reliability_band=1)
+    assert prices[0] == .26
+    own = [Machine(None, id=100, gpu_name="RTX 3090", num_gpus=1, reliability2=.99)]
+    assert market_prices(own, market)[0][0] == .24, "Offers on our own machines aren't competition."
+
+def test_strategy():
+    strategy = PricingStrategy(undercut=.1, min_price={"RTX 3090": .25}, max_price=2)
+    assert strategy.target(.3, "RTX 3090") == .27
+    assert strategy.target(.2, "RTX 3090") == .25 and strategy.target(.2, "A100") == .18
+    assert strategy.target(3.) == 2
+
+def test_autopilot(server, client):
+    autopilot = PricingAutopilot(client, PricingStrategy(hysteresis=.01), dry_run=True)
+    planned = autopilot.check()
+    assert [(c.machine_id, c.old, c.new, c.competitors) for c in planned] == [(1, .30, .23, 4), (3, .36, .34, 3)], \
+        "Machine 2 is within hysteresis of its target, and machine 4 has too few competitors."
+    assert server.requests["PUT /machines/create_asks/"] == 0 and len(autopilot.changes) == 2
+    autopilot.dry_run = False
+    changes = autopilot.check()
+    assert [c.machine_id for c in changes] == [c.machine_id for c in planned]
+    assert server.requests["GET /machines"] == 2 and server.requests["GET /bundles"] == 2
+    assert server.requests["PUT /machines/create_asks/"] == 2
+    assert server.machines[0]["listed_gpu_cost"] == .23 and server.machines[0]["listed_storage_cost"] == .2
+    assert autopilot.check() == [], "Prices already at target shouldn't be changed again."
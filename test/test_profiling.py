@@ -0,0 +1,61 @@
+from vastai import jsonlib
+from vastai.profiling import CliProfiler
+from vastai.testing import LocalVastServer
+import io
+import os
+import pstats
+import requests
+import socket
+import subprocess
+import sys
+
+src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+def test_request_phases(tmp_path):
+    getaddrinfo, send = socket.getaddrinfo, requests.Session.send
+    with LocalVastServer(num_offers=50) as server:
+        profiler = CliProfiler(base_url=server.url, cprofile_path=str(tmp_path/"cli.prof"),
+                               stacks_path=str(tmp_path/"cli.stacks"))
+        profiler.add_phase("imports", .01)
+        profiler.start()
+        for _ in range(20):
+            offers = requests.get(server.url + "/bundles?api_key=%s"%server.api_key).json()["offers"]
+        profiler.stop()
+    assert len(offers) == 50
+    assert socket.getaddrinfo is getaddrinfo and requests.Session.send is send, "Wrappers should be removed."
+    assert len(profiler.requests) == 20
+    first = profiler.requests[0]
+    assert first["endpoint"] == "/bundles" and first["status"] == 200 and first["bytes"] > 0
+    assert first["connect"] > 0 and first["total"] >= first["dns"] + first["connect"] + first["transfer"] - 1e-9
+    assert profiler.json_s > 0 and profiler.command_s >= sum(r["total"] for r in profiler.requests)
+    assert pstats.Stats(str(tmp_path/"cli.prof")).total_calls > 0
+    with open(str(tmp_path/"cli.stacks")) as f:
+        stack, count = f.readline().rsplit(" ", 1)
+    assert "test_profiling.py:test_request_phases" in stack and int(count) > 0
+    out = io.StringIO()
+    profiler.report(out)
+    assert "GET    /bundles" in out.getvalue() and "api_key" not in out.getvalue()
+
+def test_jsonlib_decode_is_timed():
+    loads = jsonlib.loads
+    with LocalVastServer(num_offers=500) as server:
+        body = requests.get(server.url + "/bundles?api_key=%s"%server.api_key).content
+    profiler = CliProfiler()
+    profiler.start()
+    assert len(jsonlib.loads(body)["offers"]) == 500
+    profiler.stop()
+    assert jsonlib.loads is loads, "The wrapper should be removed."
+    assert profiler.json_s > 0
+
+def test_cli_profile_option():
+    with LocalVastServer(num_offers=10) as server:
+        server.add_instances(3)
+        proc = subprocess.run([sys.executable, os.path.join(src_dir, "vastai", "vast.py"), "show", "instances",
+                               "--url", server.url, "--api-key", server.api_key, "--raw", "--profile"],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                              env=dict(os.environ, PYTHONPATH=src_dir))
+    assert proc.returncode == 0
+    assert proc.stdout.lstrip().startswith("["), "Raw output shouldn't be mixed with the profile."
+    for phase in ("imports", "parser setup", "argument parsing", "http requests", "json decode", "formatting/output"):
+        assert phase in proc.stderr
+    assert "/instances" in proc.stderr
@@ -0,0 +1,42 @@
+from vastai import selection
+from vastai.api import OfferList
+import numpy as np
+import pytest
+
+def random_offers(n, seed=0):
+    rnd = np.random.RandomState(seed)
+    return [dict(id=i, dph_total=float(rnd.randint(1, 20))/10, dlperf=float(rnd.randint(1, 20)), 
+                 total_flops=float(rnd.randint(1, 20)), reliability2=1.0, inet_down=100.0, gpu_ram=8192)
+            for i in range(n)]
+
+def brute_force_front(offers, objectives):
+    costs = selection._cost_matrix(offers, selection.parse_objectives(objectives))
+    front = []
+    for i, a in enumerate(costs):
+        dominated = any((b <= a).all() and ((b < a).any() or j < i) for j, b in enumerate(costs) if j != i)
+        if not dominated:
+            front.append(i)
+    return front
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pareto_front_matches_brute_force(seed):
+    offers = random_offers(200, seed)
+    front = selection.pareto_front(offers, "dph,dlperf-,total_flops-")
+    assert list(front) == brute_force_front(offers, "dph,dlperf-,total_flops-")
+
+def test_pareto_missing_values_are_worst():
+    offers = [dict(id=1, dph_total=0.1, dlperf=None), dict(id=2, dph_total=0.1, dlperf=1.0)]
+    assert list(selection.pareto_front(offers, "dph_total,dlperf-")) == [1]
+
+def test_top_k_orders_by_weighted_score():
+    offers = OfferList([dict(id=1, dph_total=1.0, dlperf=10.0), dict(id=2, dph_total=0.5, dlperf=10.0),
+                        dict(id=3, dph_total=0.5, dlperf=20.0), dict(id=4, dph_total=2.0, dlperf=None)])
+    best = offers.top_k(2, weights="dph=-1,dlperf=1")
+    assert type(best) is OfferList
+    assert [o['id'] for o in best] == [3, 2]
+    assert [o['id'] for o in offers.select(pareto="dph,dlperf-")] == [3]
+
+def test_parse_weights():
+    assert selection.parse_weights("dph=-2, reliability=1") == {"dph_total": -2.0, "reliability2": 1.0}
+    with pytest.raises(ValueError):
+        selection.parse_weights("dph")
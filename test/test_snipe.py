@@ -0,0 +1,60 @@
+from vastai.api import VastClient
+from vastai.snipe import OfferSniper, compile_predicate
+from vastai.testing import LocalVastServer, generate_offers, filter_offers
+from vastai.vast import parse_query
+import pytest
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=100) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key + "%" # Quoted into the url as %25.
+    server.api_key = client.api_key
+    return client
+
+def test_compile_predicate():
+    offers = generate_offers(500)
+    for query in ("num_gpus>=4 gpu_name in [RTX_3090, A100_SXM4] reliability>0.95", "verified=true dph<1",
+                  "gpu_name=RTX_3090 num_gpus!=2", ""):
+        predicate = compile_predicate(query)
+        expected = filter_offers(offers, parse_query(query))
+        assert [o["id"] for o in offers if predicate(o)] == [o["id"] for o in expected], query
+    with pytest.raises(ValueError):
+        compile_predicate("num_gpus>=")
+
+def test_snipe(server, client):
+    rare = "num_gpus>=8 gpu_name=H100_SXM"
+    sniper = OfferSniper(client, rare, max_price=20., count=2, interval_s=0, image="vastai/test", label="sniped")
+    assert sniper.run(iterations=3) == [] and sniper.polls == 3
+    offers = generate_offers(3, start_id=5000)
+    for offer in offers:
+        offer.update(num_gpus=8, gpu_name="H100 SXM", dph_total=offer["dph_total"] % 19)
+    server.offers.extend(offers)
+    contracts = sniper.run(iterations=5)
+    assert len(contracts) == 2 and sniper.polls == 4
+    assert [ok for _, _, ok in sniper.latencies] == [True, True]
+    assert all(0 < latency < 5 for _, latency, _ in sniper.latencies)
+    assert {server.instances[c]["label"] for c in contracts} == {"sniped"}
+    assert server.requests["GET /bundles"] == 4 and server.requests["PUT /asks/{id}/"] == 2
+    assert sniper.rent(sniper.latencies[0][0]) is None, "Offers taken by someone else should be skipped."
+
+def test_snipe_price_cap_and_retries(server, client, capsys):
+    sniper = OfferSniper(client, "dph_total<=5 num_gpus>=8 gpu_name=H100_SXM", max_price=12., interval_s=0)
+    assert not sniper.predicate({"dph_total": 6., "num_gpus": 8, "gpu_name": "H100 SXM"}), \
+        "The query's lower price cap should be kept."
+    offers = generate_offers(1, start_id=5000)
+    offers[0].update(num_gpus=8, gpu_name="H100 SXM", dph_total=1.)
+    server.offers.extend(offers)
+    server.error_rate, server.error_codes = 1., (503,)
+    assert sniper.rent(5000) is None and 5000 not in sniper.tried, "Transient errors should be retried."
+    assert sniper.run(iterations=2) == []
+    assert [(offer_id, err.response.status_code) for _, offer_id, err in sniper.errors] == \
+        [(5000, 503), (None, 503), (None, 503)]
+    server.error_rate = 0.
+    assert len(sniper.run(iterations=1)) == 1 and 5000 in sniper.tried
+    assert capsys.readouterr().out == "", "The sniper should leave printing to the caller."
@@ -0,0 +1,116 @@
+from vastai.api import VastClient
+from vastai.telemetry import TelemetryCollector, TelemetryStore, RingBuffer, parse_sample, metrics
+from vastai.testing import LocalVastServer
+import numpy as np
+import pytest
+import socket
+import time
+
+@pytest.fixture
+def server():
+    with LocalVastServer(num_offers=20) as server:
+        yield server
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.delenv('VAST_API_KEY', raising=False)
+    client = VastClient(api_key_file=None, api_url=server.url)
+    client.api_key = server.api_key
+    return client
+
+def sample_line(t, busy, total, gpu_util=50):
+    return ("S|%.3f|%i, 4000, 8000, 60;%i, 2000, 8000, 70;|cpu %i 0 0 %i 0 0 0|1000 250|30 120\n"
+            %(t, gpu_util, gpu_util, busy, total - busy))
+
+def test_parse_sample():
+    t, values, cpu = parse_sample(sample_line(100., 50, 100))
+    assert t == 100. and cpu == (50., 100.)
+    assert np.isnan(values[metrics.index("cpu_util")]), "CPU utilization needs a previous sample."
+    t, values, cpu = parse_sample(sample_line(101., 80, 200), cpu)
+    assert dict(zip(metrics, values.tolist())) == {"gpu_util": 50., "gpu_mem_util": 37.5, "gpu_temp": 70.,
+                                                   "cpu_util": 30., "ram_util": 75., "disk_util": 25.}
+    _, values, _ = parse_sample("S|1.0||cpu 1 0 0 1|1000 500|1 2")
+    assert np.isnan(values[:3]).all() and values[4] == 50.
+    with pytest.raises(ValueError):
+        parse_sample("Welcome to vast.ai")
+
+def test_ring_buffer():
+    buf = RingBuffer(4, 1)
+    for i in range(6):
+        buf.append(float(i), [i*10.])
+    times, rows = buf.values()
+    assert times.tolist() == [2., 3., 4., 5.] and rows[:, 0].tolist() == [20., 30., 40., 50.]
+    assert buf.values(since=4)[0].tolist() == [4., 5.]
+
+def test_store_downsamples():
+    store = TelemetryStore(raw_capacity=10, bucket_s=10)
+    now = 1000.
+    for i in range(100):
+        store.add(1, now + i, np.array([float(i % 10), np.nan, 1, 1, 1, 1]))
+    assert len(store.history(1)) == 10 and len(store.history(1, downsampled=True)) == 9
+    assert store.history(1, downsampled=True)["gpu_util"].tolist() == [4.5]*9
+    assert store.latest(1)["gpu_util"] == 9. and store.latest(2) is None
+    assert store.percentiles(1, q=(50,), now=now + 100)["gpu_util"] == [4.5]
+    assert store.percentiles(1, q=(0, 100), window_s=60, now=now + 100)["gpu_util"] == [4.5, 4.5], \
+        "Windows longer than the raw samples cover should use the downsampled values."
+    summary = store.summary(q=(50, 90))
+    assert list(summary.index) == [1] and "gpu_util_p90" in summary and np.isnan(summary["gpu_mem_util_p50"][1])
+
+def test_collector(server, client):
+    ids = server.add_instances(3)
+    server.add_instances(1, status="exited")
+    client.get_instances()
+    peers = {}
+    def connect(inst, interval_s):
+        if inst.id == ids[2]:
+            raise OSError("Connection refused")
+        ours, theirs = socket.socketpair()
+        peers[inst.id] = theirs
+        return ours
+    collector = TelemetryCollector(client, interval_s=1, connect=connect).start()
+    try:
+        deadline = time.time() + 5
+        while len(peers) < 2 or ids[2] not in collector.errors:
+            assert time.time() < deadline
+            time.sleep(.01)
+        now = time.time()
+        for inst_id, peer in peers.items():
+            peer.sendall(b"Welcome\n" + sample_line(now, 50, 100).encode())
+            peer.sendall(sample_line(now + 1, 100, 200, gpu_util=inst_id % 100)[:20].encode())
+            peer.sendall(sample_line(now + 1, 100, 200, gpu_util=inst_id % 100)[20:].encode())
+        while collector.samples < 4:
+            assert time.time() < deadline
+            time.sleep(.01)
+        assert sorted(collector.store.instances()) == ids[:2]
+        assert collector.store.latest(ids[0])["gpu_util"] == ids[0] % 100
+        assert collector.store.latest(ids[0])["cpu_util"] == 50.
+        # Instances that stop running are dropped on the next refresh.
+        server.instances[ids[0]]["actual_status"] = "exited"
+        client.refresh_instances()
+        while ids[0] in collector._streams:
+            assert time.time() < deadline
+            time.sleep(.01)
+        assert peers[ids[0]].recv(10) == b"", "The channel should have been closed."
+    finally:
+        collector.close()
+    assert not collector._streams and client.refresh_listeners == []
+    assert peers[ids[1]].recv(10) == b""
+
+def test_store_peaks():
+    store = TelemetryStore(raw_capacity=10, bucket_s=10)
+    for i in range(30):
+        store.add(1, 1000. + i, np.array([90. if i == 5 else 1., np.nan, 1, 1, 1, 1]))
+    assert store.peaks(1, 60, now=1030.) is None, "Samples don't go back a minute."
+    assert store.peaks(1, 30, now=1030.)["gpu_util"] == 9.9, "Older samples are only kept as averages."
+    peaks = store.peaks(1, 10, now=1030.)
+    assert peaks["gpu_util"] == 1. and np.isnan(peaks["gpu_mem_util"])
+    assert store.peaks(2, 10) is None
+
+def test_store_peaks_include_raw_samples():
+    store = TelemetryStore(raw_capacity=900, bucket_s=60)
+    now = 3600.
+    for t in range(3600):
+        store.add(1, float(t), np.array([100. if t >= 3560 else 0., np.nan, 1, 1, 1, 1]))
+        store.add(2, float(t), np.array([0., np.nan, 1, 1, 1, 1]))
+    assert store.peaks(1, 1800, now=now)["gpu_util"] == 100., "The spike is only in the raw samples."
+    assert store.peaks(2, 1800, now=now)["gpu_util"] == 0.
@@ -0,0 +1,34 @@
+from vastai.timeline import LaunchTimeline
+from collections import namedtuple
+
+Inst = namedtuple("Inst", "id actual_status status_msg gpu_name host_id image_uuid")
+
+def launch(timeline, contract, gpu_name, t0, pull_s, start_s):
+    timeline.record(contract, "requested", t0)
+    timeline.record(contract, "accepted", t0+1)
+    for dt, status, msg in [(2, None, None), (3, "loading", "Pulling fs layer"), (3+pull_s, "loading", "Successfully loaded img"),
+                            (3+pull_s, "loading", "Successfully loaded img"), (3+pull_s+start_s, "running", "Successfully loaded img")]:
+        timeline.observe(Inst(contract, status, msg, gpu_name, 7, "img"), t0+dt)
+    timeline.mark_ssh(contract, t0+3+pull_s+start_s+2)
+
+def test_stage_latencies():
+    timeline = LaunchTimeline()
+    launch(timeline, 1, "RTX 3090", 100., pull_s=30, start_s=5)
+    launch(timeline, 2, "A100", 100., pull_s=60, start_s=10)
+    timeline.observe(Inst(3, "running", None, "A100", 7, "img"), 100.)
+    assert 3 not in timeline, "Instances that weren't launched by the client aren't tracked."
+    assert len(timeline.events[1]) == 4, "Repeated statuses are only recorded once."
+    df = timeline.latencies()
+    assert df.loc[1, "api"] == 1 and df.loc[1, "queue"] == 2
+    assert df.loc[1, "image_pull"] == 30 and df.loc[1, "container_start"] == 5
+    assert df.loc[2, "start"] == 72 and df.loc[2, "ssh"] == 2 and df.loc[2, "total"] == 75
+
+def test_summary_and_histogram():
+    timeline = LaunchTimeline()
+    for contract in range(6):
+        launch(timeline, contract, "A100" if contract%2 else "RTX 3090", 0., pull_s=10*contract, start_s=1)
+    summary = timeline.summary(by="gpu_name", stage="image_pull")
+    assert list(summary.index) == ["RTX 3090", "A100"], "Fastest group first."
+    assert summary.loc["A100", "count"] == 3
+    hist = timeline.histogram(by="gpu_name", stage="image_pull", bins=[0, 25, 60])
+    assert hist.loc["RTX 3090"].tolist() == [2, 1] and hist.loc["A100"].tolist() == [1, 2]
@@ -164,3 +164,42 @@ def test_instance_create(vast_client, requests_mock, instance, fs):
 
 
 
+
+
+def test_lazy_subparsers():
+    parser = vast.apwrap()
+    calls = []
+
+    @parser.command(vast.argument("id", type=int), vast.argument("--price", type=float), epilog="""
+        Example:
+            vast change bid 12 --price 0.3
+    """)
+    def change__bid(args):
+        calls.append(args)
+
+    @parser.command(vast.argument("id", type=int), aliases=["kill instance"])
+    def destroy__instance(args):
+        calls.append(args)
+
+    parser.add_argument("--raw", action="store_true")
+    args = parser.parse_args(["change", "bid", "12", "--price", "0.3", "--raw"])
+    assert args.func is change__bid and args.id == 12 and args.price == .3 and args.raw
+    assert list(parser.parsers) == ["change bid"], "Only the selected command's parser should be built."
+    assert parser.parse_args(["kill", "instance", "7"]).func is destroy__instance
+    help_text = parser.build_parser().format_help()
+    assert "change bid" in help_text and "destroy instance" in help_text
+    assert "\nExample:\n    vast change bid" in parser.parsers["change bid"]._subparsers._group_actions[0]\
+        .choices["change bid"].format_help(), "Epilogs should be deindented when built."
+
+def test_installed_script():
+    import subprocess
+    from vastai.testing import LocalVastServer
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with LocalVastServer(num_offers=10) as server:
+        server.add_instances(2)
+        proc = subprocess.run([sys.executable, os.path.join(root_dir, "vast.py"), "show", "instances", "--no-daemon",
+                               "--url", server.url, "--api-key", server.api_key, "--raw"],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                              env=dict(os.environ, PYTHONPATH=os.path.join(root_dir, "src")))
+    assert proc.returncode == 0, proc.stderr
+    assert len(json.loads(proc.stdout)) == 2
@@ -0,0 +1,85 @@
+from vastai.vast import instance_fields
+from vastai.watch import TableView, watch, bold_yellow, green
+from vastai import jsonlib
+from vastai.testing import LocalVastServer
+import io
+import json
+import requests
+
+def instances(n, **changes):
+    rows = [dict(id=i, machine_id=100+i, actual_status="running", num_gpus=1, gpu_name="RTX 3090",
+                 gpu_util=50., dph_total=.5) for i in range(n)]
+    for i, fields in changes.items():
+        rows[int(i)].update(fields)
+    return rows
+
+def test_only_changed_lines_are_redrawn():
+    out = io.StringIO()
+    view = TableView(instance_fields, out=out, ansi=True, max_lines=1000, clock=lambda: 0.)
+    assert view.update(instances(300), "status") == 302, "First update draws the whole table and status line."
+    assert view.update(instances(300), "status") == 0
+    out.seek(0)
+    out.truncate()
+    assert view.update(instances(300, **{"7": dict(actual_status="exited"), "9": dict(gpu_util=90.)}), "status") == 2
+    assert bold_yellow + "exited" in out.getvalue() and green + "90.0" in out.getvalue()
+    assert out.getvalue().count("\x1b[") == 2*2 + 2*2, "A cursor move and line clear per changed line, "\
+                                                        "and a color and reset per changed cell."
+    assert view.update(instances(299), "status") == 301, "Removing a row redraws everything."
+
+def test_plain_output_and_truncation():
+    out = io.StringIO()
+    view = TableView(instance_fields, out=out, ansi=False, max_lines=5)
+    view.update(instances(20))
+    assert "\x1b" not in out.getvalue() and "(showing 5 of 20)" in out.getvalue()
+    assert view.update(instances(20)) == 0
+
+def test_watch_backs_off_while_unchanged():
+    bodies = [json.dumps({"instances": instances(3)})]*4 + [json.dumps({"instances": instances(4)})]
+    delays = []
+    view = TableView(instance_fields, out=io.StringIO(), ansi=True, max_lines=100)
+    watch(lambda: bodies.pop(0).encode(), view, interval_s=2, max_interval_s=5, iterations=5, sleep=delays.append)
+    assert delays == [2, 3, 4.5, 5]
+    assert len(view.rows) == 4
+
+def test_watch_retries_invalid_responses():
+    bodies = [json.dumps({"instances": instances(3)}), "<html>502 Bad Gateway</html>",
+              json.dumps({"instances": instances(4)})]
+    delays, statuses = [], []
+    view = TableView(instance_fields, out=io.StringIO(), ansi=True, max_lines=100)
+    update = view.update
+    view.update = lambda rows, status: (statuses.append(status), update(rows, status))
+    watch(lambda: bodies.pop(0).encode(), view, interval_s=2, iterations=3, sleep=delays.append)
+    assert delays == [2, 3]
+    assert statuses[1].startswith("Request failed: invalid response") and len(view.rows) == 4
+
+def test_watch_backs_off_against_server(monkeypatch):
+    with LocalVastServer(num_offers=10) as server:
+        ids = server.add_instances(3)
+        session = requests.Session()
+        url = server.url + "/instances?owner=me&api_key=" + server.api_key
+        def fetch():
+            r = session.get(url)
+            r.raise_for_status()
+            return r.content
+        delays, decoded = [], []
+        monkeypatch.setattr(jsonlib, "loads", lambda data, _loads=jsonlib.loads: decoded.append(data) or _loads(data))
+        def sleep(delay):
+            delays.append(delay)
+            if len(delays) == 3:
+                server.instances[ids[0]]["gpu_util"] = 90.
+        view = TableView(instance_fields, out=io.StringIO(), ansi=True, max_lines=100)
+        watch(fetch, view, interval_s=1, max_interval_s=10, iterations=5, sleep=sleep)
+    assert delays == [1, 1.5, 2.25, 1], "Only the gpu_util change should reset the interval."
+    assert len(decoded) == 2 and view.rows[ids[0]][0]["gpu_util"] == 90.
+
+def test_volatile_fields_dont_reformat_rows():
+    from vastai.vast import format_row, justify_row
+    formatted = []
+    view = TableView(instance_fields, lambda row, fields: formatted.append(row["id"]) or format_row(row, fields),
+                     justify_row, out=io.StringIO(), ansi=True, max_lines=100)
+    view.update(instances(3, **{str(i): dict(duration=100.) for i in range(3)}))
+    view.update(instances(3, **{str(i): dict(duration=99.) for i in range(3)}))
+    rows = instances(3, **{str(i): dict(duration=98.) for i in range(3)})
+    rows[1]["gpu_util"] = 70.
+    view.update(rows)
+    assert formatted == [0, 1, 2, 1]
@@ -2,9 +2,12 @@ from vastai.api import VastClient, api_base_url, default_api_key_file
 from vastai.exceptions import Unauthorized
 from . import stubs 
 import pytest
+import requests
 import requests_mock
 from requests_mock.exceptions import NoMockAddress
 import os
+import json
+import time
 
 test_api_key = "asupersecretapikey"
 
@@ -161,6 +164,45 @@ def test_destroy_instance(requests_mock, instance):
     #log_request(requests_mock.last_request)
     assert requests_mock.last_request.method == 'DELETE'
 
+def test_create_instances_falls_back_to_next_offer(requests_mock, authorized_client):
+    ask_url = api_base_url+"/asks/%i/?api_key="+test_api_key
+    requests_mock.put(ask_url%1, json={"success": True, "new_contract": 384792})
+    requests_mock.put(ask_url%2, status_code=400, json={"success": False, "msg": "offer taken"})
+    requests_mock.put(ask_url%3, json={"success": False, "msg": "offer taken"})
+    requests_mock.put(ask_url%4, json={"success": True, "new_contract": 384793})
+    requests_mock.put(ask_url%5, json={"success": True, "new_contract": 999999})
+    requests_mock.get(api_base_url+"/instances?api_key=%s"%test_api_key, json=stubs.instances_json)
+    offers = [dict(id=1), dict(id=2), dict(id=3), dict(id=4), dict(id=5)]
+    instances = authorized_client.create_instances(offers, 2, max_workers=2, image="vastai/test", disk=5)
+    assert list(instances.keys()) in ([384792, 384793], [384793, 384792])
+    assert all(inst is authorized_client.get_instance(contract) for contract, inst in instances.items())
+    asked = [r for r in requests_mock.request_history if '/asks/' in r.url]
+    assert len(asked) == 4, "Should stop asking once enough instances were created."
+    assert all(r.json()['image'] == "vastai/test" for r in asked)
+
+def test_create_instances_returns_contracts_on_auth_error(requests_mock, authorized_client):
+    ask_url = api_base_url+"/asks/%i/?api_key="+test_api_key
+    requests_mock.put(ask_url%1, json={"success": True, "new_contract": 384792})
+    requests_mock.put(ask_url%2, exc=requests.exceptions.ConnectionError)
+    requests_mock.put(ask_url%3, status_code=401, json={"msg": "bad key"})
+    requests_mock.put(ask_url%4, json={"success": True, "new_contract": 384793})
+    with pytest.raises(Unauthorized) as err:
+        authorized_client.create_instances([1, 2, 3, 4], 3, max_workers=1)
+    assert list(err.value.contracts) == [384792], "Instances rented before the error should be returned."
+    assert not any('/asks/4/' in r.url for r in requests_mock.request_history), "Should stop after a 401."
+
+def test_wait_until_all(requests_mock, authorized_client, monkeypatch):
+    running = json.loads(json.dumps(stubs.instances_json))
+    for inst in running['instances']:
+        inst['actual_status'] = 'running'
+    requests_mock.get(api_base_url+"/instances?api_key=%s"%test_api_key, 
+                      [{'json': stubs.instances_json}, {'json': running}])
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    instances = authorized_client.get_instances()
+    result = authorized_client.wait_until_all(instances, 'running', check_every_s=0)
+    assert [inst.status for inst in result] == ['running', 'running']
+    assert requests_mock.call_count == 3, "Should make one request per check, not per instance."
+
 #def test_instance_repr(instance):
 #    assert instance.__repr__().strip() == stubs.instance_repr.strip()
 